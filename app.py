@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
@@ -7,12 +7,24 @@ from pathlib import Path
 import re
 import uuid
 import logging
+import threading
+import time
+from functools import partial
 import smbprotocol
 from smbprotocol.connection import Connection
 from smbprotocol.session import Session
 from smbprotocol.tree import TreeConnect
-from smbprotocol.open import Open, CreateDisposition
 from smbprotocol.exceptions import SMBException
+import batch_columns
+from batch_archive import PartitionedBatchStore
+from batch_import import detect_format, import_batches, parse_batches
+from batch_store import open_batch_store
+from smb_pool import get_pool
+from preview_cache import PreviewCache, PreviewPrefetcher
+from reconcile import ReconcileIndex, match_quality
+from reconcile_view import ReconcileView
+from smb_scanner import SMBBackend, get_scanner
+from smb_sources import MultiSourceScanner, parse_sources, source_file
 
 # Configure logging
 logging.basicConfig(
@@ -45,12 +57,66 @@ app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-pr
 # Configuración from environment variables
 USERS_FILE = os.environ.get('USERS_FILE', 'users.json')
 BATCHES_FILE = os.environ.get('BATCHES_FILE', 'batches.json')
+# Batch storage: "sqlite" (BATCHES_DB) or "journal" (append-only BATCHES_JOURNAL
+# folded into BATCHES_SNAPSHOT every BATCHES_COMPACT_INTERVAL seconds).
+# batches.json is migrated into it once.
+BATCH_STORE = os.environ.get('BATCH_STORE', 'sqlite')
+BATCHES_DB = os.environ.get('BATCHES_DB', 'batches.db')
+BATCHES_JOURNAL = os.environ.get('BATCHES_JOURNAL', 'batches.journal.jsonl')
+BATCHES_SNAPSHOT = os.environ.get('BATCHES_SNAPSHOT', 'batches.snapshot.json')
+BATCHES_COMPACT_INTERVAL = int(os.environ.get('BATCHES_COMPACT_INTERVAL', 300))
+# Batches of closed months (older than BATCHES_HOT_MONTHS, not pending) are moved
+# to one compressed file per month in BATCHES_ARCHIVE_DIR (0 disables archiving)
+BATCHES_ARCHIVE_DIR = os.environ.get('BATCHES_ARCHIVE_DIR', 'batches_archive')
+BATCHES_HOT_MONTHS = int(os.environ.get('BATCHES_HOT_MONTHS', 2))
+BATCHES_ARCHIVE_INTERVAL = int(os.environ.get('BATCHES_ARCHIVE_INTERVAL', 3600))
 SMB_SERVER = os.environ.get('SMB_SERVER', '172.16.11.104')
 SMB_SHARE = os.environ.get('SMB_SHARE', 'pond')
 SMB_USERNAME = os.environ.get('SMB_USERNAME', '')
 SMB_PASSWORD = os.environ.get('SMB_PASSWORD', '')
 SMB_BASE_PATH = os.environ.get('SMB_BASE_PATH', 'incoming/Orexplore')
 SMB_PATH = f'//{SMB_SERVER}/{SMB_SHARE}/{SMB_BASE_PATH}/'
+SMB_MACHINE = os.environ.get('SMB_MACHINE', 'OREXPLORE')
+# Location of each scanner machine; SMB_SOURCES (JSON list) overrides the single one above
+SMB_SOURCE_DEFAULTS = {
+    'server': SMB_SERVER,
+    'share': SMB_SHARE,
+    'base_path': SMB_BASE_PATH,
+    'machine': SMB_MACHINE,
+    'username': SMB_USERNAME,
+    'password': SMB_PASSWORD
+}
+SMB_SOURCES = parse_sources(os.environ.get('SMB_SOURCES', ''), SMB_SOURCE_DEFAULTS)
+SMB_POOL_SIZE = int(os.environ.get('SMB_POOL_SIZE', 4))
+SMB_POOL_IDLE_TIMEOUT = int(os.environ.get('SMB_POOL_IDLE_TIMEOUT', 300))
+SMB_SCAN_WORKERS = int(os.environ.get('SMB_SCAN_WORKERS', 4))
+SMB_SNAPSHOT_FILE = os.environ.get('SMB_SNAPSHOT_FILE', 'smb_snapshot.json')
+SMB_CACHE_MAX_AGE = int(os.environ.get('SMB_CACHE_MAX_AGE', 60))
+# inline: requests scan the share when the data is old; service: only scanner_service.py
+# scans and web workers read its snapshot files
+SMB_SCANNER_MODE = os.environ.get('SMB_SCANNER_MODE', 'inline')
+# Change events kept per source for /api/smb_changes
+SMB_CHANGES_RETENTION = int(os.environ.get('SMB_CHANGES_RETENTION', 1000))
+SMB_HEALTH_PING_INTERVAL = int(os.environ.get('SMB_HEALTH_PING_INTERVAL', 10))
+SMB_READY_MAX_AGE = int(os.environ.get('SMB_READY_MAX_AGE', 600))
+PREVIEW_CACHE_DIR = os.environ.get('PREVIEW_CACHE_DIR', 'preview_cache')
+PREVIEW_CACHE_MAX_MB = int(os.environ.get('PREVIEW_CACHE_MAX_MB', 200))
+PREVIEW_PREFETCH_WORKERS = int(os.environ.get('PREVIEW_PREFETCH_WORKERS', 2))
+PREVIEW_PREFETCH_BUDGET = int(os.environ.get('PREVIEW_PREFETCH_BUDGET', 30))
+# Depths (m) within this distance of the machine's still match (12.31 vs 12.30)
+RECONCILE_TOLERANCE = float(os.environ.get('RECONCILE_TOLERANCE', 0.05))
+
+def get_smb_pool(server=None, share=None, username=None, password=None):
+    """Pooled SMB connections for the configured server (see smb_pool.py)"""
+    return get_pool(
+        server or SMB_SERVER,
+        share or SMB_SHARE,
+        username or SMB_USERNAME,
+        password or SMB_PASSWORD,
+        connect=smb_connect,
+        max_size=SMB_POOL_SIZE,
+        idle_timeout=SMB_POOL_IDLE_TIMEOUT
+    )
 
 # Inicializar archivos de datos
 def init_data_files():
@@ -89,13 +155,28 @@ def init_data_files():
                 }
                 save_users(users)
                 logger.info("Admin user added to existing users file")
-    
-    if not os.path.exists(BATCHES_FILE):
-        with open(BATCHES_FILE, 'w') as f:
-            json.dump([], f)
 
 init_data_files()
 
+# Routes read and write single batches instead of rewriting the whole list.
+# Routine reads only see the hot partition (recent and pending batches).
+batch_store = PartitionedBatchStore(
+    open_batch_store(
+        BATCH_STORE,
+        json_path=BATCHES_FILE,
+        db_path=BATCHES_DB,
+        journal_path=BATCHES_JOURNAL,
+        snapshot_path=BATCHES_SNAPSHOT,
+        compact_interval=BATCHES_COMPACT_INTERVAL
+    ),
+    BATCHES_ARCHIVE_DIR,
+    hot_months=BATCHES_HOT_MONTHS,
+    archive_interval=BATCHES_ARCHIVE_INTERVAL if BATCHES_HOT_MONTHS else 0
+)
+
+# NumPy columns of every batch for the metros totals and charts (None without NumPy)
+batch_columns_cache = batch_columns.ColumnCache(batch_store.partitions) if batch_columns.available() else None
+
 # Funciones auxiliares
 def load_users():
     with open(USERS_FILE, 'r') as f:
@@ -106,12 +187,12 @@ def save_users(users):
         json.dump(users, f, indent=4)
 
 def load_batches():
-    with open(BATCHES_FILE, 'r') as f:
-        return json.load(f)
+    """Every batch, archived ones included, oldest first. Prefer the batch_store queries in new code."""
+    return batch_store.all(include_archive=True)
 
 def save_batches(batches):
-    with open(BATCHES_FILE, 'w') as f:
-        json.dump(batches, f, indent=4)
+    """Replaces every batch. Prefer batch_store.add/update/delete in new code."""
+    batch_store.replace_all(batches)
 
 def check_file_values(hole_id, from_val, to_val, machine):
     """Verifica si los valores coinciden con el archivo .txr en el servidor"""
@@ -124,27 +205,109 @@ def check_file_values(hole_id, from_val, to_val, machine):
     except:
         return False
 
-def get_preview_image(hole_id):
-    """Busca la imagen .jpg asociada al hole_id"""
+_preview_caches = {}
+_preview_cache_lock = threading.Lock()
+
+def get_preview_cache(source):
+    """Thumbnail cache on disk for one SMB source (see preview_cache.py)"""
+    with _preview_cache_lock:
+        cache = _preview_caches.get(source['name'])
+        if cache is None:
+            cache = PreviewCache(
+                SMBBackend(get_smb_pool(source['server'], source['share'], source['username'], source['password'])),
+                source['base_path'],
+                source_file(PREVIEW_CACHE_DIR, source, SMB_SOURCES),
+                max_bytes=PREVIEW_CACHE_MAX_MB * 1024 * 1024 // len(SMB_SOURCES)
+            )
+            _preview_caches[source['name']] = cache
+        return cache
+
+_preview_prefetcher = None
+
+def get_preview_prefetcher():
+    global _preview_prefetcher
+    with _preview_cache_lock:
+        if _preview_prefetcher is None:
+            _preview_prefetcher = PreviewPrefetcher(
+                workers=PREVIEW_PREFETCH_WORKERS,
+                budget=PREVIEW_PREFETCH_BUDGET
+            )
+        return _preview_prefetcher
+
+def _preview_location(scanner, batch):
+    """(cache, hole_id, batch_folder) of a batch's thumbnail"""
+    source, source_scanner = scanner.locate(batch['hole_id'], batch.get('machine'))
+    batch_folder = source_scanner.batch_folder(batch['hole_id'], batch['to'])
+    return get_preview_cache(source), batch['hole_id'], batch_folder
+
+def prefetch_previews(batches):
+    """Warms the preview cache in the background for a page of batches"""
+    if PREVIEW_PREFETCH_BUDGET <= 0 or not batches:
+        return
     try:
-        # Implementar búsqueda de imagen en servidor SMB
-        image_path = f"smb://172.16.11.104/pond/incoming/orexplore/{hole_id}.jpg"
-        return image_path
-    except:
-        return None
+        scanner = get_orexplore_scanner()
+        get_preview_prefetcher().prefetch(
+            _preview_location(scanner, batch)
+            for batch in batches
+            if batch.get('hole_id') and batch.get('to') not in (None, '')
+        )
+    except Exception as e:
+        logger.warning(f"Could not start preview prefetch: {e}")
+
+def get_preview_image(batch):
+    """
+    Thumbnail (sample-1/rec-low-res-thumb-x.jpg) of the batch, from the local
+    cache or fetched once from SMB. Returns the cache entry or None.
+    """
+    cache, hole_id, batch_folder = _preview_location(get_orexplore_scanner(), batch)
+    return cache.get(hole_id, batch_folder)
+
+def import_batch_rows(text, fmt, dry_run=False, skip_duplicates=True):
+    """
+    Validates a CSV/NDJSON file of batches and stores them in one write
+    (see batch_import.py). Each batch is 'correct' when the last SMB scan has
+    its depth.txt, 'incorrect' otherwise.
+    """
+    rows, errors = parse_batches(text, fmt)
+    if errors:
+        return {'imported': 0, 'valid': len(rows), 'errors': errors}
+    
+    # One SMB snapshot for the whole file
+    smb_data = get_smb_data()
+    
+    if batch_columns.available():
+        # The whole file joined to the SMB records in one vectorized pass
+        batches = [batch for _, batch in rows]
+        statuses = batch_columns.depth_statuses(batches, smb_data, RECONCILE_TOLERANCE, 'correct', 'incorrect', 'incorrect')
+        by_depth = dict(zip(((b['hole_id'], b['to']) for b in batches), statuses))
+        
+        def status_of(batch):
+            return by_depth[(batch['hole_id'], batch['to'])]
+    else:
+        index = ReconcileIndex(smb_data)
+        
+        def status_of(batch):
+            smb = index.by_depth(batch['hole_id'], batch['to'], RECONCILE_TOLERANCE)
+            return 'correct' if smb and smb.get('M_from') not in (None, '') else 'incorrect'
+    
+    result = import_batches(batch_store, rows, status_of, skip_duplicates=skip_duplicates, dry_run=dry_run)
+    result['errors'] = []
+    return result
 
 def calculate_metros_escaneados():
     """Calcula los metros escaneados totales"""
-    batches = load_batches()
+    if batch_columns_cache is not None:
+        columns = batch_columns_cache.get()
+        return round(columns.meters(columns.mask(status='correct')), 2)
+    
     total = 0
-    for batch in batches:
-        if batch.get('status') == 'correct':
-            try:
-                to_val = float(batch.get('to', 0))
-                from_val = float(batch.get('from', 0))
-                total += (to_val - from_val)
-            except:
-                pass
+    for batch in batch_store.find(status='correct'):
+        try:
+            to_val = float(batch.get('to', 0))
+            from_val = float(batch.get('from', 0))
+            total += (to_val - from_val)
+        except:
+            pass
     return round(total, 2)
 
 # Rutas
@@ -214,14 +377,9 @@ def batches_api():
         page = int(request.args.get('page', 1))
         per_page = 20
         
-        batches = load_batches()
-        batches.reverse()
-        
-        start = (page - 1) * per_page
-        end = start + per_page
-        
-        paginated_batches = batches[start:end]
-        total_pages = (len(batches) + per_page - 1) // per_page
+        paginated_batches, total = batch_store.page(page, per_page)
+        total_pages = (total + per_page - 1) // per_page
+        prefetch_previews(paginated_batches)
         
         return jsonify({
             'batches': paginated_batches,
@@ -231,12 +389,8 @@ def batches_api():
     
     elif request.method == 'POST':
         data = request.json
-        batches = load_batches()
-        
-        batch_number = len(batches) + 1
         
         new_batch = {
-            'batch_number': batch_number,
             'hole_id': data.get('hole_id'),
             'from': data.get('from'),
             'to': data.get('to'),
@@ -251,27 +405,46 @@ def batches_api():
             'created_at': datetime.now().isoformat()
         }
         
-        batches.append(new_batch)
-        save_batches(batches)
+        # batch_number is assigned by the store inside the insert transaction
+        new_batch = batch_store.add(new_batch)
         
         return jsonify({'success': True, 'batch': new_batch})
+@app.route('/api/batches/import', methods=['POST'])
+def import_batches_api():
+    """
+    Bulk import of a CSV or NDJSON file (multipart field `file` or the request
+    body). `format` (csv|ndjson) defaults to the file name or Content-Type;
+    `dry_run=1` validates without writing. Nothing is written if a row is invalid.
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+        fmt = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+    else:
+        text = request.get_data(as_text=True)
+        fmt = request.args.get('format') or detect_format(content_type=request.content_type)
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Formato no reconocido, use format=csv o format=ndjson'}), 400
+    
+    result = import_batch_rows(
+        text, fmt,
+        dry_run=request.args.get('dry_run') in ('1', 'true'),
+        skip_duplicates=request.args.get('skip_duplicates', '1') not in ('0', 'false')
+    )
+    return jsonify(result), (400 if result['errors'] else 200)
+
 @app.route('/api/batches/<int:batch_number>', methods=['DELETE'])
 def delete_batch(batch_number):
     if 'username' not in session:
         return jsonify({'error': 'No autorizado'}), 401
 
-    batches = load_batches()
-    updated = [b for b in batches if b['batch_number'] != batch_number]
-
-    if len(updated) == len(batches):
+    # Stable IDs: the other batches keep their numbers
+    if not batch_store.delete(batch_number):
         return jsonify({'error': 'Batch no encontrado'}), 404
 
-    # Reasignar numeración limpia
-    for i, b in enumerate(updated, start=1):
-        b['batch_number'] = i
-
-    save_batches(updated)
-
     return jsonify({'success': True})
 
 @app.route('/api/batches/<int:batch_number>', methods=['PUT'])
@@ -280,22 +453,14 @@ def update_batch(batch_number):
         return jsonify({'error': 'No autorizado'}), 401
 
     data = request.json
-    batches = load_batches()
     
-    batch = next((b for b in batches if b['batch_number'] == batch_number), None)
+    # Update batch fields
+    fields = {k: data[k] for k in ('hole_id', 'from', 'to', 'machine', 'comentarios') if k in data}
+    batch = batch_store.update(batch_number, fields)
     
     if not batch:
         return jsonify({'error': 'Batch no encontrado'}), 404
     
-    # Update batch fields
-    batch['hole_id'] = data.get('hole_id', batch['hole_id'])
-    batch['from'] = data.get('from', batch['from'])
-    batch['to'] = data.get('to', batch['to'])
-    batch['machine'] = data.get('machine', batch['machine'])
-    batch['comentarios'] = data.get('comentarios', batch.get('comentarios', ''))
-    
-    save_batches(batches)
-    
     return jsonify({'success': True, 'batch': batch})
 
 @app.route('/api/metros_escaneados')
@@ -311,14 +476,29 @@ def preview_image(batch_number):
     if 'username' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
-    batches = load_batches()
-    batch = next((b for b in batches if b['batch_number'] == batch_number), None)
+    batch = batch_store.get(batch_number)
     
-    if batch:
-        image_path = get_preview_image(batch['hole_id'])
-        return jsonify({'image_path': image_path})
+    if not batch:
+        return jsonify({'error': 'Batch no encontrado'}), 404
     
-    return jsonify({'error': 'Batch no encontrado'}), 404
+    try:
+        image = get_preview_image(batch)
+    except Exception as e:
+        logger.error(f"Error fetching preview for batch {batch_number}: {e}")
+        return jsonify({'error': 'Servidor SMB no disponible'}), 502
+    
+    if image is None:
+        return jsonify({'error': 'Imagen no encontrada'}), 404
+    
+    # conditional=True answers If-None-Match / If-Modified-Since with 304
+    return send_file(
+        image['path'],
+        mimetype='image/jpeg',
+        etag=image['etag'],
+        last_modified=image['last_modified'],
+        max_age=3600,
+        conditional=True
+    )
 
 @app.route('/status_checker')
 def status_checker():
@@ -335,161 +515,172 @@ def status_checker_data():
     page = int(request.args.get('page', 1))
     per_page = 30
 
-    batches = load_batches()
-    batches.reverse()
-
-    # Get SMB data from the server with error handling
-    try:
-        smb_data = leer_orexplore_smb()
-    except Exception as e:
-        logger.error(f"Error fetching SMB data: {e}")
-        smb_data = []
-
-    # Match batches with SMB data and populate machine_values
-    for batch in batches:
-        # First, try to use existing machine data from the batch object
-        if "machine_hole_id" in batch or "machine_from" in batch or "machine_to" in batch or "machine_machine" in batch:
-            batch["machine_values"] = {
-                "hole_id": batch.get("machine_hole_id", "-"),
-                "from": batch.get("machine_from", "-"),
-                "to": batch.get("machine_to", "-"),
-                "machine": batch.get("machine_machine", "-")
-            }
-        else:
-            batch["machine_values"] = None
-        
-        # Then, override with fresh SMB data if available
-        for smb in smb_data:
-            if smb["M_hole_id"] == batch["hole_id"]:
-                batch["machine_values"] = {
-                    "hole_id": smb["M_hole_id"],
-                    "from": smb["M_from"],
-                    "to": smb["M_to"],
-                    "machine": smb["M_machine"] or "OREXPLORE"
-                }
-                break
-
-    start = (page - 1) * per_page
-    end = start + per_page
-    
-    paginated_batches = batches[start:end]
-    total_pages = (len(batches) + per_page - 1) // per_page
+    # The page window (archived months included) and the total come from the
+    # store; only its rows whose batch or SMB records changed are reconciled
+    # again (see reconcile_view.py). Newest first, numbered down from the total
+    paginated_batches, total = reconcile_view.page(page, per_page)
+    total_pages = (total + per_page - 1) // per_page
+    prefetch_previews(paginated_batches)
     
     return jsonify({
         'batches': paginated_batches,
         'total_pages': total_pages,
-        'current_page': page
+        'current_page': page,
+        'tolerance': RECONCILE_TOLERANCE
     })
 
 
+@app.route('/api/smb_changes')
+def smb_changes():
+    """
+    Changes in the SMB tree (batch_added, depth_ready, batch_removed) after the
+    `since` cursor returned by the previous call. Without a cursor, or when it
+    is older than the retained events, `reset` is true: reload the full data
+    and continue from the returned cursor.
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        limit = max(1, min(int(request.args.get('limit', 500)), 5000))
+    except ValueError:
+        return jsonify({'error': 'limit inválido'}), 400
+    
+    try:
+        # Starts a background refresh when the last scan is old
+        get_smb_data()
+        return jsonify(get_orexplore_scanner().changes_since(request.args.get('since'), limit))
+    except Exception as e:
+        logger.error(f"Error reading SMB changes: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 # ⚠️ ESTA FUNCIÓN DEBE IR FUERA DE LA RUTA, A NIVEL GLOBAL
-def leer_orexplore_smb(server=None, share=None, username=None, password=None, base_path=None):
+def leer_orexplore_smb(server=None, share=None, username=None, password=None, base_path=None, workers=None):
     """
-    Reads data from Orexplore SMB server with proper error handling.
+    Reads data from the Orexplore SMB sources with proper error handling.
+    All sources (SMB_SOURCES) are scanned at the same time and their records merged,
+    M_machine set from each source. Hole directories are scanned by `workers` threads
+    (SMB_SCAN_WORKERS by default) and holes whose LastWriteTime did not change since
+    the last scan are reused.
     Returns list of batch data or empty list on error.
     """
-    # Use environment variables as defaults
-    server = server or SMB_SERVER
-    share = share or SMB_SHARE
-    username = username or SMB_USERNAME
-    password = password or SMB_PASSWORD
-    base_path = base_path or SMB_BASE_PATH
-    
     resultados = []
-    conn = None
-    smb_session = None
-    tree = None
     
     try:
-        logger.info(f"Connecting to SMB server: {server}")
-        conn, smb_session, tree = smb_connect(server, share, username, password)
-        
-        base_dir = Open(tree, base_path)
-        base_dir.create(CreateDisposition.FILE_OPEN)
-        
-        for info in base_dir.query_directory("*"):
-            hole_id = info.file_name
-            hole_path = f"{base_path}/{hole_id}"
-            
-            if "." in hole_id:
-                continue
-            
-            hole_dir = None
-            try:
-                hole_dir = Open(tree, hole_path)
-                hole_dir.create(CreateDisposition.FILE_OPEN)
-            except SMBException as e:
-                logger.warning(f"Could not open hole directory {hole_id}: {e}")
-                continue
-            
-            try:
-                for batch_info in hole_dir.query_directory("*"):
-                    batch_folder = batch_info.file_name
-                    
-                    if not batch_folder.startswith("batch-"):
-                        continue
-                    
-                    M_to = batch_folder.replace("batch-", "")
-                    batch_path = f"{hole_path}/{batch_folder}"
-                    depth_path = f"{batch_path}/depth.txt"
-                    
-                    depth_file = None
-                    try:
-                        depth_file = Open(tree, depth_path)
-                        depth_file.create(CreateDisposition.FILE_OPEN)
-                        raw = depth_file.read(0, 2048).decode("utf-8")
-                        M_from = raw.splitlines()[0].strip()
-                        
-                        resultados.append({
-                            "M_hole_id": hole_id,
-                            "M_from": M_from,
-                            "M_to": M_to,
-                            "M_machine": None
-                        })
-                    except SMBException as e:
-                        logger.warning(f"Could not read depth file for {hole_id}/{batch_folder}: {e}")
-                    except (IndexError, ValueError) as e:
-                        logger.warning(f"Invalid depth file format for {hole_id}/{batch_folder}: {e}")
-                    finally:
-                        if depth_file:
-                            try:
-                                depth_file.close()
-                            except Exception:
-                                pass
-            finally:
-                if hole_dir:
-                    try:
-                        hole_dir.close()
-                    except Exception:
-                        pass
-        
-        base_dir.close()
+        scanner = get_orexplore_scanner(server, share, username, password, base_path, workers)
+        servers = ', '.join(f"{s['name']} ({s['server']})" for s in scanner.sources)
+        logger.info(f"Scanning SMB sources: {servers} ({workers or SMB_SCAN_WORKERS} workers each)")
+        resultados = scanner.scan()
         logger.info(f"Successfully read {len(resultados)} batches from SMB server")
         
     except SMBException as e:
         logger.error(f"SMB connection error: {e}")
     except Exception as e:
         logger.error(f"Unexpected error reading from SMB: {e}")
-    finally:
-        # Clean up connections
-        if tree:
-            try:
-                tree.disconnect()
-            except Exception:
-                pass
-        if smb_session:
-            try:
-                smb_session.disconnect()
-            except Exception:
-                pass
-        if conn:
-            try:
-                conn.disconnect()
-            except Exception:
-                pass
     
     return resultados
 
+def get_orexplore_scanner(server=None, share=None, username=None, password=None, base_path=None, workers=None):
+    """
+    Scanner over every configured SMB source, or over a single location when
+    any argument is given (environment variables as defaults)
+    """
+    if server or share or username or password or base_path:
+        source = dict(SMB_SOURCE_DEFAULTS, name='adhoc')
+        source.update((k, v) for k, v in (
+            ('server', server), ('share', share), ('username', username),
+            ('password', password), ('base_path', base_path)
+        ) if v)
+        return MultiSourceScanner([(source, get_source_scanner(source, workers, persist=False))])
+
+    return MultiSourceScanner([(source, get_source_scanner(source, workers)) for source in SMB_SOURCES])
+
+def get_source_scanner(source, workers=None, persist=True):
+    """
+    Scanner for one SMB source; configured sources are persisted to SMB_SNAPSHOT_FILE,
+    and with SMB_SCANNER_MODE=service only read back from it
+    """
+    return get_scanner(
+        SMBBackend(get_smb_pool(source['server'], source['share'], source['username'], source['password'])),
+        source['base_path'],
+        partial(_depth_record, machine=source['machine']),
+        workers=workers or SMB_SCAN_WORKERS,
+        include_hole=lambda name: "." not in name,
+        snapshot_path=source_file(SMB_SNAPSHOT_FILE, source, SMB_SOURCES) if persist else None,
+        read_only=persist and SMB_SCANNER_MODE == 'service',
+        change_log_size=SMB_CHANGES_RETENTION
+    )
+
+def get_smb_data():
+    """
+    Last known SMB records, answered from memory or the snapshot file.
+    A background refresh is started when they are older than SMB_CACHE_MAX_AGE.
+    """
+    try:
+        return get_orexplore_scanner().cached(SMB_CACHE_MAX_AGE)
+    except Exception as e:
+        logger.error(f"Error fetching SMB data: {e}")
+        return []
+
+def smb_changes_since(cursor):
+    """
+    Change feed of the SMB sources for the reconciliation view. Like
+    get_smb_data, a scan older than SMB_CACHE_MAX_AGE is refreshed in the background.
+    """
+    scanner = get_orexplore_scanner()
+    if SMB_SCANNER_MODE != 'service':
+        age = scanner.age()
+        if age is not None and age > SMB_CACHE_MAX_AGE:
+            scanner.refresh_in_background()
+    return scanner.changes_since(cursor, max(SMB_CHANGES_RETENTION, 500))
+
+def reconcile_batch(batch, smb_index):
+    """
+    Status checker row of one batch: machine values of the hole's SMB record
+    nearest to the batch depths (the first one if they are not numbers), else
+    the machine_* values stored with the batch. The status is kept as stored.
+    """
+    smb, delta = smb_index.nearest(batch.get('hole_id'), batch.get('from'), batch.get('to'))
+    quality = match_quality(delta, RECONCILE_TOLERANCE)
+    if smb is None:
+        smb = smb_index.first(batch.get('hole_id'))
+        quality = 'hole'
+    
+    if smb:
+        machine_values = {
+            'hole_id': smb['M_hole_id'],
+            'from': smb['M_from'],
+            'to': smb['M_to'],
+            'machine': smb['M_machine'] or 'OREXPLORE',
+            'delta': delta
+        }
+    elif 'machine_hole_id' in batch or 'machine_from' in batch or 'machine_to' in batch or 'machine_machine' in batch:
+        machine_values = {
+            'hole_id': batch.get('machine_hole_id', '-'),
+            'from': batch.get('machine_from', '-'),
+            'to': batch.get('machine_to', '-'),
+            'machine': batch.get('machine_machine', '-')
+        }
+        quality = 'stored'
+    else:
+        machine_values, quality = None, 'none'
+    
+    return {'machine_values': machine_values, 'match': quality}
+
+# Status checker rows of every batch, kept up to date with the batches and the SMB change feed
+reconcile_view = ReconcileView(batch_store, reconcile_batch, get_smb_data, smb_changes_since)
+
+def _depth_record(hole_id, batch_folder, raw, machine=None):
+    """Builds the record for one batch-<to>/depth.txt (first line is the from depth)"""
+    M_from = raw.decode("utf-8").splitlines()[0].strip()
+    return {
+        "M_hole_id": hole_id,
+        "M_from": M_from,
+        "M_to": batch_folder.replace("batch-", ""),
+        "M_machine": machine
+    }
+
 @app.route('/metros')
 def metros():
     if 'username' not in session:
@@ -501,9 +692,24 @@ def metros_data():
     if 'username' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
-    batches = load_batches()
-    
     now = datetime.now()
+    # Only the last 30 days are charted: read them through the created_at index
+    first_day = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if batch_columns_cache is not None:
+        # Vectorized over the cached columns: one bincount per chart
+        columns = batch_columns_cache.get()
+        mask = columns.mask(status='correct', created_from=first_day)
+        hourly = columns.meters_by_hour(now, mask)
+        daily = columns.meters_by_day(first_day, 30, mask)
+        return jsonify({
+            'daily': [{'hour': hour, 'metros': round(float(hourly[hour]), 2)} for hour in range(24)],
+            'monthly': [
+                {'day': (first_day + timedelta(days=day)).strftime('%d/%m'), 'metros': round(float(daily[day]), 2)}
+                for day in range(30)
+            ]
+        })
+    
+    batches = batch_store.find(status='correct', created_from=first_day.isoformat())
     daily_data = []
     
     for hour in range(24):
@@ -549,9 +755,130 @@ def metros_data():
         'monthly': monthly_data
     })
 
+# Last SMB2 ECHO result, shared by every health request
+_smb_ping = {'checked_at': None, 'ok': None, 'error': None, 'latency_ms': None}
+_smb_ping_lock = threading.Lock()
+_smb_ping_running = False
+
+def _run_smb_ping():
+    global _smb_ping_running
+    started = time.monotonic()
+    errors = []
+    for source in SMB_SOURCES:
+        try:
+            get_smb_pool(source['server'], source['share'], source['username'], source['password']).ping(timeout=1)
+        except TimeoutError:
+            # Every pooled connection is checked out by a scan: the server answers
+            pass
+        except Exception as e:
+            errors.append(f"{source['name']}: {e}")
+    ok, error = not errors, '; '.join(errors) or None
+    with _smb_ping_lock:
+        _smb_ping.update({
+            'checked_at': time.monotonic(),
+            'ok': ok,
+            'error': error,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1)
+        })
+        _smb_ping_running = False
+
+def check_smb_connection():
+    """
+    Result of an SMB2 ECHO to every source over pooled connections (no directory access).
+    The echo runs at most every SMB_HEALTH_PING_INTERVAL seconds, always in a
+    background thread; requests get the last result and never wait for the
+    share ('ok' is None until the first echo finished).
+    """
+    global _smb_ping_running
+    with _smb_ping_lock:
+        checked_at = _smb_ping['checked_at']
+        stale = checked_at is None or time.monotonic() - checked_at > SMB_HEALTH_PING_INTERVAL
+        start = stale and not _smb_ping_running
+        if start:
+            _smb_ping_running = True
+        result = dict(_smb_ping)
+
+    if start:
+        threading.Thread(target=_run_smb_ping, name='smb-ping', daemon=True).start()
+    return result
+
+def smb_readiness():
+    """
+    SMB status from the connection echo and the last scan kept in memory.
+    Until a first scan exists one is started in the background (inline mode).
+    With SMB_SCANNER_MODE=service the web workers open no SMB connection:
+    reachability is the result of the last scan published by scanner_service.py.
+    """
+    scanner = get_orexplore_scanner()
+    if SMB_SCANNER_MODE == 'service':
+        scanner.reload_snapshot()
+        ping = None
+    else:
+        ping = check_smb_connection()
+        if scanner.scanned_at is None:
+            # Inline mode scans on user traffic, which an unready instance never gets
+            scanner.refresh_in_background()
+    stats = scanner.stats()
+
+    smb = {
+        'status': 'ok',
+        'batches_found': stats['batches'],
+        'holes': stats['holes'],
+        'last_scan': stats['scanned_at'],
+        'scan_age': round(stats['age'], 1) if stats['age'] is not None else None,
+        'scanning': stats['scanning'],
+        'stale': stats['age'] is not None and stats['age'] > SMB_READY_MAX_AGE,
+        'echo_ms': ping['latency_ms'] if ping else None,
+        'sources': [
+            {
+                'name': s['name'],
+                'machine': s['machine'],
+                'batches_found': s['batches'],
+                'last_scan': s['scanned_at'],
+                'error': s['last_error']
+            }
+            for s in stats['sources']
+        ]
+    }
+    if ping and ping['ok'] is None:
+        smb['status'] = 'error'
+        smb['error'] = 'SMB connection check pending'
+    elif ping and not ping['ok']:
+        smb['status'] = 'error'
+        smb['error'] = ping['error'] or 'SMB server not reachable'
+    elif stats['last_error']:
+        smb['status'] = 'error'
+        smb['error'] = stats['last_error']
+    elif stats['scanned_at'] is None:
+        smb['status'] = 'error'
+        smb['error'] = 'First SMB scan in progress' if stats['scanning'] else 'No SMB scan completed yet'
+    return smb
+
+@app.route('/health/live')
+def health_live():
+    """Liveness probe: the process answers requests."""
+    return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness probe: 200 when SMB answers and scan data is available, 503 otherwise."""
+    try:
+        smb = smb_readiness()
+    except Exception as e:
+        smb = {'status': 'error', 'error': str(e)}
+    ready = smb['status'] == 'ok'
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'timestamp': datetime.now().isoformat(),
+        'services': {'smb': smb}
+    }), (200 if ready else 503)
+
 @app.route('/health')
 def health_check():
-    """Health check endpoint to verify app and SMB connectivity status."""
+    """
+    Health check endpoint to verify app and SMB connectivity status.
+    Never scans the share: SMB status comes from smb_readiness().
+    """
     status = {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
@@ -560,10 +887,9 @@ def health_check():
     
     # Check database files
     try:
-        batches = load_batches()
         status['services']['database'] = {
             'status': 'ok',
-            'batches_count': len(batches)
+            'batches_count': batch_store.count()
         }
     except Exception as e:
         status['status'] = 'degraded'
@@ -572,13 +898,11 @@ def health_check():
             'error': str(e)
         }
     
-    # Check SMB connectivity
+    # Check SMB connectivity (echo + last known scan)
     try:
-        smb_data = leer_orexplore_smb()
-        status['services']['smb'] = {
-            'status': 'ok',
-            'batches_found': len(smb_data)
-        }
+        status['services']['smb'] = smb_readiness()
+        if status['services']['smb']['status'] != 'ok':
+            status['status'] = 'degraded'
     except Exception as e:
         status['status'] = 'degraded'
         status['services']['smb'] = {
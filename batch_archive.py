@@ -0,0 +1,407 @@
+"""
+Monthly archives of historical batches.
+
+PartitionedBatchStore wraps a batch store (SQLite or journal, see
+batch_store.py) that becomes the hot partition: batches of the last
+``hot_months`` calendar months plus every batch still pending. The archiver
+moves the other batches into one gzipped JSON file per ``created_at`` month
+in ``directory`` (``batches-2026-01.json.gz``), listed in ``index.json``
+with their count and batch_number range.
+
+Routine reads (metros of the last 30 days, the first pages of the table
+and of the status checker) only touch the hot partition. A month file is
+read only by a query that needs it: a page that reaches the month, a date
+range that includes it, or a batch_number in its range; once read it is
+kept in memory until the file changes. Editing or deleting an archived
+batch moves it back to the hot partition first; edits and deletes take the
+archive lock, so the archiver never files a stale copy of a batch.
+
+Month ranges of batch_number can overlap (a batch imported with an old
+created_at gets a new number but lands in its old month), so lookups try
+every month whose range holds the number and pages merge the months in
+true batch_number order.
+"""
+import gzip
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from batch_store import batch_matches, number_page
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Batches in these states stay in the hot partition whatever their age
+ACTIVE_STATUSES = ("pending", "in_progress")
+
+INDEX_FILE = "index.json"
+
+
+class PartitionedBatchStore:
+    def __init__(self, hot, directory, hot_months=2, archive_interval=3600):
+        self.hot = hot
+        self.directory = os.path.abspath(directory)
+        self.hot_months = hot_months
+        self.archive_interval = archive_interval
+        self._index = {}
+        self._index_stamp = None
+        self._months = {}  # month -> (stamp, batches in batch_number order)
+        self._lock = threading.RLock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        if archive_interval:
+            threading.Thread(target=self._archive_loop, name="batch-archiver", daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Reads
+
+    def version(self):
+        return self.hot.version(), self._read_index()[1]
+
+    def all(self, newest_first=False, include_archive=False):
+        """Hot batches; ``include_archive`` adds every archived month (reads all of them)."""
+        batches = self.hot.all()
+        if include_archive:
+            batches = sorted(batches + self._archived(self._read_index()[0], {b["batch_number"] for b in batches}),
+                             key=_number)
+        return batches[::-1] if newest_first else batches
+
+    def partitions(self):
+        """
+        ``(name, version, load)`` of the hot partition and of each archived
+        month, hot first, for caches built per partition (batch_columns.py).
+        ``load()`` returns batches that must not be modified.
+        """
+        index, _ = self._read_index()
+        yield "hot", self.hot.version(), lambda: self.hot.view().batches
+        for month in sorted(index, reverse=True):
+            yield month, _stamp(self._month_path(month)), lambda month=month: self._load(month)
+
+    def count(self):
+        index, _ = self._read_index()
+        return self.hot.count() + sum(entry["count"] for entry in index.values())
+
+    def get(self, batch_number):
+        batch = self.hot.get(batch_number)
+        if batch is not None:
+            return batch
+        for month in self._months_of(batch_number):
+            batch = next((b for b in self._load(month) if b["batch_number"] == batch_number), None)
+            if batch is not None:
+                return dict(batch)
+        return None
+
+    def page(self, page, per_page, order="batch_number", newest_first=True):
+        """Like BatchStore.page(); archived months are read only when the page reaches them."""
+        index, _ = self._read_index()
+        if not index:
+            return self.hot.page(page, per_page, order, newest_first)
+        if order == "batch_number":
+            key = _number
+        elif order == "created_at":
+            key = _created
+        else:
+            raise ValueError(f"Unsupported order: {order}")
+
+        view = self.hot.view()
+        # Iterators over the cached lists: the merge reads only up to the page
+        if key is _number:
+            hot = reversed(view.batches) if newest_first else iter(view.batches)
+        else:
+            hot = iter(view.by_created()) if newest_first else reversed(view.by_created())
+        offset = max(page - 1, 0) * per_page
+        total = len(view.batches) + sum(entry["count"] for entry in index.values())
+        archived = self._archived_sorted(index, key, newest_first, view.by_number)
+        rows = list(islice(heapq.merge(hot, archived, key=key, reverse=newest_first), offset, offset + per_page))
+        if newest_first:
+            return number_page(rows, total - offset, -1), total
+        return number_page(rows, offset + 1), total
+
+    def find(self, hole_id=None, to=None, status=None, exclude_status=None,
+             created_from=None, created_to=None, newest_first=False, include_archive=True):
+        """
+        Like BatchStore.find(); only the archived months inside
+        ``created_from``/``created_to`` are searched.
+        """
+        found = self.hot.find(hole_id, to, status, exclude_status, created_from, created_to)
+        if include_archive:
+            index, _ = self._read_index()
+            months = [m for m in index
+                      if (created_from is None or m >= created_from[:7])
+                      and (created_to is None or m <= created_to[:7])]
+            hot_numbers = {b["batch_number"] for b in found}
+            found += [b for b in self._archived(months, hot_numbers)
+                      if batch_matches(b, hole_id, to, status, exclude_status, created_from, created_to)]
+            found.sort(key=_number)
+        return found[::-1] if newest_first else found
+
+    # ------------------------------------------------------------------
+    # Writes
+
+    def add(self, batch):
+        return self.hot.add(batch)
+
+    def add_many(self, batches):
+        return self.hot.add_many(batches)
+
+    # Changes to existing batches hold the archive lock, so archive() never
+    # files a copy that is changed (or restored) before it deletes the hot one
+
+    def update(self, batch_number, fields):
+        with self._archive_lock():
+            self._restore(batch_number)
+            return self.hot.update(batch_number, fields)
+
+    def update_many(self, changes):
+        with self._archive_lock():
+            for batch_number in changes:
+                self._restore(batch_number)
+            return self.hot.update_many(changes)
+
+    def delete(self, batch_number):
+        with self._archive_lock():
+            self._restore(batch_number)
+            return self.hot.delete(batch_number)
+
+    def replace_all(self, batches):
+        """Replaces every batch, archived ones included; they are archived again later."""
+        with self._archive_lock():
+            self.hot.replace_all(batches)
+            for month in list(self._read_index()[0]):
+                self._write_month(month, [])
+
+    # ------------------------------------------------------------------
+    # Archiving
+
+    def archive(self, now=None):
+        """
+        Moves batches created before the hot months, and not pending, into
+        their month files. Returns the number of batches archived.
+        """
+        if not self.hot_months:
+            return 0
+        cutoff = _first_month(now or datetime.now(), self.hot_months)
+        with self._archive_lock():
+            by_month = {}
+            for batch in self.hot.all():
+                month = (batch.get("created_at") or "")[:7]
+                if month and month < cutoff and batch.get("status") not in ACTIVE_STATUSES:
+                    by_month.setdefault(month, []).append(batch)
+            if not by_month:
+                return 0
+
+            # Files first: if the process dies before the delete, the batches
+            # are in both places and the hot copy wins
+            for month, batches in sorted(by_month.items()):
+                known = {b["batch_number"]: b for b in self._load(month)}
+                known.update((b["batch_number"], b) for b in batches)
+                self._write_month(month, list(known.values()))
+            moved = [b["batch_number"] for batches in by_month.values() for b in batches]
+            self.hot.delete_many(moved)
+        logger.info(f"Archived {len(moved)} batches from {len(by_month)} months before {cutoff}")
+        return len(moved)
+
+    def _archive_loop(self):
+        while True:
+            try:
+                self.archive()
+            except Exception as e:
+                logger.error(f"Batch archiving failed: {e}")
+            time.sleep(self.archive_interval)
+
+    def _restore(self, batch_number):
+        """Moves an archived batch back to the hot partition before it is changed; caller holds the archive lock."""
+        if self.hot.get(batch_number) is not None:
+            return
+        for month in self._months_of(batch_number):
+            batches = self._load(month)
+            batch = next((b for b in batches if b["batch_number"] == batch_number), None)
+            if batch is not None:
+                self.hot.put(batch)
+                self._write_month(month, [b for b in batches if b["batch_number"] != batch_number])
+                return
+
+    # ------------------------------------------------------------------
+    # Files
+
+    def _read_index(self):
+        """(index, stamp), reloaded when index.json changed."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        stamp = _stamp(path)
+        with self._lock:
+            if stamp != self._index_stamp:
+                try:
+                    with open(path, "r") as f:
+                        self._index = json.load(f)
+                except FileNotFoundError:
+                    self._index = {}
+                self._index_stamp = stamp
+            return self._index, stamp
+
+    def _months_of(self, batch_number):
+        """
+        Months whose batch_number range includes ``batch_number``. Ranges can
+        overlap: a batch imported with an old created_at gets a new number but
+        is archived into its old month.
+        """
+        index, _ = self._read_index()
+        return [month for month, entry in sorted(index.items())
+                if entry["min_number"] <= batch_number <= entry["max_number"]]
+
+    def _load(self, month):
+        path = self._month_path(month)
+        stamp = _stamp(path)
+        with self._lock:
+            cached = self._months.get(month)
+            if cached and cached[0] == stamp:
+                return cached[1]
+        if stamp is None:
+            batches = []
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                batches = json.load(f)
+        with self._lock:
+            self._months[month] = (stamp, batches)
+        return batches
+
+    def _archived(self, months, skip_numbers):
+        return [dict(b) for month in months for b in self._load(month) if b["batch_number"] not in skip_numbers]
+
+    def _archived_sorted(self, index, key, reverse, hot_numbers):
+        """
+        Archived batches of every month in ``key`` order (descending with
+        ``reverse``), skipping ``hot_numbers``. Month ranges may overlap, so
+        this is a k-way merge; a month is loaded only once the merge reaches
+        the bound of its range (index.json), so the first pages stay cheap.
+        """
+        def bounds(month):
+            entry = index[month]
+            if key is _number:
+                return entry["min_number"], entry["max_number"]
+            return (month, 0), (month + "\uffff", 0)  # every created_at of the month sorts in between
+
+        # Months in the order their first batch comes out: by upper bound when descending
+        pending = sorted(index, key=lambda m: bounds(m)[1 if reverse else 0], reverse=reverse)
+        heap = []
+
+        def push(iterator, order):
+            for batch in iterator:
+                if batch["batch_number"] not in hot_numbers:
+                    heapq.heappush(heap, (_Key(key(batch), reverse), order, batch, iterator))
+                    return
+
+        order = 0
+        while pending or heap:
+            # Activate every month that could hold the next batch
+            while pending and (not heap or _Key(bounds(pending[0])[1 if reverse else 0], reverse) <= heap[0][0]):
+                month = pending.pop(0)
+                push(iter(sorted(self._load(month), key=key, reverse=reverse)), order)
+                order += 1
+            if not heap:
+                break
+            _, batch_order, batch, iterator = heapq.heappop(heap)
+            yield batch
+            push(iterator, batch_order)
+
+    def _write_month(self, month, batches):
+        """Rewrites one month file and its index entry; caller holds the archive lock."""
+        path = self._month_path(month)
+        index = dict(self._read_index()[0])
+        batches = sorted(batches, key=_number)
+        if batches:
+            _atomic_write(path, gzip.compress(json.dumps(batches).encode("utf-8")), self.directory)
+            index[month] = {
+                "count": len(batches),
+                "min_number": batches[0]["batch_number"],
+                "max_number": batches[-1]["batch_number"],
+            }
+        else:
+            index.pop(month, None)
+        _atomic_write(os.path.join(self.directory, INDEX_FILE),
+                      json.dumps(index, indent=2, sort_keys=True).encode("utf-8"), self.directory)
+        if not batches:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _month_path(self, month):
+        return os.path.join(self.directory, f"batches-{month}.json.gz")
+
+    @contextmanager
+    def _archive_lock(self):
+        """
+        Archive files are rewritten, and archived batches changed, by one
+        thread of one process at a time. Not reentrant across the file lock:
+        take it once per operation.
+        """
+        with self._lock, open(os.path.join(self.directory, ".lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+def _first_month(now, hot_months):
+    """'YYYY-MM' of the oldest hot month: the current month is the first of ``hot_months``."""
+    months = now.year * 12 + now.month - 1 - (hot_months - 1)
+    return f"{months // 12:04d}-{months % 12 + 1:02d}"
+
+
+class _Key:
+    """Sort key for the archive merge heap, inverted when merging in descending order."""
+
+    __slots__ = ("value", "reverse")
+
+    def __init__(self, value, reverse):
+        self.value = value
+        self.reverse = reverse
+
+    def __lt__(self, other):
+        return other.value < self.value if self.reverse else self.value < other.value
+
+    def __le__(self, other):
+        return not other < self
+
+
+def _number(batch):
+    return batch["batch_number"]
+
+
+def _created(batch):
+    # Ties by batch_number, like BatchView.by_created()
+    return batch.get("created_at") or "", batch["batch_number"]
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _atomic_write(path, data, directory):
+    fd, tmp_path = tempfile.mkstemp(prefix=".archive-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
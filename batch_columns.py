@@ -0,0 +1,255 @@
+"""
+Columnar (NumPy) copies of the batches and SMB records for whole-history work.
+
+The metros totals and charts and the reconciliation of a bulk import walk
+every batch in Python and parse ``from``/``to`` with float() each time.
+BatchColumns keeps the same batches as arrays, parsed once: hole_id codes,
+float64 from/to (NaN when not a number), datetime64 created_at (NaT),
+status codes and batch_number. Meters by status and day, and the join of
+batches to SMB records by hole and depth (``match_depths``, the same rule as
+ReconcileIndex.by_depth), are then a few vectorized operations.
+
+ColumnCache builds the columns per store partition (the hot batches and
+each archived month) and rebuilds only the partitions whose version
+changed, so a new batch does not re-parse years of archive.
+
+NumPy is optional: ``available()`` is False without it and callers keep
+their per-record loops. ``python bench_columns.py`` compares both.
+"""
+import threading
+
+from reconcile import _EPSILON, norm_text
+
+try:
+    import numpy as np
+except ImportError:  # optional, see available()
+    np = None
+
+
+def available():
+    return np is not None
+
+
+class Vocabulary:
+    """Integer codes of strings (hole ids, statuses), shared by the columns that are compared."""
+
+    def __init__(self):
+        self.codes = {}
+        self._lock = threading.Lock()
+
+    def encode(self, values):
+        codes = self.codes
+        with self._lock:
+            return np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int64)
+
+    def code(self, value):
+        """Code of ``value``; -1 if it never appeared (matches nothing)."""
+        return self.codes.get(value, -1)
+
+
+class BatchColumns:
+    def __init__(self, batches, holes=None, statuses=None):
+        self.holes = holes if holes is not None else Vocabulary()
+        self.statuses = statuses if statuses is not None else Vocabulary()
+        self.batch_number = np.fromiter((b.get("batch_number", -1) for b in batches), dtype=np.int64)
+        self.hole = self.holes.encode(norm_text(b.get("hole_id")) for b in batches)
+        self.from_ = _floats([b.get("from") for b in batches])
+        self.to = _floats([b.get("to") for b in batches])
+        self.created_at = _datetimes([b.get("created_at") for b in batches])
+        self.status = self.statuses.encode(b.get("status") for b in batches)
+
+    def __len__(self):
+        return len(self.batch_number)
+
+    @classmethod
+    def concat(cls, parts, holes, statuses):
+        """One BatchColumns of ``parts`` (same vocabularies); a batch_number repeated keeps its first row."""
+        columns = cls([], holes, statuses)
+        if parts:
+            for name in ("batch_number", "hole", "from_", "to", "created_at", "status"):
+                setattr(columns, name, np.concatenate([getattr(part, name) for part in parts]))
+            _, first = np.unique(columns.batch_number, return_index=True)
+            if len(first) < len(columns):
+                columns._take(np.sort(first))
+        return columns
+
+    def _take(self, rows):
+        for name in ("batch_number", "hole", "from_", "to", "created_at", "status"):
+            setattr(self, name, getattr(self, name)[rows])
+
+    def mask(self, status=None, created_from=None, created_to=None):
+        """Rows with ``status`` created within [created_from, created_to) (datetimes or ISO strings)."""
+        mask = np.ones(len(self), dtype=bool)
+        if status is not None:
+            mask &= self.status == self.statuses.code(status)
+        if created_from is not None:
+            mask &= self.created_at >= np.datetime64(created_from, "us")
+        if created_to is not None:
+            mask &= self.created_at < np.datetime64(created_to, "us")
+        return mask
+
+    def lengths(self):
+        """to - from of every row; NaN where either is not a number."""
+        return self.to - self.from_
+
+    def meters(self, mask=None):
+        """Meters (to - from) of the rows in ``mask``; rows without numeric depths count 0."""
+        lengths = self.lengths()
+        return float(np.nansum(lengths if mask is None else lengths[mask]))
+
+    def meters_by_day(self, first_day, days, mask=None):
+        """Meters per calendar day of created_at, ``days`` values from ``first_day``."""
+        day = (self.created_at.astype("datetime64[D]") - np.datetime64(first_day, "D")).astype(np.int64)
+        rows = (day >= 0) & (day < days) & ~np.isnat(self.created_at)
+        if mask is not None:
+            rows &= mask
+        return np.bincount(day[rows], weights=np.nan_to_num(self.lengths()[rows]), minlength=days)
+
+    def meters_by_hour(self, day, mask=None):
+        """Meters created on ``day`` up to and including each hour (24 running totals)."""
+        created = self.created_at
+        start = np.datetime64(day, "D")
+        rows = (created >= start) & (created < start + np.timedelta64(1, "D"))
+        if mask is not None:
+            rows &= mask
+        hour = ((created[rows] - start) // np.timedelta64(1, "h")).astype(np.int64)
+        return np.cumsum(np.bincount(hour, weights=np.nan_to_num(self.lengths()[rows]), minlength=24))
+
+
+class SMBColumns:
+    """SMB records as arrays, sorted by (hole, to) for the depth join."""
+
+    def __init__(self, records, holes):
+        self.records = records
+        self.holes = holes
+        self.hole = holes.encode(norm_text(r.get("M_hole_id")) for r in records)
+        self.to = _floats([r.get("M_to") for r in records])
+        self.has_from = np.fromiter((r.get("M_from") is not None for r in records), dtype=bool, count=len(records))
+
+        # Stable sort: among equal (hole, to) the first record wins, as in ReconcileIndex
+        valid = np.flatnonzero(~np.isnan(self.to))
+        self.order = valid[np.lexsort((self.to[valid], self.hole[valid]))]
+
+
+def match_depths(batches, smb, tolerance=0):
+    """
+    For every row of ``batches`` (BatchColumns), the index in ``smb.records``
+    of its hole's record whose to is nearest within ``tolerance``, or -1, and
+    the to delta (machine minus OP, NaN without a match). Same choice as
+    ReconcileIndex.by_depth(): on a tie the deeper record wins.
+    """
+    n = len(batches)
+    matched = np.full(n, -1, dtype=np.int64)
+    delta = np.full(n, np.nan)
+    order = smb.order
+    if not len(order) or not n:
+        return matched, delta
+
+    s_hole, s_to = smb.hole[order], smb.to[order]
+    b_hole, b_to = batches.hole, batches.to
+    finite = ~np.isnan(b_to)
+
+    # (hole, to) as one sortable float: holes spaced further apart than any depth difference
+    low = min(s_to.min(), np.nanmin(b_to) if finite.any() else s_to.min())
+    high = max(s_to.max(), np.nanmax(b_to) if finite.any() else s_to.max())
+    span = (high - low) + 2 * tolerance + 1.0
+    s_key = s_hole * span + (s_to - low)
+    b_key = b_hole * span + (np.where(finite, b_to, low) - low)
+    pos = np.searchsorted(s_key, b_key, side="left")
+
+    limit = tolerance + _EPSILON
+    right = np.minimum(pos, len(order) - 1)
+    left = np.maximum(pos - 1, 0)
+    d_right = s_to[right] - b_to
+    d_left = s_to[left] - b_to
+    ok_right = finite & (pos < len(order)) & (s_hole[right] == b_hole) & (np.abs(d_right) <= limit)
+    ok_left = finite & (pos > 0) & (s_hole[left] == b_hole) & (np.abs(d_left) <= limit)
+
+    # The record at or after the depth is tried first; the one before wins only if strictly closer
+    take_left = ok_left & (~ok_right | (np.abs(d_left) < np.abs(d_right) - _EPSILON))
+    take_right = ok_right & ~take_left
+    matched[take_right] = order[right[take_right]]
+    matched[take_left] = order[left[take_left]]
+    delta[take_right] = np.round(d_right[take_right], 3)
+    delta[take_left] = np.round(d_left[take_left], 3)
+    return matched, delta
+
+
+def depth_statuses(batches, records, tolerance=0, found="correct", partial="in_progress", missing="pending"):
+    """
+    Status of each batch (dicts) from one vectorized join to the SMB
+    ``records``: ``found`` when its batch-<to> folder has depth.txt,
+    ``partial`` when the record has no from, ``missing`` without a record.
+    """
+    holes = Vocabulary()
+    smb = SMBColumns(records, holes)
+    matched, _ = match_depths(BatchColumns(batches, holes), smb, tolerance)
+    if not len(matched):
+        return []
+    has_from = smb.has_from[np.maximum(matched, 0)] if len(records) else np.zeros(len(matched), dtype=bool)
+    statuses = np.where(matched < 0, missing, np.where(has_from, found, partial))
+    return statuses.tolist()
+
+
+class ColumnCache:
+    """
+    BatchColumns of a store, rebuilt per partition. ``partitions()`` yields
+    ``(name, version, load)`` with ``load()`` returning that partition's
+    batches (PartitionedBatchStore.partitions); a partition is parsed again
+    only when its version changed.
+    """
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.holes = Vocabulary()
+        self.statuses = Vocabulary()
+        self._parts = {}  # name -> (version, BatchColumns)
+        self._columns = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            parts, key = {}, []
+            for name, version, load in self.partitions():
+                cached = self._parts.get(name)
+                if cached is None or cached[0] != version:
+                    cached = (version, BatchColumns(load(), self.holes, self.statuses))
+                parts[name] = cached
+                key.append((name, version))
+            self._parts = parts
+            if key != self._key:
+                # Earlier partitions (hot first) win for a batch found in two of them
+                self._columns = BatchColumns.concat([part for _, part in parts.values()], self.holes, self.statuses)
+                self._key = key
+            return self._columns
+
+
+def _floats(values):
+    """float64 array of ``values``; NaN for those float() does not take."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.fromiter((_float(v) for v in values), dtype=np.float64, count=len(values))
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _datetimes(values):
+    """datetime64[us] array of ISO strings; NaT for missing or invalid ones."""
+    try:
+        return np.array([v or "NaT" for v in values], dtype="datetime64[us]")
+    except (TypeError, ValueError):
+        return np.array([_datetime(v) for v in values], dtype="datetime64[us]")
+
+
+def _datetime(value):
+    try:
+        return np.datetime64(value or "NaT", "us")
+    except (TypeError, ValueError):
+        return np.datetime64("NaT")
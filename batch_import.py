@@ -0,0 +1,201 @@
+"""
+Bulk import of batches from CSV or NDJSON.
+
+Backfilling after an outage used to mean hundreds of single POSTs. Here a
+whole file is parsed and validated first; if any row is invalid nothing is
+written. Valid rows are checked against one SMB snapshot to get their
+status, and all of them are stored with a single ``add_many()`` call (one
+transaction, or one journal write).
+
+Columns / keys: ``hole_id``, ``from``, ``to`` (required), ``machine``,
+``comentarios`` and ``created_at`` (ISO date, default: now; an old date
+is kept, and the archiver files the batch under that month, see
+test_batch_import.py). Used by
+``POST /api/batches/import`` in app.py/fix23.py and by::
+
+    python batch_import.py batches.csv [--app fix23] [--dry-run]
+"""
+import argparse
+import csv
+import importlib
+import io
+import json
+import logging
+import sys
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("hole_id", "from", "to", "machine", "comentarios", "created_at")
+REQUIRED = ("hole_id", "from", "to")
+MAX_ROWS = 10000
+
+
+def detect_format(filename=None, content_type=None):
+    """'csv' or 'ndjson' from a file name or Content-Type; None if neither tells."""
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")) or "ndjson" in ctype or "json" in ctype:
+        return "ndjson"
+    if name.endswith((".csv", ".txt")) or "csv" in ctype:
+        return "csv"
+    return None
+
+
+def parse_batches(text, fmt):
+    """
+    Rows of a CSV (with header) or NDJSON text. Returns ``(rows, errors)``:
+    rows are ``(line, batch)`` for valid lines, errors ``{line, error}``.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [c for c in REQUIRED if c not in (reader.fieldnames or [])]
+        if missing:
+            return [], [{"line": 1, "error": f"Faltan columnas: {', '.join(missing)}"}]
+        entries = ((reader.line_num, row) for row in reader)
+    elif fmt == "ndjson":
+        entries = _ndjson_entries(text)
+    else:
+        raise ValueError(f"Formato no soportado: {fmt} (csv o ndjson)")
+
+    rows, errors = [], []
+    for line, entry in entries:
+        if len(rows) + len(errors) >= MAX_ROWS:
+            errors.append({"line": line, "error": f"Máximo {MAX_ROWS} filas por importación"})
+            break
+        try:
+            rows.append((line, _validate(entry)))
+        except ValueError as e:
+            errors.append({"line": line, "error": str(e)})
+    return rows, errors
+
+
+def import_batches(store, rows, status_of, skip_duplicates=True, dry_run=False):
+    """
+    Stores the parsed ``rows`` in one write. ``status_of(batch)`` gives each
+    batch its status (reconciled against SMB by the caller). Rows whose
+    hole_id/from/to already exist are skipped with ``skip_duplicates``.
+    Returns a summary with the imported batches.
+    """
+    now = datetime.now().isoformat()
+    existing = {}
+    new_batches, skipped = [], []
+    for line, batch in rows:
+        key = _key(batch)
+        if skip_duplicates:
+            hole = batch["hole_id"]
+            if hole not in existing:
+                existing[hole] = {_key(b) for b in store.find(hole_id=hole)}
+            if key in existing[hole]:
+                skipped.append({"line": line, "hole_id": hole, "from": batch["from"], "to": batch["to"]})
+                continue
+            existing[hole].add(key)
+        batch = dict(batch, created_at=batch.get("created_at") or now)
+        batch["status"] = status_of(batch)
+        new_batches.append(batch)
+
+    if not dry_run and new_batches:
+        new_batches = store.add_many(new_batches)
+        logger.info(f"Imported {len(new_batches)} batches ({len(skipped)} duplicates skipped)")
+
+    statuses = {}
+    for batch in new_batches:
+        statuses[batch["status"]] = statuses.get(batch["status"], 0) + 1
+    return {
+        "imported": 0 if dry_run else len(new_batches),
+        "valid": len(new_batches),
+        "skipped": skipped,
+        "statuses": statuses,
+        "dry_run": dry_run,
+        "batches": new_batches,
+    }
+
+
+def _ndjson_entries(text):
+    for line, raw in enumerate(text.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            entry = json.loads(raw)
+        except ValueError as e:
+            entry = e
+        yield line, entry
+
+
+def _validate(entry):
+    if isinstance(entry, Exception):
+        raise ValueError(f"JSON inválido: {entry}")
+    if not isinstance(entry, dict):
+        raise ValueError("Se esperaba un objeto JSON por línea")
+
+    batch = {}
+    for column in COLUMNS:
+        value = entry.get(column)
+        batch[column] = value.strip() if isinstance(value, str) else value
+    missing = [c for c in REQUIRED if batch[c] in (None, "")]
+    if missing:
+        raise ValueError(f"Falta {', '.join(missing)}")
+
+    try:
+        from_val, to_val = float(batch["from"]), float(batch["to"])
+    except (TypeError, ValueError):
+        raise ValueError(f"from/to no numéricos: {batch['from']!r}, {batch['to']!r}")
+    if from_val > to_val:
+        raise ValueError(f"from ({batch['from']}) mayor que to ({batch['to']})")
+
+    if batch["created_at"]:
+        try:
+            batch["created_at"] = datetime.fromisoformat(str(batch["created_at"])).isoformat()
+        except ValueError:
+            raise ValueError(f"created_at inválido: {batch['created_at']!r}")
+    batch["machine"] = batch["machine"] or ""
+    batch["comentarios"] = batch["comentarios"] or ""
+    return batch
+
+
+def _key(batch):
+    return _text(batch.get("hole_id")), _depth(batch.get("from")), _depth(batch.get("to"))
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _depth(value):
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV or NDJSON file ('-' for stdin)")
+    parser.add_argument("--app", default="app", choices=("app", "fix23"),
+                        help="module whose batch store and SMB data are used (default: app)")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    parser.add_argument("--dry-run", action="store_true", help="validate and reconcile without writing")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="import rows whose hole_id/from/to already exist")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+    if fmt is None:
+        parser.error("cannot tell the format from the file name, use --format")
+    if args.file == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.file, "r", encoding="utf-8-sig") as f:
+            text = f.read()
+
+    module = importlib.import_module(args.app)
+    result = module.import_batch_rows(text, fmt, dry_run=args.dry_run,
+                                      skip_duplicates=not args.keep_duplicates)
+    result.pop("batches", None)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if not result.get("errors") else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,746 @@
+"""
+Batch storage.
+
+batches.json was parsed whole on every request and rewritten whole on every
+change. Two stores replace it, with the same interface:
+
+SQLiteBatchStore (``BATCH_STORE=sqlite``, the default) keeps one row per
+batch in an SQLite database in WAL mode, so readers never wait for a writer,
+routes read single rows through the primary key or an index and writes touch
+only the rows that changed. Columns ``from``/``to`` keep whatever the form
+sent (text or number), other keys a batch may carry are kept as JSON in
+``extra``.
+
+JournalBatchStore (``BATCH_STORE=journal``) keeps plain files: every change
+is one line appended (and fsynced) to a JSONL journal, and a background
+compactor periodically folds the journal into a snapshot file. The folded
+records are appended to ``<journal>.history``, an audit trail of every
+change.
+
+Both return batches as the same dicts batches.json held. ``batch_number``
+is a stable ID: numbers are allocated in increasing order, never reused and
+never renumbered, so a delete touches one batch and a page or URL keyed by
+number keeps pointing at the same batch. The 1..N numbers the tables show
+are ``display_number``, computed for the page being served. Reads are served
+from an in-memory BatchView (the parsed list plus indexes by number and
+hole). A store applies its own writes to its view; the view is reloaded
+only when the stored version shows that another process wrote. On first start an existing
+batches.json is imported once and renamed to ``batches.json.migrated``.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Keys with their own column; anything else goes to ``extra``
+FIELDS = ("batch_number", "hole_id", "from", "to", "machine", "comentarios", "status", "created_at")
+_COLUMNS = {"from": "from_value", "to": "to_value"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    batch_number INTEGER PRIMARY KEY,
+    hole_id TEXT,
+    from_value,
+    to_value,
+    machine TEXT,
+    comentarios TEXT,
+    status TEXT,
+    created_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_batches_hole_id ON batches (hole_id);
+CREATE INDEX IF NOT EXISTS idx_batches_hole_to ON batches (hole_id, to_value);
+CREATE INDEX IF NOT EXISTS idx_batches_status ON batches (status);
+CREATE INDEX IF NOT EXISTS idx_batches_created_at ON batches (created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _column(field):
+    return _COLUMNS.get(field, field)
+
+
+_SELECT = "SELECT " + ", ".join(_column(f) for f in FIELDS) + ", extra FROM batches"
+
+
+class BatchView:
+    """
+    Immutable in-memory copy of every batch at one store ``version``: the list
+    in batch_number order plus the indexes reads need. Shared by all
+    threads; never modify the batches it holds.
+    """
+
+    def __init__(self, version, batches, by_number=None, by_hole=None):
+        self.version = version
+        self.batches = batches
+        if by_number is None:
+            by_number = {b["batch_number"]: b for b in batches}
+        self.by_number = by_number
+        if by_hole is None:
+            by_hole = defaultdict(list)
+            for batch in batches:
+                by_hole[batch.get("hole_id")].append(batch)
+        self.by_hole = by_hole
+        self._by_created = None
+
+    def apply(self, version, changes):
+        """
+        New view at ``version`` with ``changes`` (batch_number -> batch, or
+        None when it was deleted) applied, without reloading the store. Only
+        the holes of the changed batches are re-indexed.
+        """
+        by_number = dict(self.by_number)
+        holes = set()
+        for number, batch in changes.items():
+            old = by_number.pop(number, None)
+            if old is not None:
+                holes.add(old.get("hole_id"))
+            if batch is not None:
+                by_number[number] = batch
+                holes.add(batch.get("hole_id"))
+
+        batches = [by_number[b["batch_number"]] for b in self.batches if b["batch_number"] in by_number]
+        added = sorted(n for n, b in changes.items() if b is not None and n not in self.by_number)
+        batches.extend(by_number[n] for n in added)
+        if added and len(batches) > len(added) and added[0] < batches[-len(added) - 1]["batch_number"]:
+            # A restored batch keeps its old, lower number
+            batches.sort(key=_number)
+
+        by_hole = defaultdict(list, self.by_hole)
+        for hole in holes:
+            kept = [by_number[b["batch_number"]] for b in self.by_hole.get(hole, ())
+                    if b["batch_number"] not in changes]
+            kept.extend(b for b in changes.values() if b is not None and b.get("hole_id") == hole)
+            if kept:
+                by_hole[hole] = sorted(kept, key=_number)
+            else:
+                by_hole.pop(hole, None)
+        return BatchView(version, batches, by_number, by_hole)
+
+    def by_created(self):
+        """Newest created_at first (ties: highest batch_number first)."""
+        if self._by_created is None:
+            self._by_created = sorted(
+                reversed(self.batches), key=lambda b: b.get("created_at") or "", reverse=True
+            )
+        return self._by_created
+
+
+class BatchStore:
+    """
+    Reads shared by the stores, answered from ``self.view()``. They return
+    copies, so callers may add keys (machine_values, ...) freely.
+    """
+
+    def view(self):
+        raise NotImplementedError
+
+    def version(self):
+        return self.view().version
+
+    def all(self, newest_first=False):
+        batches = self.view().batches
+        return [dict(b) for b in (reversed(batches) if newest_first else batches)]
+
+    def count(self):
+        return len(self.view().batches)
+
+    def get(self, batch_number):
+        batch = self.view().by_number.get(batch_number)
+        return dict(batch) if batch else None
+
+    def page(self, page, per_page, order="batch_number", newest_first=True):
+        """
+        One page by ``order`` (batch_number or created_at), newest first
+        unless ``newest_first`` is False. Returns (batches, total).
+        """
+        view = self.view()
+        if order == "batch_number":
+            ordered, reverse = view.batches, newest_first
+        elif order == "created_at":
+            ordered, reverse = view.by_created(), not newest_first
+        else:
+            raise ValueError(f"Unsupported order: {order}")
+        offset = max(page - 1, 0) * per_page
+        total = len(ordered)
+        if reverse:
+            # Slice the window from the other end; only the page is copied
+            end = max(total - offset, 0)
+            rows = ordered[max(end - per_page, 0):end][::-1]
+        else:
+            rows = ordered[offset:offset + per_page]
+        if newest_first:
+            return number_page(rows, total - offset, -1), total
+        return number_page(rows, offset + 1), total
+
+    def find(self, hole_id=None, to=None, status=None, exclude_status=None,
+             created_from=None, created_to=None, newest_first=False):
+        """
+        Batches matching every given filter. ``created_from``/``created_to``
+        are ISO strings (from inclusive, to exclusive).
+        """
+        view = self.view()
+        batches = view.batches if hole_id is None else view.by_hole.get(hole_id, [])
+        found = [dict(b) for b in batches
+                 if batch_matches(b, None, to, status, exclude_status, created_from, created_to)]
+        return found[::-1] if newest_first else found
+
+
+class SQLiteBatchStore(BatchStore):
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._view = None
+        self._view_lock = threading.Lock()
+        # batch_numbers written by the open transaction, None when unknown (replace_all)
+        self._changed = set()
+
+        self._db().executescript(_SCHEMA)
+        if json_path:
+            self.migrate_json(json_path)
+
+    def view(self):
+        """
+        The cached BatchView, reloaded in one read transaction when the
+        version row differs from the view's. Writes through this store patch
+        the view and give it the version they produced, so only writes from
+        another connection or process cause a reload.
+        """
+        db = self._db()
+        version = _version(db)
+        view = self._view
+        if view is not None and view.version == version:
+            return view
+        with self._view_lock:
+            view = self._view
+            db.execute("BEGIN")
+            try:
+                version = _version(db)
+                if view is None or view.version != version:
+                    view = BatchView(version, self._query(f"{_SELECT} ORDER BY batch_number"))
+                    self._view = view
+            finally:
+                db.execute("COMMIT")
+        return view
+
+    # ------------------------------------------------------------------
+    # Writes
+
+    def add(self, batch):
+        """Inserts a batch with the next batch_number (never a deleted one's). Returns it."""
+        return self.add_many([batch])[0]
+
+    def add_many(self, batches):
+        """Inserts several batches, numbered in order, in one transaction. Returns them."""
+        with self._write() as db:
+            last = db.execute(
+                "SELECT MAX(COALESCE((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'last_batch_number'), 0), "
+                "COALESCE((SELECT MAX(batch_number) FROM batches), 0))"
+            ).fetchone()[0]
+            batches = [dict(batch, batch_number=last + i) for i, batch in enumerate(batches, start=1)]
+            for batch in batches:
+                db.execute(*_insert(batch))
+                self._changed.add(batch["batch_number"])
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_batch_number', ?)",
+                       (last + len(batches),))
+        return batches
+
+    def update(self, batch_number, fields):
+        """Updates some fields of one batch. Returns the batch, or None if it does not exist."""
+        with self._write() as db:
+            batch = self._get(db, batch_number)
+            if batch is None:
+                return None
+            batch.update(fields)
+            batch["batch_number"] = batch_number
+            db.execute(*_update(batch))
+            self._changed.add(batch_number)
+        return batch
+
+    def update_many(self, changes):
+        """``{batch_number: fields}`` in one transaction. Returns the number of batches updated."""
+        updated = 0
+        with self._write() as db:
+            for batch_number, fields in changes.items():
+                batch = self._get(db, batch_number)
+                if batch is None:
+                    continue
+                batch.update(fields)
+                batch["batch_number"] = batch_number
+                db.execute(*_update(batch))
+                self._changed.add(batch_number)
+                updated += 1
+        return updated
+
+    def delete(self, batch_number):
+        """Deletes one batch; the others keep their numbers. Returns False if it did not exist."""
+        with self._write() as db:
+            deleted = db.execute("DELETE FROM batches WHERE batch_number = ?", (batch_number,)).rowcount
+            self._changed.add(batch_number)
+        return bool(deleted)
+
+    def put(self, batch):
+        """Inserts or replaces a batch keeping its batch_number (restoring an archived batch)."""
+        with self._write() as db:
+            db.execute(*_insert(batch, replace=True))
+            self._changed.add(batch["batch_number"])
+
+    def delete_many(self, batch_numbers):
+        """Deletes several batches in one transaction. Returns how many existed."""
+        with self._write() as db:
+            self._changed.update(batch_numbers)
+            return sum(db.execute("DELETE FROM batches WHERE batch_number = ?", (n,)).rowcount
+                       for n in batch_numbers)
+
+    def replace_all(self, batches):
+        """Replaces the whole table (save_batches() compatibility)."""
+        with self._write() as db:
+            self._changed = None
+            db.execute("DELETE FROM batches")
+            for batch in batches:
+                db.execute(*_insert(batch))
+
+    def migrate_json(self, json_path):
+        """
+        Imports batches.json once, when the table is still empty, and renames
+        it so it is not imported again.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        with self._write() as db:
+            if db.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+                return 0
+            if db.execute("SELECT COUNT(*) FROM batches").fetchone()[0]:
+                return 0
+
+            with open(json_path, "r") as f:
+                batches = json.load(f)
+
+            self._changed = None
+            for batch in _numbered(batches):
+                db.execute(*_insert(batch))
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (os.path.abspath(json_path),))
+
+        os.replace(json_path, json_path + ".migrated")
+        logger.info(f"Migrated {len(batches)} batches from {json_path} to {self.path}")
+        return len(batches)
+
+    # ------------------------------------------------------------------
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        """
+        One IMMEDIATE transaction: other writers (threads or processes) wait,
+        readers do not. The rows it changed are read back before the commit
+        and applied to the cached view.
+        """
+        db = self._db()
+        with self._write_lock:
+            self._changed = set()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                # Every write moves the version, so views cached by other processes reload
+                db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+                )
+                version = _version(db)
+                changes = None
+                if self._changed is not None:
+                    changes = {n: self._get(db, n) for n in self._changed}
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+            with self._view_lock:
+                view = self._view
+                # A view older than this transaction's start has to reload anyway
+                if changes is not None and view is not None and view.version == version - 1:
+                    self._view = view.apply(version, changes)
+
+    def _query(self, sql, params=()):
+        return [_to_batch(row) for row in self._db().execute(sql, params)]
+
+    def _get(self, db, batch_number):
+        row = db.execute(f"{_SELECT} WHERE batch_number = ?", (batch_number,)).fetchone()
+        return _to_batch(row) if row else None
+
+
+class JournalBatchStore(BatchStore):
+    """
+    Batches in ``snapshot_path`` plus the changes appended to ``journal_path``
+    since then. The state is kept in memory and caught up with the journal
+    tail before each operation, so several processes can share the files;
+    writers serialize on ``<journal>.lock``.
+
+    Journal records: ``create`` (batch), ``update`` (batch_number, fields),
+    ``delete`` (batch_number) and ``replace`` (batches), each with
+    ``seq`` and ``at``. The snapshot stores the seq it includes, so records
+    are never applied twice.
+    """
+
+    def __init__(self, journal_path, snapshot_path, json_path=None, compact_interval=300):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.compact_interval = compact_interval
+        self._lock_path = journal_path + ".lock"
+        self._history_path = journal_path + ".history"
+        self._batches = {}
+        self._seq = 0
+        self._last_number = 0
+        self._snapshot_seq = 0
+        self._snapshot_stamp = None
+        self._journal_ino = None
+        self._offset = 0
+        self._view = None
+        # batch_numbers changed since the view was built, None when it has to be rebuilt
+        self._changed = None
+        self._lock = threading.RLock()
+
+        if json_path:
+            self.migrate_json(json_path)
+        with self._lock:
+            self._catch_up()
+        if compact_interval:
+            threading.Thread(target=self._compact_loop, name="batch-compactor", daemon=True).start()
+
+    def view(self):
+        """
+        The cached BatchView at the journal's seq. Journal records applied
+        since it was built (this process's writes or another's) patch it;
+        it is rebuilt only after a replace or a snapshot written elsewhere.
+        """
+        with self._lock:
+            self._catch_up()
+            if self._view is None or self._view.version != self._seq:
+                if self._view is None or self._changed is None:
+                    batches = [dict(b) for b in sorted(self._batches.values(), key=_number)]
+                    self._view = BatchView(self._seq, batches)
+                else:
+                    changes = {n: dict(self._batches[n]) if n in self._batches else None for n in self._changed}
+                    self._view = self._view.apply(self._seq, changes)
+                self._changed = set()
+            return self._view
+
+    # ------------------------------------------------------------------
+    # Writes
+
+    def add(self, batch):
+        return self.add_many([batch])[0]
+
+    def add_many(self, batches):
+        """One journal write (and fsync) for all of them."""
+        with self._write():
+            last = max(self._last_number, max(self._batches, default=0))
+            batches = [dict(batch, batch_number=last + i) for i, batch in enumerate(batches, start=1)]
+            if batches:
+                self._append([{"op": "create", "batch": batch} for batch in batches])
+        return [dict(batch) for batch in batches]
+
+    def update(self, batch_number, fields):
+        with self._write():
+            if batch_number not in self._batches:
+                return None
+            self._append([{"op": "update", "batch_number": batch_number, "fields": fields}])
+            return dict(self._batches[batch_number])
+
+    def update_many(self, changes):
+        with self._write():
+            records = [{"op": "update", "batch_number": n, "fields": fields}
+                       for n, fields in changes.items() if n in self._batches]
+            if records:
+                self._append(records)
+        return len(records)
+
+    def delete(self, batch_number):
+        with self._write():
+            if batch_number not in self._batches:
+                return False
+            self._append([{"op": "delete", "batch_number": batch_number}])
+        return True
+
+    def put(self, batch):
+        with self._write():
+            self._append([{"op": "create", "batch": batch}])
+
+    def delete_many(self, batch_numbers):
+        with self._write():
+            records = [{"op": "delete", "batch_number": n} for n in batch_numbers if n in self._batches]
+            if records:
+                self._append(records)
+        return len(records)
+
+    def replace_all(self, batches):
+        with self._write():
+            self._append([{"op": "replace", "batches": list(batches)}])
+
+    def migrate_json(self, json_path):
+        """Writes batches.json as the first snapshot if there is no snapshot or journal yet."""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock, self._file_lock():
+            if os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path):
+                return 0
+            with open(json_path, "r") as f:
+                batches = _numbered(json.load(f))
+            _atomic_write_json(self.snapshot_path, {"seq": 0, "batches": batches})
+        os.replace(json_path, json_path + ".migrated")
+        logger.info(f"Migrated {len(batches)} batches from {json_path} to {self.snapshot_path}")
+        return len(batches)
+
+    def compact(self):
+        """
+        Folds the journal into the snapshot: writes the current state, moves
+        the journal lines to the history file and starts an empty journal.
+        Returns the number of records folded.
+        """
+        with self._lock, self._file_lock():
+            self._catch_up()
+            if not self._offset:
+                return 0
+            records = self._seq - self._snapshot_seq
+            _atomic_write_json(self.snapshot_path, {
+                "seq": self._seq,
+                "last_batch_number": self._last_number,
+                "batches": sorted(self._batches.values(), key=_number),
+            })
+            with open(self.journal_path, "rb") as src, open(self._history_path, "ab") as dst:
+                dst.write(src.read(self._offset))
+            fd, tmp_path = tempfile.mkstemp(prefix=".journal-", dir=os.path.dirname(os.path.abspath(self.journal_path)))
+            os.close(fd)
+            os.replace(tmp_path, self.journal_path)
+            # Same state as before: follow the new files without reloading the snapshot
+            self._snapshot_stamp = _stamp(self.snapshot_path)
+            self._snapshot_seq = self._seq
+            self._journal_ino, self._offset = os.stat(self.journal_path).st_ino, 0
+        logger.info(f"Compacted {records} journal records into {self.snapshot_path}")
+        return records
+
+    # ------------------------------------------------------------------
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Batch journal compaction failed: {e}")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def _write(self):
+        with self._lock, self._file_lock():
+            self._catch_up()
+            yield
+
+    def _append(self, records):
+        """Writes records to the journal (one write + fsync), then applies them; caller holds both locks."""
+        at = datetime.now().isoformat(timespec="seconds")
+        records = [dict(r, seq=self._seq + i, at=at) for i, r in enumerate(records, start=1)]
+        data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+        with open(self.journal_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            ino, offset = os.fstat(f.fileno()).st_ino, f.tell()
+        for record in records:
+            self._apply(record)
+        self._journal_ino, self._offset = ino, offset
+
+    def _catch_up(self):
+        """Reloads the snapshot if it changed and applies new journal lines; caller holds self._lock."""
+        try:
+            journal = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            journal = None
+        try:
+            ino = os.fstat(journal.fileno()).st_ino if journal else None
+            if ino != self._journal_ino or _stamp(self.snapshot_path) != self._snapshot_stamp:
+                self._load_snapshot()
+                self._journal_ino, self._offset = ino, 0
+            if journal is None:
+                return
+            journal.seek(self._offset)
+            data = journal.read()
+            # A line still being written by another process is read next time
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                record = json.loads(line)
+                if record["seq"] > self._seq:
+                    self._apply(record)
+            self._offset += len(complete)
+        finally:
+            if journal:
+                journal.close()
+
+    def _load_snapshot(self):
+        self._snapshot_stamp = _stamp(self.snapshot_path)
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            snapshot = {"seq": 0, "batches": []}
+        self._batches = {b["batch_number"]: b for b in snapshot["batches"]}
+        self._seq = self._snapshot_seq = snapshot["seq"]
+        self._changed = None
+        self._last_number = snapshot.get("last_batch_number", 0)
+
+    def _apply(self, record):
+        _apply(self._batches, record)
+        op = record["op"]
+        if op == "create":
+            self._last_number = max(self._last_number, record["batch"]["batch_number"])
+        if op == "replace":
+            self._changed = None
+        elif self._changed is not None:
+            self._changed.add(record["batch"]["batch_number"] if op == "create" else record["batch_number"])
+        self._seq = record["seq"]
+
+
+def open_batch_store(kind, json_path=None, db_path="batches.db", journal_path="batches.journal.jsonl",
+                     snapshot_path="batches.snapshot.json", compact_interval=300):
+    """Store selected by ``BATCH_STORE``: ``sqlite`` or ``journal``."""
+    if kind == "sqlite":
+        return SQLiteBatchStore(db_path, json_path=json_path)
+    if kind == "journal":
+        return JournalBatchStore(journal_path, snapshot_path, json_path=json_path, compact_interval=compact_interval)
+    raise ValueError(f"Unknown batch store: {kind} (use 'sqlite' or 'journal')")
+
+
+def _apply(batches, record):
+    op = record["op"]
+    if op == "create":
+        batch = record["batch"]
+        batches[batch["batch_number"]] = dict(batch)
+    elif op == "update":
+        batch = batches.get(record["batch_number"])
+        if batch is not None:
+            batch.update(record["fields"])
+            batch["batch_number"] = record["batch_number"]
+    elif op == "delete":
+        batches.pop(record["batch_number"], None)
+    elif op == "replace":
+        batches.clear()
+        batches.update((b["batch_number"], dict(b)) for b in record["batches"])
+
+
+def batch_matches(batch, hole_id=None, to=None, status=None, exclude_status=None,
+                  created_from=None, created_to=None):
+    """The filters of BatchStore.find() for one batch (None = any)."""
+    created_at = batch.get("created_at") or ""
+    return ((hole_id is None or batch.get("hole_id") == hole_id)
+            and (to is None or batch.get("to") == to)
+            and (status is None or batch.get("status") == status)
+            and (exclude_status is None or batch.get("status") != exclude_status)
+            and (created_from is None or created_at >= created_from)
+            and (created_to is None or created_at < created_to))
+
+
+def number_page(batches, first, step=1):
+    """
+    Copies of a page of batches with ``display_number`` (the row number the
+    tables show): ``first`` for the first row, then ``first + step``, ...
+    """
+    return [dict(b, display_number=first + i * step) for i, b in enumerate(batches)]
+
+
+def _number(batch):
+    return batch["batch_number"]
+
+
+def _numbered(batches):
+    """Keeps the batch numbers of an imported list if they are unique, else numbers by position."""
+    numbers = [b.get("batch_number") for b in batches]
+    if all(isinstance(n, int) and n > 0 for n in numbers) and len(set(numbers)) == len(numbers):
+        return batches
+    return [dict(b, batch_number=position) for position, b in enumerate(batches, start=1)]
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _atomic_write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".batches-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _version(db):
+    row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _to_batch(row):
+    batch = dict(zip(FIELDS, row[:-1]))
+    if row[-1]:
+        batch.update(json.loads(row[-1]))
+    return batch
+
+
+def _row_values(batch):
+    extra = {k: v for k, v in batch.items() if k not in FIELDS}
+    return [batch.get(f) for f in FIELDS] + [json.dumps(extra) if extra else None]
+
+
+def _insert(batch, replace=False):
+    columns = [_column(f) for f in FIELDS] + ["extra"]
+    placeholders = ", ".join("?" for _ in columns)
+    verb = "INSERT OR REPLACE" if replace else "INSERT"
+    return f"{verb} INTO batches ({', '.join(columns)}) VALUES ({placeholders})", _row_values(batch)
+
+
+def _update(batch):
+    columns = [_column(f) for f in FIELDS[1:]] + ["extra"]
+    assignments = ", ".join(f"{c} = ?" for c in columns)
+    values = _row_values(batch)
+    return f"UPDATE batches SET {assignments} WHERE batch_number = ?", values[1:] + [values[0]]
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the NumPy columns (batch_columns.py) against the per-record loops.
+
+Generates ``<size>`` batches spread over ``--years`` years and SMB records
+for most of them (some a centimetre off), then times for each size:
+
+- reconcile: every batch matched to the SMB records by hole and depth
+  within ``--tolerance`` (ReconcileIndex.by_depth vs match_depths);
+- total: meters of the 'correct' batches (calculate_metros_escaneados);
+- charts: hourly and 30-day meters of /api/metros_data.
+
+Column build time is reported apart: ColumnCache parses a partition once
+and reuses it until the partition changes.
+
+    python bench_columns.py --sizes 100000,1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import batch_columns
+from reconcile import ReconcileIndex
+
+
+def generate(size, years, seed=0):
+    """``size`` batches and the SMB records of ~90% of them, 50 batches per hole."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    minutes = int(years * 365 * 24 * 60)
+    batches, records = [], []
+    for n in range(size):
+        hole = f"HOLE_{n // 50:06d}"
+        depth = (n % 50) * 3.0
+        length = round(rng.uniform(0.5, 3.0), 2)
+        to = f"{depth + length:.2f}"
+        batches.append({
+            "batch_number": n + 1,
+            "hole_id": hole,
+            "from": f"{depth:.2f}",
+            "to": to,
+            "machine": "OREXPLORE",
+            "status": rng.choice(("correct", "correct", "correct", "pending", "incorrect")),
+            "created_at": (now - timedelta(minutes=rng.randint(0, minutes))).isoformat(),
+        })
+        if rng.random() < 0.9:
+            # Hand-typed depths are sometimes a centimetre off the scanner's
+            machine_to = f"{depth + length + rng.choice((0, 0, 0, 0.01)):.2f}"
+            records.append({"M_hole_id": hole, "M_from": f"{depth:.2f}", "M_to": machine_to, "M_machine": "OREXPLORE"})
+    rng.shuffle(records)
+    return batches, records, now
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def python_reconcile(batches, records, tolerance):
+    index = ReconcileIndex(records)
+    return sum(1 for b in batches if index.by_depth(b["hole_id"], b["to"], tolerance) is not None)
+
+
+def python_total(batches):
+    total = 0
+    for batch in batches:
+        if batch.get("status") == "correct":
+            try:
+                total += float(batch.get("to", 0)) - float(batch.get("from", 0))
+            except (TypeError, ValueError):
+                pass
+    return round(total, 2)
+
+
+def python_charts(batches, now):
+    """The loops of /api/metros_data over the batches find() returns for the last 30 days."""
+    first_day = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
+    first = first_day.isoformat()
+    recent = [b for b in batches if b["status"] == "correct" and b["created_at"] >= first]
+
+    hourly = []
+    for hour in range(24):
+        metros = 0
+        for batch in recent:
+            batch_time = datetime.fromisoformat(batch["created_at"])
+            if batch_time.date() == now.date() and batch_time.hour <= hour:
+                metros += float(batch["to"]) - float(batch["from"])
+        hourly.append(round(metros, 2))
+
+    daily = []
+    for day in range(30):
+        date_point = now - timedelta(days=29 - day)
+        metros = 0
+        for batch in recent:
+            if datetime.fromisoformat(batch["created_at"]).date() == date_point.date():
+                metros += float(batch["to"]) - float(batch["from"])
+        daily.append(round(metros, 2))
+    return hourly, daily
+
+
+def numpy_build(batches, records):
+    holes = batch_columns.Vocabulary()
+    return batch_columns.BatchColumns(batches, holes), batch_columns.SMBColumns(records, holes)
+
+
+def numpy_charts(columns, now):
+    first_day = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
+    mask = columns.mask(status="correct", created_from=first_day)
+    hourly = columns.meters_by_hour(now, mask)
+    daily = columns.meters_by_day(first_day, 30, mask)
+    return [round(float(m), 2) for m in hourly], [round(float(m), 2) for m in daily]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000", help="comma separated batch counts")
+    parser.add_argument("--years", type=float, default=3.0, help="history spread of created_at")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="depth tolerance in meters")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not batch_columns.available():
+        parser.error("NumPy is not installed")
+
+    print(f"{'batches':>9} {'step':>10} {'python s':>9} {'numpy s':>9} {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        batches, records, now = generate(size, args.years, args.seed)
+        build, (columns, smb) = timed(lambda: numpy_build(batches, records))
+
+        steps = [
+            ("reconcile",
+             lambda: python_reconcile(batches, records, args.tolerance),
+             lambda: int((batch_columns.match_depths(columns, smb, args.tolerance)[0] >= 0).sum())),
+            ("total",
+             lambda: python_total(batches),
+             lambda: round(columns.meters(columns.mask(status="correct")), 2)),
+            ("charts",
+             lambda: python_charts(batches, now),
+             lambda: numpy_charts(columns, now)),
+        ]
+        for name, python_fn, numpy_fn in steps:
+            python_s, expected = timed(python_fn)
+            numpy_s, result = timed(numpy_fn)
+            if result != expected:
+                print(f"  {name}: results differ ({expected!r:.60} vs {result!r:.60})")
+            print(f"{size:>9} {name:>10} {python_s:>9.3f} {numpy_s:>9.4f} {python_s / numpy_s:>7.0f}x")
+        print(f"{size:>9} {'build':>10} {'':>9} {build:>9.3f}   (once per partition change)")
+
+
+if __name__ == "__main__":
+    main()
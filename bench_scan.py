@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Orexplore scanner on a generated local tree.
+
+Builds ``<holes>`` hole directories with ``<batches>`` batch folders each in
+the same layout as the SMB share and scans them with LocalBackend:
+
+    python bench_scan.py --holes 200 --batches 50 --workers 1,4,8 --latency 2
+
+``--latency`` (milliseconds) is added to every directory listing and file
+read to stand in for the round trip to the file server; without it the
+numbers only reflect local disk and parsing cost.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from local_backend import LocalBackend
+from smb_scanner import DEPTH_FILE, OrexploreScanner, depth_record
+
+
+def generate_fixture(root, holes, batches, pending=0.0, seed=0):
+    """
+    Writes holes x batches batch folders under root. A ``pending`` fraction
+    of batch folders get no depth.txt, like batches still being scanned.
+    Returns the number of depth.txt files written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    for h in range(holes):
+        hole_dir = os.path.join(root, f"HOLE_{h:05d}")
+        os.makedirs(hole_dir, exist_ok=True)
+        depth = 0.0
+        for _ in range(batches):
+            length = round(rng.uniform(0.5, 3.0), 2)
+            batch_dir = os.path.join(hole_dir, f"batch-{depth + length:.2f}")
+            os.makedirs(batch_dir, exist_ok=True)
+            if rng.random() >= pending:
+                with open(os.path.join(batch_dir, DEPTH_FILE), "w") as f:
+                    f.write(f"{depth:.2f}\n")
+                written += 1
+            depth = round(depth + length, 2)
+    return written
+
+
+def time_scan(scanner):
+    started = time.perf_counter()
+    records = scanner.scan()
+    return time.perf_counter() - started, records
+
+
+def parse_cost(root, repeat=3):
+    """Seconds per depth.txt spent in depth_record(), file I/O excluded."""
+    samples = []
+    for hole in os.listdir(root):
+        for batch in os.listdir(os.path.join(root, hole)):
+            path = os.path.join(root, hole, batch, DEPTH_FILE)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    samples.append((hole, batch, f.read()))
+    if not samples:
+        return 0.0
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for hole, batch, raw in samples:
+            depth_record(hole, batch, raw)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--holes", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=50, help="batch folders per hole")
+    parser.add_argument("--pending", type=float, default=0.0, help="fraction of batches without depth.txt")
+    parser.add_argument("--workers", default="1,4,8", help="comma separated worker counts")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated round trip per request, in ms")
+    parser.add_argument("--dir", help="fixture directory (kept; generated only if empty)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    root = args.dir or tempfile.mkdtemp(prefix="orexplore-bench-")
+    os.makedirs(root, exist_ok=True)
+    try:
+        if not os.listdir(root):
+            started = time.perf_counter()
+            written = generate_fixture(root, args.holes, args.batches, args.pending, args.seed)
+            print(f"fixture: {args.holes} holes x {args.batches} batches, {written} depth.txt "
+                  f"in {time.perf_counter() - started:.1f}s ({root})")
+        else:
+            print(f"fixture: reusing {root}")
+
+        backend = LocalBackend(root, latency=args.latency / 1000.0)
+        print(f"latency: {args.latency} ms per request")
+        print(f"parse cost: {parse_cost(root) * 1e6:.2f} us per depth.txt")
+        print()
+        print(f"{'workers':>7} {'cold s':>9} {'batches/s':>11} {'warm s':>9} {'records':>8}")
+
+        worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+        for workers in worker_counts:
+            scanner = OrexploreScanner(backend, "", depth_record, workers=workers)
+            cold, records = time_scan(scanner)
+            warm, _ = time_scan(scanner)
+            rate = len(records) / cold if cold else 0
+            print(f"{workers:>7} {cold:>9.3f} {rate:>11.0f} {warm:>9.3f} {len(records):>8}")
+
+        tracemalloc.start()
+        scanner = OrexploreScanner(backend, "", depth_record, workers=max(worker_counts))
+        scanner.scan()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print()
+        print(f"peak memory during a cold scan: {peak / 1024 / 1024:.1f} MiB "
+              f"(manifest of {len(scanner.manifest)} holes)")
+    finally:
+        if not args.dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
@@ -10,10 +10,6 @@ import smbprotocol
 from smbprotocol.connection import Connection
 from smbprotocol.session import Session
 from smbprotocol.tree import TreeConnect
-from smbprotocol.open import Open, CreateDisposition
-from smbprotocol.exceptions import SMBException
-from smbprotocol.open import ImpersonationLevel
-from smbprotocol.file_info import FileInformationClass
 
 # Logueos
 import logging
@@ -22,6 +18,12 @@ import os
 import threading
 import time
 
+import batch_columns
+from batch_archive import PartitionedBatchStore
+from batch_import import detect_format, import_batches, parse_batches
+from batch_store import open_batch_store
+from smb_pool import get_pool
+
 
 # =========================================================
 # SMB CONNECTION
@@ -58,6 +60,18 @@ app.secret_key = "your-secret-key-change-this-in-production"
 
 USERS_FILE = "users.json"
 BATCHES_FILE = "batches.json"
+# Almacenamiento de batches: "sqlite" (BATCHES_DB) o "journal" (BATCHES_JOURNAL
+# solo-append, compactado en BATCHES_SNAPSHOT). batches.json se migra una sola vez.
+BATCH_STORE = os.environ.get("BATCH_STORE", "sqlite")
+BATCHES_DB = os.environ.get("BATCHES_DB", "batches.db")
+BATCHES_JOURNAL = os.environ.get("BATCHES_JOURNAL", "batches.journal.jsonl")
+BATCHES_SNAPSHOT = os.environ.get("BATCHES_SNAPSHOT", "batches.snapshot.json")
+BATCHES_COMPACT_INTERVAL = int(os.environ.get("BATCHES_COMPACT_INTERVAL", 300))
+# Batches de meses cerrados (más antiguos que BATCHES_HOT_MONTHS y no pendientes)
+# se archivan en un archivo comprimido por mes en BATCHES_ARCHIVE_DIR (0 = no archivar)
+BATCHES_ARCHIVE_DIR = os.environ.get("BATCHES_ARCHIVE_DIR", "batches_archive")
+BATCHES_HOT_MONTHS = int(os.environ.get("BATCHES_HOT_MONTHS", 2))
+BATCHES_ARCHIVE_INTERVAL = int(os.environ.get("BATCHES_ARCHIVE_INTERVAL", 3600))
 SMB_PATH = "//orexplorefs04.local/pond/incoming/Orexplore/"
 
 # =========================================================
@@ -109,13 +123,28 @@ def init_data_files():
         with open(USERS_FILE, "w") as f:
             json.dump(users, f, indent=4)
 
-    if not os.path.exists(BATCHES_FILE):
-        with open(BATCHES_FILE, "w") as f:
-            json.dump([], f)
-
 
 init_data_files()
 
+# Cada ruta lee/escribe solo los batches que usa, sin reescribir el archivo completo.
+# Las lecturas habituales solo ven la partición caliente (recientes y pendientes).
+batch_store = PartitionedBatchStore(
+    open_batch_store(
+        BATCH_STORE,
+        json_path=BATCHES_FILE,
+        db_path=BATCHES_DB,
+        journal_path=BATCHES_JOURNAL,
+        snapshot_path=BATCHES_SNAPSHOT,
+        compact_interval=BATCHES_COMPACT_INTERVAL,
+    ),
+    BATCHES_ARCHIVE_DIR,
+    hot_months=BATCHES_HOT_MONTHS,
+    archive_interval=BATCHES_ARCHIVE_INTERVAL if BATCHES_HOT_MONTHS else 0,
+)
+
+# Columnas NumPy de todos los batches para metros y gráficos (None si no hay NumPy)
+batch_columns_cache = batch_columns.ColumnCache(batch_store.partitions) if batch_columns.available() else None
+
 
 # =========================================================
 # DATA LOAD/SAVE UTILITIES
@@ -133,20 +162,13 @@ def save_users(users):
 
 
 def load_batches():
-    """Carga y renumera en orden ASCENDENTE siempre."""
-    with open(BATCHES_FILE, "r") as f:
-        batches = json.load(f)
-
-    # Renumerar ASCENDENTE
-    for i, b in enumerate(batches, start=1):
-        b["batch_number"] = i
-
-    return batches
+    """Todos los batches, archivados incluidos, en orden ASCENDENTE de batch_number (ID estable)."""
+    return batch_store.all(include_archive=True)
 
 
 def save_batches(batches):
-    with open(BATCHES_FILE, "w") as f:
-        json.dump(batches, f, indent=4)
+    """Reemplaza todos los batches; en código nuevo usar batch_store.add/update/delete."""
+    batch_store.replace_all(batches)
 
 
 # =========================================================
@@ -176,11 +198,49 @@ def check_file_values(hole_id, from_val, to_val, machine):
         return False
 
 
-def get_preview_image(hole_id, to_val):
-    try:
-        return f"smb://172.16.11.107/pond/incoming/Orexplore/{hole_id}/batch-{to_val}/sample-1/rec-low-res-thumb-x.jpg"
-    except:
-        return None
+def get_preview_image(batch):
+    """
+    Miniatura sample-1/rec-low-res-thumb-x.jpg del batch, desde la caché local
+    o leída una sola vez del SMB. Devuelve la entrada de caché o None.
+    """
+    cache, hole_id, batch_folder = _preview_location(get_orexplore_scanner(), batch)
+    return cache.get(hole_id, batch_folder)
+
+
+def import_batch_rows(text, fmt, dry_run=False, skip_duplicates=True):
+    """
+    Valida un CSV/NDJSON de batches y los guarda en una sola escritura
+    (batch_import.py). Estado igual que actualizar_estado_batches(): correct si
+    el SMB tiene depth.txt, in_progress si solo la carpeta, pending si nada.
+    """
+    rows, errors = parse_batches(text, fmt)
+    if errors:
+        return {"imported": 0, "valid": len(rows), "errors": errors}
+
+    # Un solo snapshot SMB para todo el archivo
+    smb_data = get_smb_data()
+
+    if batch_columns.available():
+        # Todo el archivo contra el SMB en una sola pasada vectorizada
+        batches = [batch for _, batch in rows]
+        estados = batch_columns.depth_statuses(batches, smb_data, RECONCILE_TOLERANCE)
+        por_profundidad = dict(zip(((b["hole_id"], b["to"]) for b in batches), estados))
+
+        def status_of(batch):
+            return por_profundidad[(batch["hole_id"], batch["to"])]
+
+    else:
+        index = ReconcileIndex(smb_data)
+
+        def status_of(batch):
+            smb = index.by_depth(batch["hole_id"], batch["to"], RECONCILE_TOLERANCE)
+            if not smb:
+                return "pending"
+            return "correct" if smb.get("M_from") is not None else "in_progress"
+
+    result = import_batches(batch_store, rows, status_of, skip_duplicates=skip_duplicates, dry_run=dry_run)
+    result["errors"] = []
+    return result
 
 
 # =========================================================
@@ -189,14 +249,16 @@ def get_preview_image(hole_id, to_val):
 
 
 def calculate_metros_escaneados():
-    batches = load_batches()
+    if batch_columns_cache is not None:
+        columnas = batch_columns_cache.get()
+        return round(columnas.meters(columnas.mask(status="pending")), 2)
+
     total = 0
-    for batch in batches:
-        if batch.get("status") == "pending":  # Esperando comparacion
-            try:
-                total += float(batch.get("to", 0)) - float(batch.get("from", 0))
-            except:
-                pass
+    for batch in batch_store.find(status="pending"):  # Esperando comparacion
+        try:
+            total += float(batch.get("to", 0)) - float(batch.get("from", 0))
+        except:
+            pass
     return round(total, 2)
 
 
@@ -292,28 +354,23 @@ def batches_api():
         page = int(request.args.get("page", 1))
         per_page = 20
 
-        batches = load_batches()
-
-        # 🔥 MÁS NUEVOS ARRIBA (sin reverse)
-        batches = sorted(batches, key=lambda b: b["created_at"], reverse=True)
-
-        start = (page - 1) * per_page
-        end = start + per_page
+        # 🔥 MÁS NUEVOS ARRIBA: solo se lee la página pedida
+        batches, total = batch_store.page(page, per_page, order="created_at")
+        prefetch_previews(batches)
 
         return jsonify(
             {
-                "batches": batches[start:end],
-                "total_pages": (len(batches) + per_page - 1) // per_page,
+                "batches": batches,
+                "total_pages": (total + per_page - 1) // per_page,
                 "current_page": page,
             }
         )
 
     if request.method == "POST":
         data = request.json
-        batches = load_batches()
 
+        # batch_number lo asigna el store dentro de la transacción
         new_batch = {
-            "batch_number": len(batches) + 1,
             "hole_id": data.get("hole_id"),
             "from": data.get("from"),
             "to": data.get("to"),
@@ -323,29 +380,51 @@ def batches_api():
             "created_at": datetime.now().isoformat(),
         }
 
-        batches.append(new_batch)
-        save_batches(batches)
+        batch_store.add(new_batch)
 
         return jsonify({"success": True})
 
 
+# ------------------- IMPORTACIÓN MASIVA -------------------
+@app.route("/api/batches/import", methods=["POST"])
+def import_batches_api():
+    """
+    Importa un CSV o NDJSON (campo multipart "file" o el cuerpo). format=csv|ndjson
+    si no se deduce del nombre/Content-Type; dry_run=1 solo valida. Si una fila es
+    inválida no se escribe nada.
+    """
+    if not is_logged():
+        return jsonify({"error": "No autorizado"}), 401
+
+    upload = request.files.get("file")
+    if upload is not None:
+        text = upload.read().decode("utf-8-sig")
+        fmt = request.args.get("format") or detect_format(upload.filename, upload.mimetype)
+    else:
+        text = request.get_data(as_text=True)
+        fmt = request.args.get("format") or detect_format(content_type=request.content_type)
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "Formato no reconocido, use format=csv o format=ndjson"}), 400
+
+    result = import_batch_rows(
+        text,
+        fmt,
+        dry_run=request.args.get("dry_run") in ("1", "true"),
+        skip_duplicates=request.args.get("skip_duplicates", "1") not in ("0", "false"),
+    )
+    return jsonify(result), (400 if result["errors"] else 200)
+
+
 # ------------------- DELETE -------------------
 @app.route("/api/batches/<int:batch_number>", methods=["DELETE"])
 def delete_batch(batch_number):
     if "username" not in session:
         return jsonify({"error": "No autorizado"}), 401
 
-    batches = load_batches()
-    new_list = [b for b in batches if b["batch_number"] != batch_number]
-
-    if len(new_list) == len(batches):
+    # IDs estables: los demás batches conservan su número
+    if not batch_store.delete(batch_number):
         return jsonify({"error": "Batch no encontrado"}), 404
 
-    # Renumerar
-    for i, b in enumerate(new_list, start=1):
-        b["batch_number"] = i
-
-    save_batches(new_list)
     return jsonify({"success": True})
 
 
@@ -356,21 +435,12 @@ def update_batch(batch_number):
         return jsonify({"error": "No autorizado"}), 401
 
     data = request.json
-    batches = load_batches()
-
-    batch = next((b for b in batches if b["batch_number"] == batch_number), None)
-
-    if not batch:
-        return jsonify({"error": "Batch no encontrado"}), 404
 
     # Actualizar campos editables
-    batch["hole_id"] = data.get("hole_id", batch["hole_id"])
-    batch["from"] = data.get("from", batch["from"])
-    batch["to"] = data.get("to", batch["to"])
-    batch["machine"] = data.get("machine", batch["machine"])
-    batch["comentarios"] = data.get("comentarios", batch.get("comentarios", ""))
+    fields = {k: data[k] for k in ("hole_id", "from", "to", "machine", "comentarios") if k in data}
 
-    save_batches(batches)
+    if not batch_store.update(batch_number, fields):
+        return jsonify({"error": "Batch no encontrado"}), 404
 
     return jsonify({"success": True})
 
@@ -383,14 +453,29 @@ def preview_image(batch_number):
     if not is_logged():
         return jsonify({"error": "No autorizado"}), 401
 
-    batches = load_batches()
-
-    batch = next((b for b in batches if b["batch_number"] == batch_number), None)
+    batch = batch_store.get(batch_number)
 
     if not batch:
         return jsonify({"error": "Batch no encontrado"}), 404
 
-    return jsonify({"image_path": get_preview_image(batch["hole_id"], batch["to"])})
+    try:
+        image = get_preview_image(batch)
+    except Exception as e:
+        monitor_logger.error(f"Preview batch {batch_number}: {e}")
+        return jsonify({"error": "Servidor SMB no disponible"}), 502
+
+    if image is None:
+        return jsonify({"error": "Imagen no encontrada"}), 404
+
+    # ETag / Last-Modified: las vistas repetidas son 304
+    return send_file(
+        image["path"],
+        mimetype="image/jpeg",
+        etag=image["etag"],
+        last_modified=image["last_modified"],
+        max_age=3600,
+        conditional=True,
+    )
 
 
 # ------------------- STATUS CHECKER -------------------
@@ -407,38 +492,62 @@ def status_checker():
 # FUNCION: ACTUALIZAR EL ESTADO DE BATCHES (STATUS CHECKER)
 # INSERTAR AQUI
 # ============================================================
-def actualizar_estado_batches():
-    batches = load_batches()
-    smb_data = leer_orexplore_smb()
-
-    for batch in batches:
-        # valores por defecto (lo que verá la tabla)
-        batch["status"] = "pending"
-        batch["from"] = batch.get("from", "")
-
-        match = next(
-            (
-                smb
-                for smb in smb_data
-                if smb.get("M_hole_id") == batch.get("hole_id")
-                and str(smb.get("M_to")) == str(batch.get("to"))
-            ),
-            None,
-        )
+def conciliar_batch(batch, smb_index):
+    """
+    Fila de la vista de conciliación (reconcile_view.py) de un batch: el
+    registro SMB con from y to dentro de RECONCILE_TOLERANCE o, si no, el de
+    su carpeta batch-<to> (from distinto). correct si hay depth.txt,
+    in_progress si solo la carpeta, pending si nada.
+    """
+    hole_id, from_val, to_val = batch.get("hole_id"), batch.get("from"), batch.get("to")
+
+    match, delta = smb_index.match(hole_id, from_val, to_val, RECONCILE_TOLERANCE)
+    calidad = match_quality(delta, RECONCILE_TOLERANCE)
+    if match is None:
+        match, delta = smb_index.nearest(hole_id, None, to_val, RECONCILE_TOLERANCE)
+        calidad = "depth" if match else "none"
+
+    if not match:
+        estado = "pending"
+    else:
+        estado = "correct" if match.get("M_from") is not None else "in_progress"
+
+    return {
+        # Estructura SIEMPRE presente (frontend depende de esto)
+        "machine_values": {
+            "hole_id": match.get("M_hole_id") if match else "-",
+            "from": match.get("M_from") if match else "-",
+            "to": match.get("M_to") if match else "-",
+            "machine": (match.get("M_machine") or "OREXPLORE") if match else "-",
+            "delta": delta,
+        },
+        "status": estado,
+        "match": calidad,
+    }
+
 
-        # SMB no encontró nada → pending (tabla queda igual)
-        if not match:
-            continue
+def actualizar_estado_batches(escanear=True):
+    """
+    Guarda en el store el estado de la vista de conciliación; los confirmados
+    toman el from del depth.txt. Con ``escanear`` primero se re-escanea el SMB
+    (el watcher ya lo hizo). Solo la partición caliente: los archivados ya
+    están confirmados.
+    """
+    if escanear:
+        leer_orexplore_smb()
 
-        # SMB encontró carpeta/hole
-        batch["status"] = "in_progress"
+    cambios = {}
+    for batch, fila in reconcile_view.items():
+        nuevo = {"status": fila["status"], "from": batch.get("from", "")}
+        if fila["status"] == "correct":
+            nuevo["from"] = fila["machine_values"]["from"]
 
-        # SMB encontró depth.txt
-        if match.get("M_from"):
-            batch["from"] = match.get("M_from")
-            batch["status"] = "correct"
+        if (nuevo["status"], nuevo["from"]) != (batch.get("status"), batch.get("from")):
+            cambios[batch["batch_number"]] = nuevo
 
-    save_batches(batches)
+    # Solo se escriben los batches que cambiaron
+    if cambios:
+        batch_store.update_many(cambios)
 
 
 # ============================================================
@@ -454,197 +563,242 @@ def status_checker_data():
     page = int(request.args.get("page", 1))
     per_page = 30
 
-    batches = load_batches()
-    smb_data = leer_orexplore_smb()
-
-    def norm_str(v):
-        return str(v).strip() if v is not None else ""
-
-    def norm_num(v):
-        try:
-            return float(v)
-        except (TypeError, ValueError):
-            return None
-
-    for batch in batches:
-        match = next(
-            (
-                smb
-                for smb in smb_data
-                if norm_str(smb.get("M_hole_id")) == norm_str(batch.get("hole_id"))
-                and norm_num(smb.get("M_from")) == norm_num(batch.get("from"))
-                and norm_num(smb.get("M_to")) == norm_num(batch.get("to"))
-            ),
-            None,
-        )
-
-        # Estructura SIEMPRE presente (frontend depende de esto)
-        batch["machine_values"] = {
-            "hole_id": match.get("M_hole_id") if match else "-",
-            "from": match.get("M_from") if match else "-",
-            "to": match.get("M_to") if match else "-",
-            "machine": "OREXPLORE" if match else "-",
-        }
-
-        if not match:
-            batch["status"] = "pending"
-        else:
-            batch["status"] = "correct"
+    # La página (también de meses archivados) y el total salen del store; de
+    # ella solo se vuelven a conciliar las filas de batches editados o de
+    # holes con cambios en el SMB (reconcile_view.py). Más antiguos primero
+    pagina, total = reconcile_view.page(page, per_page, newest_first=False)
 
     # Paginación
-    total_pages = (len(batches) + per_page - 1) // per_page
-    start = (page - 1) * per_page
-    end = start + per_page
+    total_pages = (total + per_page - 1) // per_page
+    prefetch_previews(pagina)
 
     return jsonify(
         {
-            "batches": batches[start:end],
+            "batches": pagina,
             "total_pages": total_pages,
             "current_page": page,
+            "tolerance": RECONCILE_TOLERANCE,
         }
     )
 
 
+# ------------------- SMB CHANGES -------------------
+
+
+@app.route("/api/smb_changes")
+def smb_changes():
+    """
+    Cambios en el árbol SMB (batch_added, depth_ready, batch_removed) desde el
+    cursor `since` de la llamada anterior. Sin cursor, o si ya salió de la
+    ventana de retención, `reset` es true: recargar todo y seguir con el
+    cursor devuelto.
+    """
+    if not is_logged():
+        return jsonify({"error": "No autorizado"}), 401
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", 500)), 5000))
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+
+    try:
+        get_smb_data()  # refresca en segundo plano si el scan es viejo
+        return jsonify(get_orexplore_scanner().changes_since(request.args.get("since"), limit))
+    except Exception as e:
+        monitor_logger.error(f"SMB changes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 # =========================================================
 # SMB READER
 # =========================================================
-from smbprotocol.open import (
-    Open,
-    CreateDisposition,
-    CreateOptions,
-    FileAttributes,
-    ShareAccess,
-    FilePipePrinterAccessMask,
-    ImpersonationLevel,
+from preview_cache import PreviewCache, PreviewPrefetcher
+from reconcile import ReconcileIndex, match_quality
+from reconcile_view import ReconcileView
+from functools import partial
+
+from smb_scanner import SMBBackend, depth_record, get_scanner
+from smb_sources import MultiSourceScanner, parse_sources, source_file
+from smb_watcher import SMBChangeWatcher
+
+SMB_SERVER = "172.16.11.107"
+SMB_SHARE = "pond"
+SMB_BASE_PATH = "incoming/Orexplore"
+
+SMB_USERNAME = "orexplore"
+SMB_PASSWORD = "en6Eith0aphi"
+
+# Una fuente por máquina escáner; SMB_SOURCES (lista JSON) reemplaza la de arriba.
+# Ej: [{"machine": "OREXPLORE", "server": "172.16.11.107"},
+#      {"machine": "OREXPLORE2", "server": "172.16.11.108", "share": "pond2"}]
+SMB_SOURCES = parse_sources(
+    os.environ.get("SMB_SOURCES", ""),
+    {
+        "server": SMB_SERVER,
+        "share": SMB_SHARE,
+        "base_path": SMB_BASE_PATH,
+        "machine": "OREXPLORE",
+        "username": SMB_USERNAME,
+        "password": SMB_PASSWORD,
+    },
 )
-from smbprotocol.file_info import FileInformationClass
-from smbprotocol.exceptions import SMBException
 
+# Holes escaneados en paralelo (cada worker usa su propia conexión del pool)
+SMB_SCAN_WORKERS = int(os.environ.get("SMB_SCAN_WORKERS", 4))
 
-def smb_path(*parts):
-    return "\\".join(p.strip("\\/") for p in parts if p)
+# Último scan guardado en disco: al reiniciar se responde desde aquí
+SMB_SNAPSHOT_FILE = os.environ.get("SMB_SNAPSHOT_FILE", "smb_snapshot.json")
+SMB_CACHE_MAX_AGE = int(os.environ.get("SMB_CACHE_MAX_AGE", 60))
 
+# "notify" (CHANGE_NOTIFY, con polling como respaldo) o "interval" (solo polling)
+SMB_MONITOR_MODE = os.environ.get("SMB_MONITOR_MODE", "notify")
 
-def leer_orexplore_smb():
-    """
-    Lectura SEGURA de SMB Orexplore.
-    Nunca rompe el backend.
-    """
+# "inline": el monitor corre dentro de la app; "service": lo corre scanner_service.py
+# y los workers web solo leen sus snapshots
+SMB_SCANNER_MODE = os.environ.get("SMB_SCANNER_MODE", "inline")
 
-    SERVER = "172.16.11.107"
-    SHARE = "pond"
-    BASE_PATH = "incoming/Orexplore"
+# Eventos de cambio guardados por fuente para /api/smb_changes
+SMB_CHANGES_RETENTION = int(os.environ.get("SMB_CHANGES_RETENTION", 1000))
 
-    USERNAME = "orexplore"
-    PASSWORD = "en6Eith0aphi"
+# Miniaturas servidas por /api/preview, caché LRU en disco
+PREVIEW_CACHE_DIR = os.environ.get("PREVIEW_CACHE_DIR", "preview_cache")
+PREVIEW_CACHE_MAX_MB = int(os.environ.get("PREVIEW_CACHE_MAX_MB", 200))
 
-    resultados = []
+# Al servir una página de batches sus miniaturas se precargan en segundo plano
+PREVIEW_PREFETCH_WORKERS = int(os.environ.get("PREVIEW_PREFETCH_WORKERS", 2))
+PREVIEW_PREFETCH_BUDGET = int(os.environ.get("PREVIEW_PREFETCH_BUDGET", 30))
 
-    try:
-        if not USERNAME or not PASSWORD:
-            monitor_logger.warning("SMB credentials no definidas")
-            return []
+# Profundidades (m) a esta distancia de las de la máquina igual coinciden (12.31 vs 12.30)
+RECONCILE_TOLERANCE = float(os.environ.get("RECONCILE_TOLERANCE", 0.05))
 
-        conn, session, tree = smb_connect(
-            server=SERVER, share=SHARE, username=USERNAME, password=PASSWORD
-        )
 
-        try:
-            base_dir = Open(
-                tree,
-                BASE_PATH,
-                desired_access=0x00000001,
-                share_access=0x00000007,
-                create_disposition=CreateDisposition.FILE_OPEN,
-                create_options=0x00000001,
-                impersonation_level=ImpersonationLevel.Impersonation,
-            )
-            base_dir.create()
+def source_pool(source):
+    # Conexión reutilizada desde el pool (no más connect/disconnect por scan)
+    return get_pool(source["server"], source["share"], source["username"], source["password"], connect=smb_connect)
+
+
+def get_source_scanner(source, workers=None):
+    # Incremental: solo se vuelven a leer los holes cuyo LastWriteTime cambió
+    return get_scanner(
+        SMBBackend(source_pool(source)),
+        source["base_path"],
+        partial(depth_record, machine=source["machine"]),
+        workers=workers or SMB_SCAN_WORKERS,
+        snapshot_path=source_file(SMB_SNAPSHOT_FILE, source, SMB_SOURCES),
+        read_only=SMB_SCANNER_MODE == "service",
+        change_log_size=SMB_CHANGES_RETENTION,
+    )
+
+
+def get_orexplore_scanner(workers=None):
+    # Todas las fuentes se escanean a la vez: tarda lo que la más lenta
+    return MultiSourceScanner([(source, get_source_scanner(source, workers)) for source in SMB_SOURCES])
+
+
+_preview_caches = {}
+_preview_cache_lock = threading.Lock()
+
 
-            holes = base_dir.query_directory(
-                "*", FileInformationClass.FILE_DIRECTORY_INFORMATION
+def get_preview_cache(source):
+    with _preview_cache_lock:
+        cache = _preview_caches.get(source["name"])
+        if cache is None:
+            cache = PreviewCache(
+                SMBBackend(source_pool(source)),
+                source["base_path"],
+                source_file(PREVIEW_CACHE_DIR, source, SMB_SOURCES),
+                max_bytes=PREVIEW_CACHE_MAX_MB * 1024 * 1024 // len(SMB_SOURCES),
             )
+            _preview_caches[source["name"]] = cache
+        return cache
 
-            for hole in holes:
-                hole_name = hole["file_name"]
-                if hole_name in (".", ".."):
-                    continue
-
-                hole_path = f"{BASE_PATH}/{hole_name}"
-
-                try:
-                    hole_dir = Open(
-                        tree,
-                        hole_path,
-                        desired_access=0x00000001,
-                        share_access=0x00000007,
-                        create_disposition=CreateDisposition.FILE_OPEN,
-                        create_options=0x00000001,
-                        impersonation_level=ImpersonationLevel.Impersonation,
-                    )
-                    hole_dir.create()
-                except SMBException:
-                    continue
-
-                batches = hole_dir.query_directory(
-                    "batch-*", FileInformationClass.FILE_DIRECTORY_INFORMATION
-                )
-
-                for batch in batches:
-                    batch_name = batch["file_name"]
 
-                    try:
-                        m_to = round(float(batch_name.replace("batch-", "")), 2)
-                    except ValueError:
-                        continue
+_preview_prefetcher = None
 
-                    depth_path = f"{hole_path}/{batch_name}/depth.txt"
 
-                    try:
-                        depth_file = Open(
-                            tree,
-                            depth_path,
-                            desired_access=0x00000001,
-                            share_access=0x00000007,
-                            create_disposition=CreateDisposition.FILE_OPEN,
-                            impersonation_level=ImpersonationLevel.Impersonation,
-                        )
-                        depth_file.create()
+def get_preview_prefetcher():
+    global _preview_prefetcher
+    with _preview_cache_lock:
+        if _preview_prefetcher is None:
+            _preview_prefetcher = PreviewPrefetcher(
+                workers=PREVIEW_PREFETCH_WORKERS,
+                budget=PREVIEW_PREFETCH_BUDGET,
+            )
+        return _preview_prefetcher
 
-                        raw = depth_file.read(0, 2048).decode("utf-8", errors="ignore")
-                        lines = [l.strip() for l in raw.splitlines() if l.strip()]
-                        if not lines:
-                            depth_file.close()
-                            continue
 
-                        m_from = round(float(lines[0]), 2)
+def _preview_location(scanner, batch):
+    """(caché, hole_id, carpeta batch) de la miniatura, en la fuente de su máquina."""
+    source, source_scanner = scanner.locate(batch["hole_id"], batch.get("machine"))
+    batch_folder = source_scanner.batch_folder(batch["hole_id"], batch["to"])
+    return get_preview_cache(source), batch["hole_id"], batch_folder
 
-                        resultados.append(
-                            {
-                                "M_hole_id": hole_name.strip(),
-                                "M_from": m_from,
-                                "M_to": m_to,
-                                "M_machine": "OREXPLORE",
-                            }
-                        )
 
-                        depth_file.close()
+def prefetch_previews(batches):
+    """Precarga en segundo plano las miniaturas de una página de batches."""
+    if PREVIEW_PREFETCH_BUDGET <= 0 or not batches:
+        return
+    try:
+        scanner = get_orexplore_scanner()
+        get_preview_prefetcher().prefetch(
+            _preview_location(scanner, b)
+            for b in batches
+            if b.get("hole_id") and b.get("to") not in (None, "")
+        )
+    except Exception as e:
+        monitor_logger.warning(f"Precarga de miniaturas no iniciada: {e}")
+
 
-                    except (SMBException, ValueError):
-                        continue
+def leer_orexplore_smb(workers=None):
+    """
+    Lectura SEGURA de SMB Orexplore.
+    Nunca rompe el backend.
+    """
+    try:
+        if not SMB_USERNAME or not SMB_PASSWORD:
+            monitor_logger.warning("SMB credentials no definidas")
+            return []
 
-                hole_dir.close()
+        return get_orexplore_scanner(workers).scan()
 
-            base_dir.close()
+    except Exception as e:
+        monitor_logger.error(f"SMB crítico: {e}")
+        return []
 
-        finally:
-            conn.disconnect()
 
+def get_smb_data():
+    """
+    Último estado conocido del SMB (memoria o snapshot en disco), sin esperar
+    al servidor. Si tiene más de SMB_CACHE_MAX_AGE segundos se refresca en
+    segundo plano.
+    """
+    try:
+        if not SMB_USERNAME or not SMB_PASSWORD:
+            return []
+        return get_orexplore_scanner().cached(SMB_CACHE_MAX_AGE)
     except Exception as e:
         monitor_logger.error(f"SMB crítico: {e}")
         return []
 
-    return resultados
+
+def smb_changes_since(cursor):
+    """
+    Cambios del SMB para la vista de conciliación. Como get_smb_data(), si el
+    último scan tiene más de SMB_CACHE_MAX_AGE segundos se refresca en segundo plano.
+    """
+    if not SMB_USERNAME or not SMB_PASSWORD:
+        return {"cursor": "", "changes": [], "more": False, "reset": cursor is None}
+    scanner = get_orexplore_scanner()
+    if SMB_SCANNER_MODE != "service":
+        age = scanner.age()
+        if age is not None and age > SMB_CACHE_MAX_AGE:
+            scanner.refresh_in_background()
+    return scanner.changes_since(cursor, max(SMB_CHANGES_RETENTION, 500))
+
+
+# Una fila por batch, también los archivados (machine_values, status, calidad del match),
+# al día con los batches y con los cambios del SMB
+reconcile_view = ReconcileView(batch_store, conciliar_batch, get_smb_data, smb_changes_since)
 
 
 # =========================================================
@@ -664,8 +818,29 @@ def metros_data():
     if not is_logged():
         return jsonify({"error": "No autorizado"}), 401
 
-    batches = load_batches()
     now = datetime.now()
+    # Solo se grafican los últimos 30 días: se leen por el índice de created_at
+    primer_dia = (now - timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if batch_columns_cache is not None:
+        # Vectorizado sobre las columnas en caché: un bincount por gráfico
+        columnas = batch_columns_cache.get()
+        mask = columnas.mask(status="correct", created_from=primer_dia)
+        por_hora = columnas.meters_by_hour(now, mask)
+        por_dia = columnas.meters_by_day(primer_dia, 30, mask)
+        return jsonify(
+            {
+                "daily": [{"hour": hour, "metros": round(float(por_hora[hour]), 2)} for hour in range(24)],
+                "monthly": [
+                    {
+                        "day": (primer_dia + timedelta(days=day)).strftime("%d/%m"),
+                        "metros": round(float(por_dia[day]), 2),
+                    }
+                    for day in range(30)
+                ],
+            }
+        )
+
+    batches = batch_store.find(status="correct", created_from=primer_dia.isoformat())
 
     daily_data = []
     for hour in range(24):
@@ -729,13 +904,66 @@ def start_smb_monitor_interval():
         time.sleep(300)  # 5 minutos
 
 
+def holes_pendientes():
+    """Holes con batches aún no confirmados en SMB, los más recientes primero."""
+    # Los pendientes nunca se archivan: basta la partición caliente
+    return [
+        b.get("hole_id")
+        for b in batch_store.find(exclude_status="correct", newest_first=True, include_archive=False)
+    ]
+
+
+def _watch_source(source, fallback):
+    """CHANGE_NOTIFY de una fuente; marca ``fallback`` si el servidor no lo soporta."""
+    try:
+        watcher = SMBChangeWatcher(
+            get_source_scanner(source),
+            # Cada aviso re-escanea solo su fuente, pero se comparan todas
+            on_change=lambda _records: actualizar_estado_batches(escanear=False),
+            active_holes=holes_pendientes,
+            poll_interval=300,
+        )
+        monitor_logger.info(f"Monitoreo SMB por CHANGE_NOTIFY iniciado ({source['name']}).")
+        if watcher.run():
+            return
+    except Exception as e:
+        monitor_logger.error(f"Error en monitoreo CHANGE_NOTIFY ({source['name']}): {e}")
+
+    monitor_logger.warning(f"CHANGE_NOTIFY no disponible en {source['name']}.")
+    fallback.set()
+
+
+def start_smb_monitor():
+    """
+    Monitor SMB por CHANGE_NOTIFY: un watcher por fuente, y solo se
+    re-escanean los holes que el servidor reporta como modificados. Si algún
+    servidor no soporta CHANGE_NOTIFY (o SMB_MONITOR_MODE=interval) se usa el
+    polling de 5 minutos.
+    """
+    if SMB_MONITOR_MODE != "interval" and SMB_USERNAME and SMB_PASSWORD:
+        fallback = threading.Event()
+        for source in SMB_SOURCES:
+            threading.Thread(
+                target=_watch_source,
+                args=(source, fallback),
+                name=f"smb-watch-{source['name']}",
+                daemon=True,
+            ).start()
+
+        fallback.wait()
+        monitor_logger.warning("Usando polling cada 5 minutos.")
+
+    start_smb_monitor_interval()
+
+
 # =========================================================
 # RUN SERVER
 # =========================================================
 
 if __name__ == "__main__":
-    # Iniciar hilo del monitoreo SMB automático
-    monitor_thread = threading.Thread(target=start_smb_monitor_interval, daemon=True)
-    monitor_thread.start()
+    # Iniciar hilo del monitoreo SMB automático (en modo service lo corre scanner_service.py)
+    if SMB_SCANNER_MODE != "service":
+        monitor_thread = threading.Thread(target=start_smb_monitor, daemon=True)
+        monitor_thread.start()
 
     app.run(host="172.16.11.104", port=5001, debug=True)
@@ -0,0 +1,57 @@
+"""
+Local-directory backend for OrexploreScanner.
+
+Reads the same ``<hole>/batch-<to>/depth.txt`` layout as the SMB share from
+a directory on disk, so scans can be measured and tuned without the file
+server. ``latency`` adds a fixed delay per directory listing and file read
+to mimic the round trip to the server.
+"""
+import fnmatch
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class LocalBackend:
+    errors = (OSError,)
+    missing_errors = (FileNotFoundError,)
+
+    def __init__(self, root, latency=0.0):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.key = ("local", self.root)
+
+    @contextmanager
+    def connection(self):
+        yield None
+
+    def path(self, *parts):
+        parts = [p.strip("\\/") for p in parts if p]
+        return os.path.join(*parts) if parts else ""
+
+    def list_dirs(self, conn, path, pattern="*"):
+        self._round_trip()
+        dirs = []
+        with os.scandir(os.path.join(self.root, path)) as entries:
+            for entry in entries:
+                if not entry.is_dir() or not fnmatch.fnmatch(entry.name, pattern):
+                    continue
+                dirs.append((entry.name, datetime.fromtimestamp(entry.stat().st_mtime)))
+        return dirs
+
+    def read_file(self, conn, path, length=2048):
+        self._round_trip()
+        with open(os.path.join(self.root, path), "rb") as f:
+            return f.read(length)
+
+    def fetch_file(self, conn, path):
+        self._round_trip()
+        full_path = os.path.join(self.root, path)
+        with open(full_path, "rb") as f:
+            data = f.read()
+        return data, datetime.fromtimestamp(os.path.getmtime(full_path))
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
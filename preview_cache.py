@@ -0,0 +1,272 @@
+"""
+On-disk LRU cache for batch preview thumbnails.
+
+Browsers cannot open the ``smb://`` URL of a thumbnail, so the app serves
+the image itself. Thumbnails are read once through the scanner backend
+(one pooled SMB connection, compound CREATE/READ/CLOSE) and kept in
+``directory`` until the cache grows past ``max_bytes``; the least recently
+served ones are evicted first. Each image is stored next to a small JSON
+file with its source path, ETag and LastWriteTime, so the cache survives a
+restart.
+
+Concurrent requests for the same thumbnail share one fetch, and a
+thumbnail that does not exist is remembered for ``missing_ttl`` seconds,
+so a page of previews hits the file server at most once per image.
+
+PreviewPrefetcher warms the cache in the background for the batches of a
+table page as soon as the page is served, so opening a preview is usually
+a local file read.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_DIR = "sample-1"
+THUMBNAIL_FILE = "rec-low-res-thumb-x.jpg"
+
+
+class PreviewCache:
+    def __init__(self, backend, base_path, directory, max_bytes=200 * 1024 * 1024, missing_ttl=60):
+        self.backend = backend
+        self.base_path = base_path
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.missing_ttl = missing_ttl
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict()  # key -> entry, least recently used first
+        self._bytes = 0
+        self._missing = {}  # key -> monotonic time until which it is not retried
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def get(self, hole_id, batch_folder):
+        """
+        Cache entry for the thumbnail of one batch folder, fetching it from the
+        share if needed: a dict with ``path`` (local file), ``etag``,
+        ``last_modified`` (datetime) and ``size``. Returns None if the batch has
+        no thumbnail. Backend errors (share unreachable) are raised.
+        """
+        key = f"{hole_id}/{batch_folder}"
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            if self._missing.get(key, 0) > time.monotonic():
+                return None
+
+        entry, _ = self._flight.do(key, self._fetch, key, hole_id, batch_folder)
+        return entry
+
+    def contains(self, hole_id, batch_folder):
+        key = f"{hole_id}/{batch_folder}"
+        with self._lock:
+            return key in self._index or self._missing.get(key, 0) > time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            # The file mtime is the LRU order after a restart
+            os.utime(entry["path"])
+        except OSError:
+            with self._lock:
+                self._drop(key)
+            return None
+        return entry
+
+    def _fetch(self, key, hole_id, batch_folder):
+        backend = self.backend
+        path = backend.path(self.base_path, hole_id, batch_folder, SAMPLE_DIR, THUMBNAIL_FILE)
+        with self._lock:
+            self.misses += 1
+
+        try:
+            with backend.connection() as conn:
+                data, last_write_time = backend.fetch_file(conn, path)
+        except backend.missing_errors:
+            with self._lock:
+                self._missing[key] = time.monotonic() + self.missing_ttl
+            return None
+
+        last_modified = last_write_time.replace(microsecond=0)
+        entry = {
+            "key": key,
+            "source": path,
+            "size": len(data),
+            "etag": f"{len(data):x}-{int(last_modified.timestamp()):x}",
+            "last_modified": last_modified,
+        }
+        entry["path"] = self._write(key, data, entry)
+
+        with self._lock:
+            self._missing.pop(key, None)
+            self._drop(key)
+            self._index[key] = entry
+            self._bytes += entry["size"]
+            evicted = self._evict()
+        for old in evicted:
+            _remove_files(old)
+        return entry
+
+    def _write(self, key, data, entry):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        image_path = os.path.join(self.directory, name + ".jpg")
+        meta = dict(entry, last_modified=entry["last_modified"].isoformat())
+        _atomic_write(image_path, data, self.directory)
+        _atomic_write(os.path.join(self.directory, name + ".json"), json.dumps(meta).encode("utf-8"), self.directory)
+        return image_path
+
+    def _drop(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+        return entry
+
+    def _evict(self):
+        """Pops least recently used entries until the cache fits; caller holds the lock."""
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            _, entry = self._index.popitem(last=False)
+            self._bytes -= entry["size"]
+            evicted.append(entry)
+        return evicted
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            image_path = meta_path[:-len(".json")] + ".jpg"
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+                used = os.path.getmtime(image_path)
+                meta["last_modified"] = datetime.fromisoformat(meta["last_modified"])
+            except (OSError, ValueError, KeyError):
+                _remove_files({"path": image_path})
+                continue
+            meta["path"] = image_path
+            entries.append((used, meta))
+
+        for _, meta in sorted(entries, key=lambda e: e[0]):
+            self._index[meta["key"]] = meta
+            self._bytes += meta["size"]
+        for old in self._evict():
+            _remove_files(old)
+        if self._index:
+            logger.info(f"Preview cache: {len(self._index)} thumbnails, {self._bytes // 1024} KiB in {self.directory}")
+
+
+class PreviewPrefetcher:
+    """
+    Fetches thumbnails into PreviewCaches from ``workers`` background threads.
+
+    Each prefetch() call (one per page served) queues at most ``budget``
+    thumbnails, and those not started within ``timeout`` seconds are
+    dropped, so paging quickly through a table does not pile up work for
+    pages nobody is looking at. After a backend error prefetching pauses
+    for ``error_backoff`` seconds; user requests still go to the cache. A
+    batch whose folder or thumbnail does not exist yet is not an error.
+    """
+
+    def __init__(self, workers=2, budget=30, timeout=15, error_backoff=60):
+        self.budget = budget
+        self.timeout = timeout
+        self.error_backoff = error_backoff
+        self._pending = set()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview-prefetch")
+
+    def prefetch(self, items):
+        """
+        Queues ``(cache, hole_id, batch_folder)`` items not cached yet.
+        Returns immediately with the number of thumbnails queued.
+        """
+        now = time.monotonic()
+        deadline = now + self.timeout
+        queued = 0
+        with self._lock:
+            if now < self._paused_until:
+                return 0
+            for cache, hole_id, batch_folder in items:
+                if queued >= self.budget:
+                    break
+                key = (cache, hole_id, batch_folder)
+                if key in self._pending or cache.contains(hole_id, batch_folder):
+                    continue
+                self._pending.add(key)
+                self._executor.submit(self._run, key, deadline)
+                queued += 1
+        return queued
+
+    def _run(self, key, deadline):
+        cache, hole_id, batch_folder = key
+        try:
+            if time.monotonic() > deadline or time.monotonic() < self._paused_until:
+                return
+            cache.get(hole_id, batch_folder)
+        except cache.backend.missing_errors:
+            # A pending batch has no folder or thumbnail yet: no preview, not a backend failure
+            pass
+        except Exception as e:
+            logger.warning(f"Preview prefetch of {key[1]}/{key[2]} failed, pausing prefetch: {e}")
+            with self._lock:
+                self._paused_until = time.monotonic() + self.error_backoff
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def _atomic_write(path, data, directory):
+    fd, tmp_path = tempfile.mkstemp(prefix=".preview-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _remove_files(entry):
+    image_path = entry["path"]
+    for path in (image_path, image_path[:-len(".jpg")] + ".json"):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
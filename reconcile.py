@@ -0,0 +1,163 @@
+"""
+Reconciliation of OP batches against the SMB records.
+
+Matching used to scan the whole SMB list for every batch (``next(...)``
+over ``smb_data``), O(batches x records) per request. ReconcileIndex is
+built once per SMB snapshot, in one pass over the records, with hash
+indexes for each way batches are matched:
+
+- ``exact(hole_id, from, to)``: the status checker in fix23.py
+- ``by_depth(hole_id, to)``: the monitor's status update and bulk imports
+- ``first(hole_id)``: the status checker in app.py
+
+Every lookup is O(1), so reconciling a page or the whole history is linear.
+Keys are normalized the way the status checker compared values: stripped
+text for hole ids, floats for depths ("12.3" and "12.30" are the same). When
+several records share a key the first one wins, as ``next()`` did.
+
+Depths typed by hand do not always match the machine to the centimetre
+(12.31 in OP, 12.30 in depth.txt). For each hole the records are also kept
+sorted by ``M_to``; ``nearest()`` bisects to the batch's ``to`` and walks
+outwards only while a closer record is still possible, so a match within
+``tolerance`` metres, and its delta, costs O(log n) per batch however many
+batches the hole has.
+"""
+from bisect import bisect_left
+
+# Float noise: 12.31 - 12.30 is 0.010000000000000009
+_EPSILON = 1e-9
+
+
+class ReconcileIndex:
+    def __init__(self, smb_data):
+        self.records = smb_data
+        self._exact = {}
+        self._by_depth = {}
+        self._by_hole = {}
+        by_hole_depths = {}
+        for smb in smb_data:
+            hole = norm_text(smb.get("M_hole_id"))
+            to = norm_depth(smb.get("M_to"))
+            self._exact.setdefault((hole, norm_depth(smb.get("M_from")), to), smb)
+            self._by_depth.setdefault((hole, to), smb)
+            self._by_hole.setdefault(hole, smb)
+            if to is not None:
+                by_hole_depths.setdefault(hole, []).append((to, norm_depth(smb.get("M_from")), smb))
+
+        # Per hole: records sorted by to (stable, so the first record wins ties)
+        self._intervals = {}
+        for hole, entries in by_hole_depths.items():
+            entries.sort(key=lambda entry: entry[0])
+            self._intervals[hole] = ([entry[0] for entry in entries], entries)
+
+    def __len__(self):
+        return len(self.records)
+
+    def exact(self, hole_id, from_value, to_value):
+        """Record with the same hole, from and to, or None."""
+        return self._exact.get((norm_text(hole_id), norm_depth(from_value), norm_depth(to_value)))
+
+    def by_depth(self, hole_id, to_value, tolerance=0):
+        """
+        Record of the batch folder ``batch-<to>`` of the hole (depth.txt may be
+        missing), or the one whose to is nearest within ``tolerance``; None if
+        there is none.
+        """
+        smb = self._by_depth.get((norm_text(hole_id), norm_depth(to_value)))
+        if smb is None and tolerance:
+            smb, _ = self.nearest(hole_id, None, to_value, tolerance)
+        return smb
+
+    def match(self, hole_id, from_value, to_value, tolerance=0):
+        """
+        ``(record, delta)`` for the exact match, else the nearest record whose
+        from and to are both within ``tolerance``; ``(None, None)`` if none.
+        """
+        smb = self.exact(hole_id, from_value, to_value)
+        if smb is not None:
+            return smb, {"from": 0.0, "to": 0.0}
+        if not tolerance:
+            return None, None
+        return self.nearest(hole_id, from_value, to_value, tolerance)
+
+    def nearest(self, hole_id, from_value, to_value, tolerance=None):
+        """
+        ``(record, delta)`` of the hole's record closest to the batch: the one
+        with the smallest max(|from delta|, |to delta|), within ``tolerance``
+        if given. ``from_value`` None compares to only. ``delta`` is machine
+        minus OP for from and to. ``(None, None)`` if there is none.
+        """
+        intervals = self._intervals.get(norm_text(hole_id))
+        to = norm_depth(to_value)
+        if not intervals or to is None:
+            return None, None
+        from_ = norm_depth(from_value) if from_value is not None else None
+        if from_value is not None and from_ is None:
+            return None, None
+
+        tos, entries = intervals
+        limit = float("inf") if tolerance is None else tolerance + _EPSILON
+        best, best_score = None, float("inf")
+
+        def consider(entry):
+            nonlocal best, best_score
+            entry_to, entry_from, _ = entry
+            score = abs(entry_to - to)
+            if from_ is not None:
+                if entry_from is None:
+                    return
+                score = max(score, abs(entry_from - from_))
+            if score <= limit and score < best_score - _EPSILON:
+                best, best_score = entry, score
+
+        # Walk outwards from the insertion point while |to delta| can still beat the best
+        right = bisect_left(tos, to)
+        left = right - 1
+        while True:
+            bound = min(limit, best_score)
+            moved = False
+            if right < len(tos) and tos[right] - to <= bound:
+                consider(entries[right])
+                right += 1
+                moved = True
+            if left >= 0 and to - tos[left] <= bound:
+                consider(entries[left])
+                left -= 1
+                moved = True
+            if not moved:
+                break
+
+        if best is None:
+            return None, None
+        entry_to, entry_from, smb = best
+        delta = {
+            "from": round(entry_from - from_, 3) if from_ is not None else None,
+            "to": round(entry_to - to, 3),
+        }
+        return smb, delta
+
+    def first(self, hole_id):
+        """First record of the hole, or None."""
+        return self._by_hole.get(norm_text(hole_id))
+
+
+def match_quality(delta, tolerance=0):
+    """'exact', 'tolerance' or 'nearest' for the ``delta`` of a match; 'none' without one."""
+    if delta is None:
+        return "none"
+    worst = max(abs(d) for d in delta.values() if d is not None)
+    if worst <= _EPSILON:
+        return "exact"
+    return "tolerance" if worst <= tolerance + _EPSILON else "nearest"
+
+
+def norm_text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def norm_depth(value):
+    """Depth as float; None when it is not a number (such values only match each other)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,124 @@
+"""
+Materialized reconciliation of the batches against the SMB records.
+
+The status checker reconciled every batch on every request, and fix23.py's
+monitor computed its own version of the same statuses every few minutes.
+ReconcileView keeps one row per batch (the batch plus the fields its
+``reconcile`` function adds: machine_values, status, match quality). A row
+is stale when its inputs changed:
+
+- the batch was created or edited: it differs from the batch the row was
+  built from;
+- the SMB records of its hole changed: the scanners' change feed
+  (``changes_since``) names the holes, and rows built before that are stale.
+  A reset of the feed (first call, events dropped, more than one call's
+  worth) makes every row stale.
+
+Rows are enriched lazily, page first: ``page()`` takes the window and the
+total from the store's own ``page()`` (PartitionedBatchStore: archived
+months included, read only when the window reaches them) and reconciles
+only the stale rows of that window. A request costs the store's page plus
+at most ``per_page`` lookups, however many batches there are; ``items()``
+(the monitor) brings every hot row up to date. The rows live in memory in
+each process.
+"""
+
+import logging
+import threading
+
+from reconcile import ReconcileIndex, norm_text
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileView:
+    def __init__(self, store, reconcile, records, changes):
+        """
+        ``store``: batch store whose ``page()`` and ``all()`` are reconciled.
+        ``reconcile(batch, index)``: the fields the row adds to the batch.
+        ``records()``: current SMB records. ``changes(cursor)``: the scanners'
+        change feed, as returned by MultiSourceScanner.changes_since().
+        """
+        self.store = store
+        self.reconcile = reconcile
+        self.records = records
+        self.changes = changes
+        self._lock = threading.Lock()
+        self._rows = {}  # batch_number -> (batch, generation, row)
+        self._generation = 0  # bumped by every SMB change
+        self._reset_at = 0  # rows older than this are stale
+        self._hole_changed_at = {}  # normalized hole_id -> generation of its last change
+        self._index = None
+        self._index_generation = None
+        self._cursor = None
+
+    def page(self, page, per_page, newest_first=True):
+        """
+        Rows of one page in batch_number order, reconciled if stale, with
+        the store's ``display_number``. Returns ``(rows, total)``; the total
+        is the store's count.
+        """
+        with self._lock:
+            self._poll_smb()
+            window, total = self.store.page(page, per_page, newest_first=newest_first)
+            rows = []
+            for batch in window:
+                display_number = batch.pop("display_number", None)
+                rows.append(dict(self._row(batch), display_number=display_number))
+            self._prune(total)
+        return rows, total
+
+    def items(self):
+        """
+        ``(batch, row)`` of every batch of ``store.all()`` (the hot partition:
+        archived batches are settled), in batch_number order. Rows are shared.
+        """
+        with self._lock:
+            self._poll_smb()
+            batches = self.store.all()
+            items = [(batch, self._row(batch)) for batch in batches]
+            self._prune(len(batches))
+        return items
+
+    def _row(self, batch):
+        """Row of ``batch``, reconciled again if the batch or its hole's SMB records changed."""
+        cached = self._rows.get(batch["batch_number"])
+        if cached is not None:
+            source, generation, row = cached
+            if ((source is batch or source == batch) and generation >= self._reset_at
+                    and generation >= self._hole_changed_at.get(norm_text(batch.get("hole_id")), 0)):
+                return row
+
+        if self._index_generation != self._generation:
+            self._index = ReconcileIndex(self.records())
+            self._index_generation = self._generation
+        row = dict(batch, **self.reconcile(batch, self._index))
+        self._rows[batch["batch_number"]] = (batch, self._generation, row)
+        return row
+
+    def _poll_smb(self):
+        """Marks the rows of the holes changed in the SMB feed since the last call as stale."""
+        try:
+            feed = self.changes(self._cursor)
+        except Exception as e:
+            logger.error(f"Error reading SMB changes for reconciliation: {e}")
+            return
+
+        self._cursor = feed["cursor"]
+        if feed["reset"] or feed.get("more"):
+            self._generation += 1
+            self._reset_at = self._generation
+            self._hole_changed_at = {}
+        elif feed["changes"]:
+            self._generation += 1
+            for event in feed["changes"]:
+                self._hole_changed_at[norm_text(event.get("hole_id"))] = self._generation
+
+    def _prune(self, total):
+        """
+        Once there are many more rows than batches (deleted ones), keeps
+        only the hot rows; archived rows are rebuilt when a page needs them.
+        """
+        if len(self._rows) > 2 * total + 1000:
+            live = {b["batch_number"] for b in self.store.all()}
+            self._rows = {n: entry for n, entry in self._rows.items() if n in live}
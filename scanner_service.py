@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Standalone SMB scanner process.
+
+Runs the SMB scans outside the web server so that, however many WSGI
+workers serve the app, exactly one process talks to the shares:
+
+    python scanner_service.py              # sources configured in app.py (.env)
+    python scanner_service.py --app fix23  # fix23.py: CHANGE_NOTIFY monitor
+
+Every scan is published to the snapshot files (SMB_SNAPSHOT_FILE, one per
+source) with an atomic rename. Web workers started with
+SMB_SCANNER_MODE=service never scan; they reload those files when they
+change. A lock file next to the snapshot keeps a second scanner from
+starting.
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import sys
+import threading
+
+from smb_pool import close_all_pools
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("scanner_service")
+
+
+def acquire_lock(path):
+    """Exclusive lock held for the life of the process; None if another scanner has it."""
+    lock_file = open(path, "a+")
+    if fcntl is None:
+        logger.warning("File locking not available, make sure only one scanner runs")
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    return lock_file
+
+
+def run_interval(module, interval, stop):
+    """Incremental scan of every source each ``interval`` seconds."""
+    scanner = module.get_orexplore_scanner()
+    while not stop.is_set():
+        records = scanner.refresh()
+        logger.info(f"Published {len(records)} batches from {len(scanner.sources)} SMB sources")
+        stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app", choices=("app", "fix23"),
+                        help="module whose SMB configuration is used (default: app)")
+    parser.add_argument("--interval", type=int, default=int(os.environ.get("SMB_SCAN_INTERVAL", 60)),
+                        help="seconds between scans when not watching with CHANGE_NOTIFY")
+    parser.add_argument("--once", action="store_true", help="scan once and exit")
+    args = parser.parse_args()
+
+    # This process is the scanner: its scanners must not be read-only
+    os.environ["SMB_SCANNER_MODE"] = "inline"
+    module = importlib.import_module(args.app)
+
+    snapshot_dir = os.path.dirname(os.path.abspath(module.SMB_SNAPSHOT_FILE or "."))
+    lock_path = os.environ.get("SMB_SCANNER_LOCK", os.path.join(snapshot_dir, "smb_scanner.lock"))
+    lock = acquire_lock(lock_path)
+    if lock is None:
+        logger.error(f"Another scanner holds {lock_path}, exiting")
+        return 1
+    if not module.SMB_SNAPSHOT_FILE:
+        logger.error("SMB_SNAPSHOT_FILE is empty: there is nothing to publish to")
+        return 1
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    logger.info(f"SMB scanner started (pid {os.getpid()}, {args.app}.py configuration)")
+    try:
+        if args.once:
+            scanner = module.get_orexplore_scanner()
+            records = scanner.refresh()
+            logger.info(f"Published {len(records)} batches from {len(scanner.sources)} SMB sources")
+            return 0 if scanner.last_error is None else 1
+
+        if hasattr(module, "start_smb_monitor"):
+            # fix23.py: CHANGE_NOTIFY watchers, polling fallback and batch status updates
+            threading.Thread(target=module.start_smb_monitor, name="smb-monitor", daemon=True).start()
+            stop.wait()
+        else:
+            run_interval(module, args.interval, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_all_pools()
+        lock.close()
+    logger.info("SMB scanner stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Single-flight call coalescing.
+
+When several threads ask for the same expensive result at the same time
+(a scan of the share, a file fetched from it), only the first one does the
+work; the others wait for it and receive the same result, or the same
+exception. Once the call returns, the next caller starts a new one.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` unless a call for ``key`` is already in
+        flight, in which case it waits for that one instead.
+
+        Returns ``(result, shared)``; ``shared`` is True when the result came
+        from another thread's call, so the caller must not mutate it in place.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, call.waiters > 0
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
@@ -0,0 +1,199 @@
+"""
+Pool of authenticated SMB connections.
+
+Each entry keeps the Connection, Session and TreeConnect returned by
+``smb_connect()`` alive between scans so callers only pay the TCP connect,
+NTLM session setup and TreeConnect once. Idle entries are checked with an
+SMB2 ECHO before being handed out again and are replaced transparently when
+the server dropped them.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from smbprotocol.exceptions import SMBResponseException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_ECHO_INTERVAL = 30
+DEFAULT_ECHO_TIMEOUT = 5
+
+
+class _PooledConnection:
+    def __init__(self, conn, session, tree):
+        self.conn = conn
+        self.session = session
+        self.tree = tree
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def echo(self, timeout):
+        self.conn.echo(sid=self.session.session_id, timeout=timeout)
+
+    def close(self):
+        for obj in (self.tree, self.session, self.conn):
+            try:
+                obj.disconnect()
+            except Exception:
+                pass
+
+
+class SMBConnectionPool:
+    """
+    Bounded pool of (conn, session, tree) triples for one server/share/user.
+
+    ``max_size`` caps how many connections are open at once, idle plus in use.
+    Callers that find the pool exhausted wait until a connection is released.
+    """
+
+    def __init__(self, server, share, username, password, connect,
+                 max_size=DEFAULT_MAX_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 echo_interval=DEFAULT_ECHO_INTERVAL, echo_timeout=DEFAULT_ECHO_TIMEOUT):
+        self.server = server
+        self.share = share
+        self.username = username
+        self.password = password
+        self.max_size = max(1, int(max_size))
+        self.idle_timeout = idle_timeout
+        self.echo_interval = echo_interval
+        self.echo_timeout = echo_timeout
+        self._connect = connect
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+    # -----------------------------------------------------------------
+    # checkout / release
+    # -----------------------------------------------------------------
+    def _checkout(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    pooled = None
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No SMB connection available for {self.server}")
+                self._cond.wait(remaining)
+
+        if pooled is not None:
+            if self._is_alive(pooled):
+                return pooled
+            logger.info(f"Discarding stale SMB connection to {self.server}, reconnecting")
+            pooled.close()
+
+        # The slot is already counted in self._open, give it back if connect fails
+        try:
+            conn, session, tree = self._connect(self.server, self.share, self.username, self.password)
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        logger.info(f"Opened pooled SMB connection to {self.server}\\{self.share}")
+        return _PooledConnection(conn, session, tree)
+
+    def _is_alive(self, pooled):
+        idle_for = time.monotonic() - pooled.last_used
+        if self.idle_timeout and idle_for > self.idle_timeout:
+            return False
+        if idle_for < self.echo_interval:
+            return True
+        try:
+            pooled.echo(self.echo_timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"SMB echo to {self.server} failed: {e}")
+            return False
+
+    def _release(self, pooled, broken=False):
+        if broken:
+            pooled.close()
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a connected TreeConnect.
+
+        Error responses from the server (file not found, access denied...)
+        leave the connection usable. Anything else raised inside the block
+        closes the connection instead of returning it to the pool.
+        """
+        pooled = self._checkout(timeout)
+        try:
+            yield pooled.tree
+        except SMBResponseException:
+            self._release(pooled)
+            raise
+        except BaseException:
+            self._release(pooled, broken=True)
+            raise
+        else:
+            self._release(pooled)
+
+    def ping(self, timeout=None):
+        """Send an SMB2 ECHO over a pooled connection, opening one if needed."""
+        pooled = self._checkout(timeout)
+        try:
+            pooled.echo(self.echo_timeout)
+        except BaseException:
+            self._release(pooled, broken=True)
+            raise
+        self._release(pooled)
+
+    def stats(self):
+        with self._cond:
+            return {'open': self._open, 'idle': len(self._idle), 'max_size': self.max_size}
+
+    def close_all(self):
+        """Close every idle connection. Connections currently borrowed are left alone."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            pooled.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(server, share, username, password, connect, **kwargs):
+    """Return the process-wide pool for server/share/username, creating it on first use."""
+    key = (server, share, username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.password != password:
+            if pool is not None:
+                pool.close_all()
+            pool = SMBConnectionPool(server, share, username, password, connect, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,672 @@
+"""
+Orexplore tree walker shared by app.py and fix23.py.
+
+Layout on the share::
+
+    <base_path>/<hole_id>/batch-<to>/depth.txt
+
+The scanner reads the tree through a backend: SMBBackend (here) talks to
+the file server through smb_pool, LocalBackend (local_backend.py) reads
+the same layout from a local directory for benchmarks and tests.
+
+Each hole directory is independent, so holes can be scanned by a pool of
+worker threads, each one borrowing its own connection from the backend.
+The result keeps the order of the base directory listing whatever the
+number of workers, so callers get exactly the same records as a
+sequential walk.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from smbprotocol.exceptions import (
+    EndOfFile,
+    NoSuchFile,
+    ObjectNameNotFound,
+    ObjectPathNotFound,
+    SMBException,
+    SMBResponseException,
+)
+from smbprotocol.file_info import FileAttributes, FileInformationClass
+from smbprotocol.open import (
+    CreateDisposition,
+    CreateOptions,
+    FilePipePrinterAccessMask,
+    ImpersonationLevel,
+    Open,
+    ShareAccess,
+)
+
+from single_flight import SingleFlight
+from smb_snapshot import load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+DEPTH_FILE = "depth.txt"
+DEPTH_READ_SIZE = 2048
+BATCH_PREFIX = "batch-"
+
+_SHARE_ALL = ShareAccess.FILE_SHARE_READ | ShareAccess.FILE_SHARE_WRITE | ShareAccess.FILE_SHARE_DELETE
+
+
+def smb_path(*parts):
+    return "\\".join(p.strip("\\/").replace("/", "\\") for p in parts if p)
+
+
+def _create_args(directory):
+    return (
+        ImpersonationLevel.Impersonation,
+        FilePipePrinterAccessMask.FILE_READ_DATA | FilePipePrinterAccessMask.FILE_READ_ATTRIBUTES,
+        FileAttributes.FILE_ATTRIBUTE_DIRECTORY if directory else FileAttributes.FILE_ATTRIBUTE_NORMAL,
+        _SHARE_ALL,
+        CreateDisposition.FILE_OPEN,
+        CreateOptions.FILE_DIRECTORY_FILE if directory else CreateOptions.FILE_NON_DIRECTORY_FILE,
+    )
+
+
+def _open(tree, path, directory):
+    handle = Open(tree, path)
+    handle.create(*_create_args(directory))
+    return handle
+
+
+def open_dir(tree, path):
+    """Opens a directory handle; the caller must close() it."""
+    return _open(tree, path, directory=True)
+
+
+def list_dirs(tree, path, pattern="*"):
+    """
+    Sub-directories of ``path`` as ``(name, last_write_time)`` tuples.
+
+    A pattern that matches nothing returns an empty list instead of raising.
+    """
+    handle = _open(tree, path, directory=True)
+    try:
+        try:
+            entries = handle.query_directory(pattern, FileInformationClass.FILE_DIRECTORY_INFORMATION)
+        except NoSuchFile:
+            return []
+    finally:
+        handle.close()
+
+    dirs = []
+    for entry in entries:
+        name = entry["file_name"].get_value().decode("utf-16-le")
+        if name in (".", ".."):
+            continue
+        if not entry["file_attributes"].get_value() & FileAttributes.FILE_ATTRIBUTE_DIRECTORY:
+            continue
+        dirs.append((name, entry["last_write_time"].get_value()))
+    return dirs
+
+
+def read_file(tree, path, length=DEPTH_READ_SIZE):
+    """
+    Reads the first ``length`` bytes of a file in a single network round trip.
+
+    CREATE, READ and CLOSE go out as one related SMB2 compound request: the
+    READ and CLOSE use the handle opened by the CREATE before them, so the
+    server answers all three at once. An empty file returns b"".
+    """
+    data, _ = _compound_read(tree, path, length)
+    return data
+
+
+def fetch_file(tree, path):
+    """
+    Whole content of a file and its LastWriteTime.
+
+    The first max_read_size bytes come with the compound CREATE/READ/CLOSE of
+    read_file(), which is the whole file for thumbnails and other small
+    files. Larger files are read on in max_read_size chunks.
+    """
+    data, handle = _compound_read(tree, path, tree.session.connection.max_read_size)
+    last_write_time = handle.last_write_time
+    if len(data) >= handle.end_of_file:
+        return data, last_write_time
+
+    chunk = tree.session.connection.max_read_size
+    buffer = bytearray(data)
+    handle = _open(tree, path, directory=False)
+    try:
+        while len(buffer) < handle.end_of_file:
+            try:
+                buffer += handle.read(len(buffer), min(chunk, handle.end_of_file - len(buffer)))
+            except EndOfFile:
+                break
+    finally:
+        handle.close()
+    return bytes(buffer), handle.last_write_time
+
+
+def _compound_read(tree, path, length):
+    handle = Open(tree, path)
+    messages = [
+        handle.create(*_create_args(directory=False), send=False),
+        handle.read(0, min(length, tree.session.connection.max_read_size), send=False),
+        handle.close(False, send=False),
+    ]
+    requests = tree.session.connection.send_compound(
+        [message for message, _ in messages],
+        tree.session.session_id,
+        tree.tree_connect_id,
+        related=True,
+    )
+
+    # Every response has to be received, even after a failure, or it is
+    # left queued on the connection that goes back to the pool.
+    responses = []
+    error = None
+    for (_, receive), request in zip(messages, requests):
+        try:
+            responses.append(receive(request))
+        except EndOfFile:
+            responses.append(b"")
+        except SMBResponseException as e:
+            responses.append(None)
+            error = error or e
+
+    if error is not None:
+        raise error
+    return responses[1], handle
+
+
+def depth_record(hole_id, batch_folder, raw, machine="OREXPLORE"):
+    """batch-<to>/depth.txt -> record with from/to rounded to 2 decimals."""
+    m_to = round(float(batch_folder.replace(BATCH_PREFIX, "")), 2)
+
+    lines = [l.strip() for l in raw.decode("utf-8", errors="ignore").splitlines() if l.strip()]
+    if not lines:
+        return None
+
+    return {
+        "M_hole_id": hole_id.strip(),
+        "M_from": round(float(lines[0]), 2),
+        "M_to": m_to,
+        "M_machine": machine,
+    }
+
+
+class SMBBackend:
+    """Reads the tree from an SMB share, one pooled connection per worker."""
+
+    errors = (SMBException,)
+    missing_errors = (ObjectNameNotFound, ObjectPathNotFound, NoSuchFile)
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.key = ("smb", pool)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def path(self, *parts):
+        return smb_path(*parts)
+
+    def list_dirs(self, tree, path, pattern="*"):
+        return list_dirs(tree, path, pattern)
+
+    def read_file(self, tree, path, length=DEPTH_READ_SIZE):
+        return read_file(tree, path, length)
+
+    def fetch_file(self, tree, path):
+        return fetch_file(tree, path)
+
+
+class OrexploreScanner:
+    """
+    Walks the Orexplore tree through a backend (SMBBackend, LocalBackend).
+
+    ``make_record(hole_id, batch_folder, raw)`` turns the bytes of a
+    depth.txt into the caller's record dict, or returns None to skip it.
+    ``include_hole(name)`` can filter hole directories before they are
+    opened. ``workers`` > 1 scans that many holes at the same time; with
+    SMBBackend the effective concurrency is also bounded by the pool size.
+
+    The scanner keeps a manifest of the LastWriteTime of every hole and
+    batch folder seen in the previous scan, together with the records
+    parsed from them. Adding or removing a batch folder changes the hole
+    directory's LastWriteTime and creating depth.txt changes the batch
+    folder's, so a hole is only listed again when its own timestamp moved
+    or when one of its batch folders had no usable depth.txt yet, and a
+    depth.txt is only read again when its batch folder changed.
+
+    With ``snapshot_path`` the manifest is saved after every scan and loaded
+    back on start, so ``cached()`` can answer from the last known state
+    right after a restart while a background refresh runs.
+
+    A ``read_only`` scanner never touches the share: it follows the snapshot
+    written by the scanner process (scanner_service.py) and reloads it
+    whenever the file changes, so web workers only read local state. Failed
+    scans are published too (``last_error``), so the readers can tell that
+    the share stopped answering without trying it themselves.
+
+    Every scan after the first one is compared with the previous manifest
+    and the differences are appended to a change log (batch_added,
+    depth_ready, batch_removed), numbered with an increasing ``seq``. The
+    last ``change_log_size`` events are kept, also in the snapshot, and
+    served by changes_since().
+    """
+
+    def __init__(self, backend, base_path, make_record, workers=1, include_hole=None, snapshot_path=None,
+                 read_only=False, change_log_size=1000):
+        self.backend = backend
+        self.base_path = base_path
+        self.make_record = make_record
+        self.workers = max(1, int(workers))
+        self.include_hole = include_hole
+        self.snapshot_path = snapshot_path
+        self.read_only = read_only
+        self._snapshot_stamp = None
+        self.manifest = {}
+        self.scanned_at = None
+        self.last_error = None
+        self.change_log_size = change_log_size
+        self.changes = []
+        self.change_seq = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # scan() and rescan_holes() both rebuild the manifest, one at a time
+        self._scan_lock = threading.Lock()
+        # Concurrent scan() callers share the scan already running
+        self._flight = SingleFlight()
+
+        if self.reload_snapshot():
+            logger.info(f"Loaded SMB snapshot from {snapshot_path} (scanned at {self.scanned_at})")
+
+    def reload_snapshot(self):
+        """
+        Loads the snapshot file if it changed since it was last loaded (one
+        stat() otherwise). Returns True when a new snapshot was loaded.
+        """
+        stamp = _file_stamp(self.snapshot_path)
+        if stamp is None or stamp == self._snapshot_stamp:
+            return False
+        snapshot = load_snapshot(self.snapshot_path)
+        if not snapshot:
+            return False
+        with self._lock:
+            self.manifest = snapshot['holes']
+            self.scanned_at = snapshot['scanned_at']
+            self.changes = snapshot.get('changes', [])
+            self.change_seq = snapshot.get('change_seq', 0)
+            if self.read_only:
+                self.last_error = snapshot.get('last_error')
+            self._snapshot_stamp = stamp
+        return True
+
+    def list_holes(self):
+        with self.backend.connection() as conn:
+            holes = self.backend.list_dirs(conn, self.backend.path(self.base_path))
+        if self.include_hole:
+            holes = [h for h in holes if self.include_hole(h[0])]
+        return holes
+
+    def scan(self, full=False):
+        """
+        Returns the records of every batch in the tree.
+
+        Unchanged holes are answered from the manifest unless ``full`` is set.
+        Callers arriving while a scan with the same ``full`` flag is running
+        wait for it and get its result instead of starting another one, so
+        the load on the share does not grow with the number of callers.
+        """
+        if self.read_only:
+            self.reload_snapshot()
+            return self.records()
+
+        resultados, shared = self._flight.do(("scan", bool(full)), self._locked_scan, full)
+        if shared:
+            return [dict(record) for record in resultados]
+        return resultados
+
+    def _locked_scan(self, full):
+        with self._scan_lock:
+            return self._scan(full)
+
+    def _scan(self, full):
+        started = time.monotonic()
+        holes = self.list_holes()
+        with self._lock:
+            previous = {} if full else self.manifest
+
+        jobs = [(name, _mtime_key(mtime), previous.get(name)) for name, mtime in holes]
+
+        if self.workers == 1 or len(jobs) < 2:
+            per_hole = [self._scan_hole_job(job) for job in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smb-scan") as executor:
+                per_hole = list(executor.map(self._scan_hole_job, jobs))
+
+        manifest = {}
+        resultados = []
+        for (name, _, _), entry in zip(jobs, per_hole):
+            if entry is None:
+                continue
+            manifest[name] = entry
+            resultados.extend(_entry_records(entry))
+
+        self._publish(manifest, started)
+
+        reused = sum(1 for (_, _, prev), entry in zip(jobs, per_hole) if prev is not None and entry is prev)
+        logger.info(f"SMB scan: {len(jobs)} holes, {reused} unchanged, {len(resultados)} batches")
+        return resultados
+
+    def records(self):
+        """Records of the last completed scan (or of the loaded snapshot)."""
+        with self._lock:
+            manifest = self.manifest
+        return [record for entry in manifest.values() for record in _entry_records(entry)]
+
+    def batch_folder(self, hole_id, to):
+        """
+        Name of the batch folder of ``hole_id`` ending at depth ``to``, looked
+        up in the manifest so "1.50" finds batch-1.5. Falls back to
+        ``batch-<to>`` when the folder has not been scanned.
+        """
+        with self._lock:
+            entry = self.manifest.get(hole_id)
+        if entry is not None:
+            try:
+                target = round(float(to), 2)
+                for folder in entry["batches"]:
+                    if round(float(folder[len(BATCH_PREFIX):]), 2) == target:
+                        return folder
+            except ValueError:
+                pass
+        return f"{BATCH_PREFIX}{to}"
+
+    def stats(self):
+        """Size and age of the last scan, from memory only (no share access)."""
+        with self._lock:
+            manifest = self.manifest
+            refreshing = self._refreshing
+        return {
+            "holes": len(manifest),
+            "batches": sum(1 for entry in manifest.values() for b in entry["batches"].values() if b["record"] is not None),
+            "scanned_at": self.scanned_at,
+            "age": self.age(),
+            "scanning": refreshing or self._flight.in_flight(("scan", False)) or self._flight.in_flight(("scan", True)),
+            "last_error": self.last_error,
+        }
+
+    def age(self):
+        """Seconds since the last completed scan, None if there was none."""
+        if self.scanned_at is None:
+            return None
+        return (datetime.now() - datetime.fromisoformat(self.scanned_at)).total_seconds()
+
+    def refresh(self, full=False):
+        """
+        scan() that never raises: on error the last known records are returned
+        and the error is saved in the snapshot for read-only scanners.
+        """
+        started = time.monotonic()
+        try:
+            resultados = self.scan(full=full)
+            self.last_error = None
+            return resultados
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"SMB scan failed: {e}")
+            if not self.read_only:
+                with self._lock:
+                    manifest, scanned_at = self.manifest, self.scanned_at
+                self._save_snapshot(manifest, scanned_at, time.monotonic() - started, last_error=self.last_error)
+            return self.records()
+
+    def cached(self, max_age):
+        """
+        Returns the last known records without waiting for the share.
+
+        If they are older than ``max_age`` seconds a refresh is started in a
+        background thread. Only when nothing was ever scanned does the caller
+        wait for a scan.
+        """
+        if self.read_only:
+            self.reload_snapshot()
+            return self.records()
+
+        age = self.age()
+        if age is None:
+            return self.refresh()
+        if age > max_age:
+            self.refresh_in_background()
+        return self.records()
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="smb-refresh", daemon=True).start()
+
+    def scan_hole(self, hole_id):
+        """Re-reads one hole ignoring the manifest. Returns its records."""
+        entry = self._scan_hole(hole_id, None, None)
+        return _entry_records(entry) if entry else []
+
+    def rescan_holes(self, hole_ids):
+        """
+        Targeted rescan: re-lists only ``hole_ids`` and merges them into the
+        manifest (and snapshot). A hole that can no longer be opened is
+        dropped. Returns the records of the whole tree.
+        """
+        if self.read_only:
+            self.reload_snapshot()
+            return self.records()
+
+        with self._scan_lock:
+            self._rescan_holes(hole_ids)
+        return self.records()
+
+    def _rescan_holes(self, hole_ids):
+        started = time.monotonic()
+        with self._lock:
+            manifest = dict(self.manifest)
+
+        for hole_id in hole_ids:
+            if self.include_hole and not self.include_hole(hole_id):
+                continue
+            prev = manifest.get(hole_id)
+            # The hole's own LastWriteTime is unknown without listing the base
+            # directory; None makes the next full scan list it once more.
+            entry = self._scan_hole(hole_id, None, prev)
+            if entry is None:
+                manifest.pop(hole_id, None)
+            else:
+                manifest[hole_id] = entry
+
+        self._publish(manifest, started)
+
+        logger.info(f"SMB targeted rescan of {len(hole_ids)} holes")
+
+    def changes_since(self, seq, limit=500):
+        """
+        Change events with a ``seq`` greater than ``seq``, oldest first, at
+        most ``limit`` of them. Returns ``(events, reset)``; ``reset`` is True
+        when events after ``seq`` were already dropped from the log (or the
+        log restarted), so the caller has to reload the full state.
+        """
+        if self.read_only:
+            self.reload_snapshot()
+        with self._lock:
+            changes = self.changes
+            current = self.change_seq
+        oldest = changes[0]["seq"] if changes else current + 1
+        reset = seq is None or seq > current or seq < oldest - 1
+        if reset:
+            return [], True
+        events = [e for e in changes if e["seq"] > seq]
+        return events[:limit], False
+
+    def _publish(self, manifest, started):
+        """Installs a new manifest, logs what changed and saves the snapshot."""
+        scanned_at = datetime.now().isoformat()
+        with self._lock:
+            previous = self.manifest
+            baseline = self.scanned_at is not None
+            changes = list(self.changes)
+            seq = self.change_seq
+            if baseline:
+                for event in _diff_manifests(previous, manifest):
+                    seq += 1
+                    changes.append(dict(event, seq=seq, at=scanned_at))
+                changes = changes[-self.change_log_size:] if self.change_log_size else []
+            self.manifest = manifest
+            self.scanned_at = scanned_at
+            self.changes = changes
+            self.change_seq = seq
+
+        self._save_snapshot(manifest, scanned_at, time.monotonic() - started)
+
+    def _save_snapshot(self, manifest, scanned_at, duration, last_error=None):
+        if not self.snapshot_path:
+            return
+        try:
+            with self._lock:
+                changes, change_seq = self.changes, self.change_seq
+            save_snapshot(self.snapshot_path, manifest, scanned_at, duration, changes, change_seq, last_error)
+            self._snapshot_stamp = _file_stamp(self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not write SMB snapshot {self.snapshot_path}: {e}")
+
+    def _scan_hole_job(self, job):
+        hole_id, mtime, prev = job
+        if prev is not None and prev["mtime"] == mtime and _settled(prev):
+            return prev
+        return self._scan_hole(hole_id, mtime, prev)
+
+    def _scan_hole(self, hole_id, mtime, prev):
+        backend = self.backend
+        hole_path = backend.path(self.base_path, hole_id)
+        prev_batches = prev["batches"] if prev else {}
+        batches = {}
+
+        with backend.connection() as conn:
+            try:
+                folders = backend.list_dirs(conn, hole_path, BATCH_PREFIX + "*")
+            except backend.errors as e:
+                logger.warning(f"Could not open hole directory {hole_id}: {e}")
+                return None
+
+            for batch_folder, folder_mtime in folders:
+                if not batch_folder.startswith(BATCH_PREFIX):
+                    continue
+                folder_mtime = _mtime_key(folder_mtime)
+                cached = prev_batches.get(batch_folder)
+                if cached is not None and cached["mtime"] == folder_mtime:
+                    batches[batch_folder] = cached
+                    continue
+                record, final = self._read_batch(conn, hole_id, batch_folder)
+                batches[batch_folder] = {
+                    "mtime": folder_mtime if final else None,
+                    "record": record,
+                }
+
+        return {"mtime": mtime, "batches": batches}
+
+    def _read_batch(self, conn, hole_id, batch_folder):
+        """
+        Returns ``(record, final)``. ``final`` is False when the read should be
+        retried on the next scan even if the batch folder did not change
+        (depth.txt being written, unreadable or half-written content).
+        """
+        backend = self.backend
+        depth_path = backend.path(self.base_path, hole_id, batch_folder, DEPTH_FILE)
+        try:
+            raw = backend.read_file(conn, depth_path)
+            record = self.make_record(hole_id, batch_folder, raw)
+            return record, record is not None
+        except backend.missing_errors:
+            # Creating depth.txt will bump the batch folder's LastWriteTime
+            return None, True
+        except backend.errors as e:
+            logger.warning(f"Could not read depth file for {hole_id}/{batch_folder}: {e}")
+        except (IndexError, ValueError) as e:
+            logger.warning(f"Invalid depth file format for {hole_id}/{batch_folder}: {e}")
+        return None, False
+
+
+_scanners = {}
+_scanners_lock = threading.Lock()
+
+
+def get_scanner(backend, base_path, make_record, workers=1, include_hole=None, snapshot_path=None, read_only=False,
+                change_log_size=1000):
+    """
+    Process-wide scanner for backend/base_path, so its manifest survives
+    between calls to leer_orexplore_smb().
+    """
+    key = (backend.key, base_path)
+    with _scanners_lock:
+        scanner = _scanners.get(key)
+        if scanner is None:
+            scanner = OrexploreScanner(backend, base_path, make_record, workers, include_hole, snapshot_path,
+                                       read_only, change_log_size)
+            _scanners[key] = scanner
+        else:
+            scanner.workers = max(1, int(workers))
+        return scanner
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _mtime_key(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _diff_manifests(old, new):
+    """
+    Change events between two manifests: batch folders that appeared
+    (batch_added, with the record if depth.txt was already there), depth.txt
+    records that appeared or changed (depth_ready) and batch folders that
+    are gone (batch_removed). Holes whose entry is the same object are
+    skipped without looking inside.
+    """
+    for hole_id, entry in new.items():
+        old_entry = old.get(hole_id)
+        if entry is old_entry:
+            continue
+        old_batches = old_entry["batches"] if old_entry else {}
+        for folder, batch in entry["batches"].items():
+            old_batch = old_batches.get(folder)
+            if old_batch is None:
+                yield {"type": "batch_added", "hole_id": hole_id, "batch_folder": folder, "record": batch["record"]}
+            elif batch["record"] is not None and batch["record"] != old_batch["record"]:
+                yield {"type": "depth_ready", "hole_id": hole_id, "batch_folder": folder, "record": batch["record"]}
+        for folder in old_batches:
+            if folder not in entry["batches"]:
+                yield {"type": "batch_removed", "hole_id": hole_id, "batch_folder": folder, "record": None}
+
+    for hole_id, old_entry in old.items():
+        if hole_id not in new:
+            for folder in old_entry["batches"]:
+                yield {"type": "batch_removed", "hole_id": hole_id, "batch_folder": folder, "record": None}
+
+
+def _settled(entry):
+    """True when every batch folder of the hole already produced a record."""
+    return all(b["record"] is not None for b in entry["batches"].values())
+
+
+def _entry_records(entry):
+    return [dict(b["record"]) for b in entry["batches"].values() if b["record"] is not None]
@@ -0,0 +1,61 @@
+"""
+On-disk snapshot of the last SMB scan.
+
+The snapshot is the scanner manifest (hole -> batch folder -> LastWriteTime
+and parsed depth.txt record) plus scan timestamps, the error of the last
+scan attempt and the recent change events, stored as JSON so a restarted process can answer from the last
+known state immediately and resume incremental scanning instead of walking
+the whole share again.
+"""
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def load_snapshot(path):
+    """Returns the snapshot dict, or None if there is no usable snapshot."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable SMB snapshot {path}: {e}")
+        return None
+    if data.get('version') != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring SMB snapshot {path} with version {data.get('version')}")
+        return None
+    return data
+
+
+def save_snapshot(path, holes, scanned_at, duration, changes=(), change_seq=0, last_error=None):
+    """
+    Writes the snapshot atomically: readers either see the previous file or
+    the new one, never a partial write.
+    """
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'scanned_at': scanned_at,
+        'duration': round(duration, 3),
+        'holes': holes,
+        'changes': list(changes),
+        'change_seq': change_seq,
+        'last_error': last_error,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.smb_snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,215 @@
+"""
+Several Orexplore scanner machines, each writing to its own share.
+
+A source is a dict with ``name``, ``server``, ``share``, ``base_path``,
+``machine`` and optionally ``username``/``password``. ``SMB_SOURCES`` holds
+them as a JSON list; without it the single SMB_SERVER/SMB_SHARE/
+SMB_BASE_PATH location is the only source.
+
+MultiSourceScanner gives the same interface as OrexploreScanner over one
+scanner per source. Sources are scanned at the same time, so a scan takes
+as long as the slowest share instead of the sum of all of them, and a
+source that fails keeps serving its last known records without hiding the
+others.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SOURCE_KEYS = ("name", "server", "share", "base_path", "machine", "username", "password")
+
+
+def parse_sources(value, defaults):
+    """
+    Sources from a JSON list (``SMB_SOURCES``), missing keys taken from
+    ``defaults``. An empty value gives the single default source. Names
+    default to the machine name and must be unique.
+    """
+    entries = json.loads(value) if value and value.strip() else [{}]
+    if isinstance(entries, dict):
+        entries = [entries]
+
+    sources = []
+    for entry in entries:
+        unknown = set(entry) - set(SOURCE_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown SMB source keys: {', '.join(sorted(unknown))}")
+        source = dict(defaults, **entry)
+        source["name"] = entry.get("name") or source["machine"]
+        sources.append(source)
+
+    names = [s["name"] for s in sources]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate SMB source names: {', '.join(duplicates)} (set a 'name' per source)")
+    return sources
+
+
+def source_file(path, source, sources):
+    """Per-source variant of a file name (snapshot, cache directory) when there are several sources."""
+    if not path or len(sources) == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{source['name']}{ext}"
+
+
+class MultiSourceScanner:
+    """
+    ``scanners`` is a list of ``(source, OrexploreScanner)``; records come out
+    in source order.
+    """
+
+    def __init__(self, scanners):
+        self.scanners = list(scanners)
+
+    @property
+    def sources(self):
+        return [source for source, _ in self.scanners]
+
+    @property
+    def scanned_at(self):
+        """Time of the oldest of the last scans, None until every source was scanned."""
+        times = [scanner.scanned_at for _, scanner in self.scanners]
+        return None if None in times else min(times)
+
+    @property
+    def last_error(self):
+        errors = [f"{source['name']}: {scanner.last_error}" for source, scanner in self.scanners if scanner.last_error]
+        return "; ".join(errors) or None
+
+    def scan(self, full=False):
+        """
+        Scans every source concurrently. A source that fails is logged by its
+        scanner and contributes its last known records.
+        """
+        return _merge(self._each(lambda scanner: scanner.refresh(full=full)))
+
+    refresh = scan
+
+    def records(self):
+        return _merge(scanner.records() for _, scanner in self.scanners)
+
+    def cached(self, max_age):
+        return _merge(self._each(lambda scanner: scanner.cached(max_age)))
+
+    def refresh_in_background(self):
+        for _, scanner in self.scanners:
+            scanner.refresh_in_background()
+
+    def reload_snapshot(self):
+        """Reloads the snapshot files that changed; True if any was loaded."""
+        return any([scanner.reload_snapshot() for _, scanner in self.scanners])
+
+    def age(self):
+        ages = [scanner.age() for _, scanner in self.scanners]
+        return None if None in ages else max(ages)
+
+    def stats(self):
+        per_source = [dict(scanner.stats(), name=source["name"], machine=source["machine"])
+                      for source, scanner in self.scanners]
+        scanned = [s["scanned_at"] for s in per_source]
+        ages = [s["age"] for s in per_source]
+        return {
+            "holes": sum(s["holes"] for s in per_source),
+            "batches": sum(s["batches"] for s in per_source),
+            "scanned_at": None if None in scanned else min(scanned),
+            "age": None if None in ages else max(ages),
+            "scanning": any(s["scanning"] for s in per_source),
+            "last_error": self.last_error,
+            "sources": per_source,
+        }
+
+    def changes_since(self, cursor, limit=500):
+        """
+        Change events of every source after ``cursor``, oldest first.
+
+        The cursor is opaque to clients (``name:seq`` per source). Returns a
+        dict with the events (each tagged with its ``source``), the cursor to
+        send next time, ``more`` when ``limit`` cut the list and ``reset``
+        when some events were already dropped (or no cursor was given) and
+        the client should reload the full state first.
+        """
+        positions = parse_cursor(cursor)
+        reset = positions is None
+        positions = positions or {}
+
+        events = []
+        next_positions = {}
+        for order, (source, scanner) in enumerate(self.scanners):
+            name = source["name"]
+            # One event past the limit tells whether this source alone fills the page
+            source_events, source_reset = scanner.changes_since(positions.get(name), limit + 1)
+            if source_reset:
+                reset = True
+                next_positions[name] = scanner.change_seq
+                continue
+            next_positions[name] = positions[name]
+            events.extend((event["at"], order, event["seq"], name, event) for event in source_events)
+
+        events.sort(key=lambda item: item[:3])
+        more = len(events) > limit
+        changes = []
+        for _, _, seq, name, event in events[:limit]:
+            changes.append(dict(event, source=name))
+            next_positions[name] = seq
+
+        return {
+            "cursor": format_cursor(next_positions),
+            "changes": changes,
+            "more": more,
+            "reset": reset,
+        }
+
+    def locate(self, hole_id, machine=None):
+        """
+        ``(source, scanner)`` holding ``hole_id``: the source of ``machine`` if
+        its manifest has the hole, else any source that has it, else the
+        source of ``machine``, else the first source.
+        """
+        def is_machine(source):
+            return machine and machine in (source["machine"], source["name"])
+
+        for matches in (
+            lambda source, scanner: is_machine(source) and hole_id in scanner.manifest,
+            lambda source, scanner: hole_id in scanner.manifest,
+            lambda source, scanner: is_machine(source),
+        ):
+            for source, scanner in self.scanners:
+                if matches(source, scanner):
+                    return source, scanner
+        return self.scanners[0]
+
+    def batch_folder(self, hole_id, to, machine=None):
+        _, scanner = self.locate(hole_id, machine)
+        return scanner.batch_folder(hole_id, to)
+
+    def _each(self, fn):
+        if len(self.scanners) == 1:
+            return [fn(self.scanners[0][1])]
+        with ThreadPoolExecutor(max_workers=len(self.scanners), thread_name_prefix="smb-source") as executor:
+            return list(executor.map(lambda item: fn(item[1]), self.scanners))
+
+
+def parse_cursor(cursor):
+    """``name:seq,name:seq`` -> {name: seq}; None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    positions = {}
+    try:
+        for part in cursor.split(","):
+            name, seq = part.rsplit(":", 1)
+            positions[name] = int(seq)
+    except ValueError:
+        return None
+    return positions
+
+
+def format_cursor(positions):
+    return ",".join(f"{name}:{seq}" for name, seq in positions.items())
+
+
+def _merge(per_source):
+    merged = []
+    for records in per_source:
+        merged.extend(records)
+    return merged
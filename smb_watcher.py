@@ -0,0 +1,205 @@
+"""
+SMB2 CHANGE_NOTIFY watcher for the Orexplore tree.
+
+Instead of rescanning the whole share on a timer, the watcher registers a
+change notification on the base directory (new or modified hole folders)
+and a recursive one on each active hole (batch folders and depth.txt being
+written). When the server reports a change, only the holes involved are
+rescanned through OrexploreScanner.rescan_holes().
+
+If nothing is reported for ``poll_interval`` seconds an incremental scan
+runs anyway, as a safety net for missed notifications. ``run()`` returns
+False straight away when the server does not support CHANGE_NOTIFY so the
+caller can fall back to plain interval polling.
+"""
+import logging
+import threading
+import time
+
+from smbprotocol.change_notify import ChangeNotifyFlags, CompletionFilter, FileSystemWatcher
+from smbprotocol.exceptions import (
+    InvalidDeviceRequest,
+    NotSupported,
+    SMBException,
+    SMBResponseException,
+)
+
+from smb_scanner import open_dir, smb_path
+
+logger = logging.getLogger(__name__)
+
+# Base directory: holes created, removed or renamed, or whose LastWriteTime
+# moved because a batch folder was added inside them
+BASE_FILTER = (
+    CompletionFilter.FILE_NOTIFY_CHANGE_DIR_NAME
+    | CompletionFilter.FILE_NOTIFY_CHANGE_LAST_WRITE
+)
+# Active holes (recursive): batch folders and depth.txt created or written
+HOLE_FILTER = (
+    CompletionFilter.FILE_NOTIFY_CHANGE_DIR_NAME
+    | CompletionFilter.FILE_NOTIFY_CHANGE_FILE_NAME
+    | CompletionFilter.FILE_NOTIFY_CHANGE_LAST_WRITE
+    | CompletionFilter.FILE_NOTIFY_CHANGE_SIZE
+)
+
+_FULL_SCAN = object()
+
+
+class SMBChangeWatcher:
+    """
+    Needs a scanner with an SMBBackend.
+
+    ``on_change(records)`` is called with the records of the whole tree after
+    every rescan. ``active_holes()`` returns the hole ids worth a recursive
+    watch (e.g. holes with batches still pending); at most ``max_holes`` of
+    them are watched at the same time.
+    """
+
+    def __init__(self, scanner, on_change, active_holes=None, poll_interval=300,
+                 settle=2, max_holes=16, retry_delay=30):
+        self.scanner = scanner
+        self.on_change = on_change
+        self.active_holes = active_holes or (lambda: [])
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.max_holes = max_holes
+        self.retry_delay = retry_delay
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """
+        Watches until stop() is called. Returns False if the server does not
+        support CHANGE_NOTIFY.
+        """
+        self._rescan(_FULL_SCAN)
+
+        while not self._stop.is_set():
+            try:
+                changed = self._watch_once()
+            except (NotSupported, InvalidDeviceRequest) as e:
+                logger.warning(f"SMB CHANGE_NOTIFY not supported by the server ({e})")
+                return False
+            except Exception as e:
+                logger.error(f"SMB watcher error, rescanning in {self.retry_delay}s: {e}")
+                self._stop.wait(self.retry_delay)
+                changed = _FULL_SCAN
+
+            if not self._stop.is_set():
+                self._rescan(changed)
+
+        return True
+
+    def _rescan(self, changed):
+        if changed is _FULL_SCAN:
+            records = self.scanner.refresh()
+        else:
+            logger.info(f"SMB change notification for holes: {', '.join(sorted(changed))}")
+            records = self.scanner.rescan_holes(sorted(changed))
+
+        try:
+            self.on_change(records)
+        except Exception as e:
+            logger.error(f"SMB watcher callback failed: {e}")
+
+    def _watch_once(self):
+        """
+        Registers the watches, waits for the first notification and returns
+        the set of hole ids that changed, or _FULL_SCAN on timeout or when
+        the server could not say what changed.
+        """
+        base_path = self.scanner.base_path
+        handles = []
+        watchers = {}
+
+        with self.scanner.backend.pool.connection() as tree:
+            try:
+                base_dir = open_dir(tree, smb_path(base_path))
+                handles.append(base_dir)
+                watchers[None] = _start_watch(base_dir, BASE_FILTER, ChangeNotifyFlags.NONE)
+
+                for hole_id in self._holes_to_watch():
+                    try:
+                        hole_dir = open_dir(tree, smb_path(base_path, hole_id))
+                    except SMBException:
+                        continue
+                    handles.append(hole_dir)
+                    watchers[hole_id] = _start_watch(hole_dir, HOLE_FILTER, ChangeNotifyFlags.SMB2_WATCH_TREE)
+
+                if not self._wait_any(watchers.values(), self.poll_interval):
+                    return _FULL_SCAN
+
+                # Copying a batch produces a burst of events, let it settle
+                self._stop.wait(self.settle)
+                return _collect_changes(watchers)
+
+            finally:
+                for watcher in watchers.values():
+                    if not watcher.response_event.is_set():
+                        try:
+                            watcher.cancel()
+                        except Exception:
+                            pass
+                for handle in handles:
+                    try:
+                        handle.close()
+                    except SMBException:
+                        pass
+
+    def _holes_to_watch(self):
+        seen = []
+        for hole_id in self.active_holes():
+            if hole_id and hole_id not in seen:
+                seen.append(hole_id)
+            if len(seen) >= self.max_holes:
+                break
+        return seen
+
+    def _wait_any(self, watchers, timeout):
+        deadline = time.monotonic() + timeout
+        while not self._stop.is_set():
+            if any(w.response_event.is_set() for w in watchers):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._stop.wait(min(0.5, remaining))
+        return False
+
+
+def _start_watch(handle, completion_filter, flags):
+    watcher = FileSystemWatcher(handle)
+    watcher.start(completion_filter, flags=flags)
+    return watcher
+
+
+def _collect_changes(watchers):
+    changed = set()
+    for hole_id, watcher in watchers.items():
+        if not watcher.response_event.is_set():
+            continue
+
+        try:
+            actions = watcher.result
+        except SMBResponseException:
+            # NotSupported on the base directory means no CHANGE_NOTIFY at all
+            if hole_id is None:
+                raise
+            changed.add(hole_id)
+            continue
+
+        if not actions:
+            # STATUS_NOTIFY_ENUM_DIR: too many changes to describe
+            if hole_id is None:
+                return _FULL_SCAN
+            changed.add(hole_id)
+            continue
+
+        for action in actions:
+            if hole_id is None:
+                changed.add(action["file_name"].get_value().split("\\")[0])
+            else:
+                changed.add(hole_id)
+    return changed
@@ -58,7 +58,7 @@ async function loadBatches(page = 1) {
             : '<span class="status-icon status-incorrect">✗</span>';
 
         row.innerHTML = `
-            <td>${batch.batch_number}</td>
+            <td>${batch.display_number ?? batch.batch_number}</td>
             <td>${batch.hole_id}</td>
             <td>${batch.from}</td>
             <td>${batch.to}</td>
@@ -104,15 +104,12 @@ async function deleteBatch(batchNumber) {
 // PREVIEW
 // ============================================================
 
-async function showPreview(batchNumber) {
-    const response = await fetch(`/api/preview/${batchNumber}`);
-    const data = await response.json();
-
-    if (data.image_path) {
-        openPreviewModal(data.image_path);
-    } else {
-        alert("No hay imagen disponible para este batch.");
-    }
+function showPreview(batchNumber) {
+    // /api/preview devuelve la imagen (cacheada en el servidor, 304 si no cambió)
+    const image = new Image();
+    image.onload = () => openPreviewModal(image.src);
+    image.onerror = () => alert("No hay imagen disponible para este batch.");
+    image.src = `/api/preview/${batchNumber}`;
 }
 
 
@@ -227,7 +224,7 @@ async function loadStatusData(page = 1) {
 
         const row = document.createElement("tr");
         row.innerHTML = `
-            <td>${batch.batch_number ?? ""}</td>
+            <td>${batch.display_number ?? batch.batch_number ?? ""}</td>
             <td>${batch.hole_id ?? "-"}</td>
             <td>${batch.from ?? "-"}</td>
             <td>${batch.to ?? "-"}</td>
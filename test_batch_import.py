@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Regression check for bulk imports with an old created_at.
+
+An imported batch gets a new, high batch_number, but the archiver files it
+under its created_at month, so that month's batch_number range overlaps the
+others in index.json. The batch must still be found by get(), listed in
+batch_number order by page() and editable (moved back to the hot partition).
+
+    python test_batch_import.py
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from batch_archive import PartitionedBatchStore
+from batch_import import import_batches, parse_batches
+from batch_store import SQLiteBatchStore
+
+NOW = datetime(2026, 10, 17)
+
+
+def test_backdated_import_in_archived_month():
+    with tempfile.TemporaryDirectory() as directory:
+        store = PartitionedBatchStore(
+            SQLiteBatchStore(os.path.join(directory, "batches.db"), os.path.join(directory, "batches.json")),
+            os.path.join(directory, "archive"),
+            hot_months=2,
+            archive_interval=0,
+        )
+        store.add_many([
+            {"hole_id": "H1", "from": str(i), "to": str(i + 1), "status": "correct",
+             "created_at": f"2026-0{1 + i // 5}-10T08:00:00"}
+            for i in range(10)
+        ])
+        assert store.archive(NOW) == 10  # 2026-01: 1..5, 2026-02: 6..10
+
+        # Backdated row: batch 11, archived into January
+        rows, errors = parse_batches("hole_id,from,to,created_at\nH2,0,1,2026-01-20T09:00:00\n", "csv")
+        assert not errors
+        imported = import_batches(store, rows, lambda batch: "correct")["batches"]
+        number = imported[0]["batch_number"]
+        assert number == 11
+        assert store.archive(NOW) == 1
+        assert store.hot.get(number) is None
+
+        for batch_number in range(1, 12):
+            batch = store.get(batch_number)
+            assert batch is not None and batch["batch_number"] == batch_number, batch_number
+
+        newest, total = store.page(1, 20)
+        assert total == 11
+        assert [b["batch_number"] for b in newest] == list(range(11, 0, -1))
+        oldest, _ = store.page(2, 4, newest_first=False)
+        assert [b["batch_number"] for b in oldest] == [5, 6, 7, 8]
+
+        # 7 sits in February although January's range (1..11) also holds it
+        assert store.update(7, {"comentarios": "ok"})["comentarios"] == "ok"
+        assert store.hot.get(7) is not None
+        assert store.delete(number)
+        assert store.get(number) is None
+        assert store.count() == 10
+
+
+if __name__ == "__main__":
+    test_backdated_import_in_archived_month()
+    print("✓ backdated import: get/page/update/delete across overlapping archive months")
+    sys.exit(0)
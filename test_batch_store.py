@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Checks of JournalBatchStore (batch_store.py) with two instances sharing one
+journal, as two web workers do: add, delete, compact and reopen.
+
+    python test_batch_store.py
+"""
+import json
+import os
+import sys
+import tempfile
+
+from batch_store import JournalBatchStore
+
+
+def open_store(directory):
+    return JournalBatchStore(os.path.join(directory, "batches.journal.jsonl"),
+                             os.path.join(directory, "batches.snapshot.json"), compact_interval=0)
+
+
+def numbers(store):
+    return [b["batch_number"] for b in store.all()]
+
+
+def test_two_instances_share_the_journal():
+    with tempfile.TemporaryDirectory() as directory:
+        a, b = open_store(directory), open_store(directory)
+
+        a.add_many([{"hole_id": "H1", "from": "0", "to": "1.5"}, {"hole_id": "H1", "from": "1.5", "to": "3"}])
+        added = b.add({"hole_id": "H2", "from": "0", "to": "2"})
+        assert added["batch_number"] == 3  # b caught up with a before numbering
+        assert numbers(a) == numbers(b) == [1, 2, 3]
+
+        # Deleted numbers are never reused, by either instance
+        assert a.delete(3)
+        assert not b.delete(3)
+        assert b.add({"hole_id": "H2", "from": "2", "to": "4"})["batch_number"] == 4
+        assert a.update(1, {"status": "correct"})["status"] == "correct"
+        assert b.get(1)["status"] == "correct"
+        assert numbers(a) == numbers(b) == [1, 2, 4]
+        assert [x["batch_number"] for x in b.find(hole_id="H2")] == [4]
+
+
+def test_compact_and_reopen():
+    with tempfile.TemporaryDirectory() as directory:
+        a, b = open_store(directory), open_store(directory)
+        a.add_many([{"hole_id": "H1", "to": str(n)} for n in range(1, 6)])
+        b.delete(5)
+        b.update(2, {"comentarios": "ok"})
+
+        assert a.compact() == 7  # 5 creates, the delete and the update, from both instances
+        assert os.path.getsize(os.path.join(directory, "batches.journal.jsonl")) == 0
+        with open(os.path.join(directory, "batches.snapshot.json")) as f:
+            snapshot = json.load(f)
+        assert [x["batch_number"] for x in snapshot["batches"]] == [1, 2, 3, 4]
+        assert snapshot["last_batch_number"] == 5
+
+        # The other instance follows the new snapshot and keeps writing
+        assert numbers(b) == [1, 2, 3, 4]
+        assert b.add({"hole_id": "H1", "to": "6"})["batch_number"] == 6
+        assert a.get(6)["to"] == "6"
+
+        # A fresh instance rebuilds the same state from snapshot + journal
+        reopened = open_store(directory)
+        assert numbers(reopened) == [1, 2, 3, 4, 6]
+        assert reopened.get(2)["comentarios"] == "ok"
+        assert reopened.add({"hole_id": "H1"})["batch_number"] == 7  # 5 stays retired after compaction
+
+        # The compacting instance keeps its state without reloading it
+        assert a.add({"hole_id": "H1"})["batch_number"] == 8
+        assert numbers(a) == numbers(reopened) == [1, 2, 3, 4, 6, 7, 8]
+
+        # History keeps every folded record
+        with open(os.path.join(directory, "batches.journal.jsonl.history")) as f:
+            ops = [json.loads(line)["op"] for line in f]
+        assert ops == ["create"] * 5 + ["delete", "update"]
+
+
+if __name__ == "__main__":
+    test_two_instances_share_the_journal()
+    test_compact_and_reopen()
+    print("✓ journal store: two instances, add/delete/update, compact and reopen")
+    sys.exit(0)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Checks of ReconcileIndex (reconcile.py): exact keys, tolerance matching and
+the nearest-record bisect, including a hole's first batch (from 0).
+
+    python test_reconcile.py
+"""
+import random
+import sys
+
+import batch_columns
+from reconcile import ReconcileIndex, match_quality
+
+TOLERANCE = 0.05
+
+
+def smb(hole, from_, to):
+    return {"M_hole_id": hole, "M_from": from_, "M_to": to, "M_machine": "OREXPLORE"}
+
+
+def test_exact_match_normalizes_keys():
+    record = smb("H1", 12.3, 15.0)
+    index = ReconcileIndex([record, smb("H1", 12.3, 15.0)])
+    assert index.exact(" H1 ", "12.30", "15") is record  # first record wins
+    assert index.by_depth("H1", "15.00") is record
+    assert index.match("H1", "12.3", "15.0", TOLERANCE) == (record, {"from": 0.0, "to": 0.0})
+    assert index.exact("H2", "12.3", "15.0") is None
+
+
+def test_tolerance_matching():
+    record = smb("H1", 10.0, 12.3)
+    index = ReconcileIndex([record])
+
+    # Typed 12.31 by hand: within tolerance, delta is machine minus OP
+    found, delta = index.match("H1", "10.0", "12.31", TOLERANCE)
+    assert found is record and delta == {"from": 0.0, "to": -0.01}
+    assert match_quality(delta, TOLERANCE) == "tolerance"
+
+    # Exactly on the tolerance still matches, past it does not
+    assert index.match("H1", "10.0", "12.35", TOLERANCE)[0] is record
+    assert index.match("H1", "10.0", "12.36", TOLERANCE) == (None, None)
+    assert index.match("H1", "10.0", "12.31") == (None, None)  # no tolerance: exact only
+    assert index.by_depth("H1", "12.36", TOLERANCE) is None
+
+    # from counts too: a close to with a far from is not a match
+    assert index.match("H1", "9.0", "12.3", TOLERANCE) == (None, None)
+
+    # Without a tolerance nearest() always answers
+    found, delta = index.nearest("H1", "9.0", "12.3")
+    assert found is record and match_quality(delta, TOLERANCE) == "nearest"
+    assert match_quality(None) == "none"
+
+
+def test_first_batch_from_zero():
+    record = smb("H1", 0.0, 1.5)
+    index = ReconcileIndex([record, smb("H1", 1.5, 3.0)])
+    found, delta = index.match("H1", "0", "1.5", TOLERANCE)
+    assert found is record and match_quality(delta, TOLERANCE) == "exact"
+    assert index.nearest("H1", "0.01", "1.5", TOLERANCE)[0] is record
+
+    if batch_columns.available():
+        batches = [{"batch_number": 1, "hole_id": "H1", "from": "0", "to": "1.5"},
+                   {"batch_number": 2, "hole_id": "H1", "from": "1.5", "to": "3.0"},
+                   {"batch_number": 3, "hole_id": "H1", "from": "3.0", "to": "4.5"}]
+        statuses = batch_columns.depth_statuses(batches, [record, smb("H1", None, 3.0)], TOLERANCE)
+        assert statuses == ["correct", "in_progress", "pending"]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(0)
+    records = [smb(f"H{rng.randrange(3)}", round(rng.uniform(0, 300), 2), round(rng.uniform(0, 300), 2))
+               for _ in range(600)]
+    records.append(smb("H0", None, 50.0))
+    index = ReconcileIndex(records)
+
+    for _ in range(500):
+        hole = f"H{rng.randrange(4)}"
+        from_ = round(rng.uniform(0, 300), 2) if rng.random() < 0.5 else None
+        to = round(rng.uniform(0, 300), 2)
+        tolerance = rng.choice((None, 0.05, 1.0, 20.0))
+
+        best = None
+        for record in records:
+            if record["M_hole_id"] != hole or (from_ is not None and record["M_from"] is None):
+                continue
+            score = abs(record["M_to"] - to)
+            if from_ is not None:
+                score = max(score, abs(record["M_from"] - from_))
+            if (tolerance is None or score <= tolerance + 1e-9) and (best is None or score < best[0] - 1e-9):
+                best = (score, record)
+
+        found, delta = index.nearest(hole, from_, to, tolerance)
+        if best is None:
+            assert found is None, (hole, from_, to, tolerance)
+            continue
+        # Ties may pick another record at the same distance
+        score = abs(found["M_to"] - to) if from_ is None else max(abs(found["M_to"] - to), abs(found["M_from"] - from_))
+        assert found["M_hole_id"] == hole and abs(score - best[0]) <= 1e-9, (hole, from_, to, tolerance)
+        assert delta["to"] == round(found["M_to"] - to, 3)
+
+
+if __name__ == "__main__":
+    test_exact_match_normalizes_keys()
+    test_tolerance_matching()
+    test_first_batch_from_zero()
+    test_nearest_matches_brute_force()
+    print("✓ reconcile: exact keys, tolerance, from 0 and nearest match brute force")
+    sys.exit(0)
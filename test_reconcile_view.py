@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Checks of ReconcileView (reconcile_view.py): a page reconciles only its own
+stale rows, and edits and SMB change events make exactly the affected rows
+stale.
+
+    python test_reconcile_view.py
+"""
+import os
+import sys
+import tempfile
+
+from batch_store import SQLiteBatchStore
+from reconcile import ReconcileIndex, match_quality
+from reconcile_view import ReconcileView
+
+
+class Feed:
+    """Stand-in for MultiSourceScanner.changes_since(): events queued by the test."""
+
+    def __init__(self):
+        self.events = []
+        self.reset = True
+
+    def __call__(self, cursor):
+        events, self.events = self.events, []
+        reset, self.reset = self.reset, False
+        return {"cursor": "feed", "changes": events, "more": False, "reset": reset}
+
+
+def make_view(directory):
+    store = SQLiteBatchStore(os.path.join(directory, "batches.db"))
+    store.add_many([{"hole_id": f"H{n % 3}", "from": str(n), "to": str(n + 1), "status": "pending"}
+                    for n in range(30)])
+    records = [{"M_hole_id": f"H{n % 3}", "M_from": float(n), "M_to": float(n + 1), "M_machine": "OREXPLORE"}
+               for n in range(30)]
+    calls = []
+
+    def reconcile(batch, index):
+        calls.append(batch["batch_number"])
+        smb, delta = index.match(batch["hole_id"], batch["from"], batch["to"], 0.05)
+        return {"machine_values": smb, "match": match_quality(delta, 0.05)}
+
+    feed = Feed()
+    view = ReconcileView(store, reconcile, lambda: records, feed)
+    return store, view, records, feed, calls
+
+
+def test_page_reconciles_only_its_window():
+    with tempfile.TemporaryDirectory() as directory:
+        store, view, _, _, calls = make_view(directory)
+
+        rows, total = view.page(1, 10)
+        assert total == 30
+        assert [r["batch_number"] for r in rows] == list(range(30, 20, -1))
+        assert [r["display_number"] for r in rows] == list(range(30, 20, -1))
+        assert sorted(calls) == list(range(21, 31))
+        assert all(r["match"] == "exact" for r in rows)
+
+        calls.clear()
+        view.page(1, 10)
+        assert calls == []  # nothing changed: cached rows
+
+        rows, _ = view.page(2, 4, newest_first=False)
+        assert [r["batch_number"] for r in rows] == [5, 6, 7, 8] and sorted(calls) == [5, 6, 7, 8]
+
+
+def test_edits_and_smb_changes_make_rows_stale():
+    with tempfile.TemporaryDirectory() as directory:
+        store, view, records, feed, calls = make_view(directory)
+        view.page(1, 30)
+
+        # An edited batch: only its row
+        calls.clear()
+        store.update(12, {"to": "12.02"})
+        rows, _ = view.page(1, 30)
+        assert calls == [12]
+        assert next(r for r in rows if r["batch_number"] == 12)["match"] == "tolerance"
+
+        # An SMB change in H1: the rows of H1 only
+        calls.clear()
+        records[1] = dict(records[1], M_to=2.2)  # batch 2 (H1) no longer matches
+        feed.events = [{"hole_id": "H1", "type": "depth_ready"}]
+        rows, _ = view.page(1, 30)
+        assert sorted(calls) == [n for n in range(1, 31) if (n - 1) % 3 == 1]
+        assert next(r for r in rows if r["batch_number"] == 2)["match"] == "none"
+
+        # A reset of the feed: every row
+        calls.clear()
+        feed.reset = True
+        view.page(1, 30)
+        assert sorted(calls) == list(range(1, 31))
+
+
+def test_rows_equal_a_full_recompute():
+    with tempfile.TemporaryDirectory() as directory:
+        store, view, records, feed, calls = make_view(directory)
+        view.page(1, 10)
+        store.delete(25)
+        store.add({"hole_id": "H2", "from": "40", "to": "41", "status": "pending"})
+        store.update(3, {"hole_id": "H0"})
+        records.append({"M_hole_id": "H2", "M_from": 40.0, "M_to": 41.0, "M_machine": "OREXPLORE"})
+        feed.events = [{"hole_id": "H2", "type": "batch_added"}]
+
+        rows = [row for page in range(1, 5) for row in view.page(page, 10)[0]]
+        reconcile, index = view.reconcile, ReconcileIndex(records)
+        expected = [dict(batch, **reconcile(batch, index))
+                    for page in range(1, 5) for batch in store.page(page, 10)[0]]
+        assert rows == expected
+        assert [batch["batch_number"] for batch, _ in view.items()] == [b["batch_number"] for b in store.all()]
+
+
+if __name__ == "__main__":
+    test_page_reconciles_only_its_window()
+    test_edits_and_smb_changes_make_rows_stale()
+    test_rows_equal_a_full_recompute()
+    print("✓ reconcile view: windowed reconciling, stale rows by edit, SMB change and reset")
+    sys.exit(0)
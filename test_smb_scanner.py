@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Checks of the incremental manifest of OrexploreScanner (smb_scanner.py) on a
+local tree: a hole or batch folder whose LastWriteTime did not change is not
+listed or read again, one whose LastWriteTime moved is.
+
+    python test_smb_scanner.py
+"""
+import os
+import sys
+import tempfile
+
+from local_backend import LocalBackend
+from smb_scanner import OrexploreScanner, depth_record
+
+T0 = 1_790_000_000  # fixed mtimes: the test does not depend on the clock's resolution
+
+
+class CountingBackend(LocalBackend):
+    def __init__(self, root):
+        super().__init__(root)
+        self.listed = []
+        self.read = []
+
+    def list_dirs(self, conn, path, pattern="*"):
+        self.listed.append(path)
+        return super().list_dirs(conn, path, pattern)
+
+    def read_file(self, conn, path, length=2048):
+        self.read.append(path)
+        return super().read_file(conn, path, length)
+
+    def reset(self):
+        self.listed, self.read = [], []
+
+
+def write_batch(root, hole, folder, depth_from=None, mtime=T0):
+    path = os.path.join(root, hole, folder)
+    os.makedirs(path, exist_ok=True)
+    if depth_from is not None:
+        with open(os.path.join(path, "depth.txt"), "w") as f:
+            f.write(f"{depth_from}\n")
+    os.utime(path, (mtime, mtime))
+
+
+def touch(root, *parts, mtime):
+    os.utime(os.path.join(root, *parts), (mtime, mtime))
+
+
+def folders(paths):
+    return sorted(os.path.dirname(p) for p in paths)
+
+
+def test_unchanged_last_write_time_skips_the_folder():
+    with tempfile.TemporaryDirectory() as root:
+        write_batch(root, "H1", "batch-1.5", 0)
+        write_batch(root, "H1", "batch-3", 1.5)
+        write_batch(root, "H2", "batch-2", 0)
+        touch(root, "H1", mtime=T0)
+        touch(root, "H2", mtime=T0)
+
+        backend = CountingBackend(root)
+        scanner = OrexploreScanner(backend, "", depth_record)
+        records = scanner.scan()
+        assert sorted((r["M_hole_id"], r["M_from"], r["M_to"]) for r in records) == [
+            ("H1", 0.0, 1.5), ("H1", 1.5, 3.0), ("H2", 0.0, 2.0)]
+        assert len(backend.read) == 3
+
+        # Nothing moved: only the base directory is listed
+        backend.reset()
+        assert len(scanner.scan()) == 3
+        assert backend.listed == [""] and backend.read == []
+
+        # H1 changed (a new batch folder) and batch-3 was rewritten: only those are read
+        write_batch(root, "H1", "batch-4.5", 3.0, mtime=T0 + 60)
+        write_batch(root, "H1", "batch-3", 1.6, mtime=T0 + 60)
+        touch(root, "H1", mtime=T0 + 60)
+        backend.reset()
+        records = scanner.scan()
+        assert backend.listed == ["", "H1"]
+        assert folders(backend.read) == [os.path.join("H1", "batch-3"), os.path.join("H1", "batch-4.5")]
+        assert ("H1", 1.6, 3.0) in [(r["M_hole_id"], r["M_from"], r["M_to"]) for r in records]
+
+        # full=True ignores the manifest
+        backend.reset()
+        scanner.scan(full=True)
+        assert len(backend.read) == 4
+
+
+def test_batch_without_depth_file_is_read_again():
+    with tempfile.TemporaryDirectory() as root:
+        write_batch(root, "H1", "batch-1.5", 0)
+        write_batch(root, "H1", "batch-3")  # depth.txt not written yet
+        touch(root, "H1", mtime=T0)
+
+        backend = CountingBackend(root)
+        scanner = OrexploreScanner(backend, "", depth_record)
+        assert len(scanner.scan()) == 1
+
+        # The hole's LastWriteTime did not move, but batch-3 is not settled yet
+        backend.reset()
+        scanner.scan()
+        assert backend.listed == ["", "H1"] and backend.read == []
+
+        # depth.txt appears: batch-3's LastWriteTime moves and it is read
+        write_batch(root, "H1", "batch-3", 1.5, mtime=T0 + 60)
+        backend.reset()
+        assert len(scanner.scan()) == 2
+        assert folders(backend.read) == [os.path.join("H1", "batch-3")]
+
+        # Settled now: nothing is listed below the base directory
+        backend.reset()
+        scanner.scan()
+        assert backend.listed == [""]
+
+
+if __name__ == "__main__":
+    test_unchanged_last_write_time_skips_the_folder()
+    test_batch_without_depth_file_is_read_again()
+    print("✓ scanner manifest: unchanged LastWriteTime skipped, changed or unsettled folders read again")
+    sys.exit(0)